@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caja', '0002_alter_cajadiaria_fecha_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cajadiaria',
+            index=models.Index(fields=['estado', '-fecha'], name='caja_estado_fecha'),
+        ),
+    ]
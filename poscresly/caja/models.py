@@ -19,6 +19,10 @@ class CajaDiaria(models.Model):
         verbose_name = 'Caja Diaria'
         verbose_name_plural = 'Cajas Diarias'
         ordering = ['-fecha']
+        indexes = [
+            # Caja abierta (en cada pedido y en la vista de caja)
+            models.Index(fields=['estado', '-fecha'], name='caja_estado_fecha'),
+        ]
 
     def __str__(self):
         return f"Caja {self.fecha} - {self.estado.title()}"
@@ -0,0 +1,31 @@
+"""
+Totales de la caja abierta para la pantalla de caja (tema 'caja' del WebSocket).
+
+Salen de total_ventas de CajaEfectivo/CajaTransferencia, que se suman con F()
+al completar pedidos (pedidos.views.sumar_ventas_caja): una sola consulta.
+"""
+from .models import CajaDiaria
+
+
+def resumen_caja():
+    """
+    {'abierta': False} sin caja abierta; si no, id, fecha, montos iniciales y
+    ventas por forma de pago (números, para poder enviarlos por el WebSocket).
+    """
+    caja = (
+        CajaDiaria.objects.filter(estado='abierta')
+        .select_related('caja_efectivo', 'caja_transferencia')
+        .first()
+    )
+    if not caja:
+        return {'abierta': False}
+
+    resumen = {'abierta': True, 'caja_id': caja.id, 'fecha': caja.fecha.isoformat()}
+    for forma_pago, relacion in (('efectivo', 'caja_efectivo'), ('transferencia', 'caja_transferencia')):
+        detalle = getattr(caja, relacion, None)
+        resumen[forma_pago] = {
+            'monto_inicial': float(detalle.monto_inicial) if detalle else 0.0,
+            'total_ventas': float(detalle.total_ventas) if detalle else 0.0,
+        }
+    resumen['total_ventas'] = resumen['efectivo']['total_ventas'] + resumen['transferencia']['total_ventas']
+    return resumen
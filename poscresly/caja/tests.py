@@ -1,3 +1,58 @@
+from datetime import date
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from caja.models import CajaDiaria, CajaEfectivo, CajaTransferencia
+from pedidos.lineas import crear_lineas_pedido
+from pedidos.models import Pedido
+from pedidos.tests import MenuDelDiaMixin
+
+
+class DashboardCajaTests(MenuDelDiaMixin, TestCase):
+
+    def setUp(self):
+        caja = CajaDiaria.objects.create(fecha=date.today(), estado='abierta')
+        CajaEfectivo.objects.create(caja_diaria=caja, monto_inicial=0)
+        CajaTransferencia.objects.create(caja_diaria=caja, monto_inicial=0)
+
+    def completar(self, cantidad):
+        for _ in range(cantidad):
+            pedido = Pedido.objects.create(tipo='Llevar', estado='completado')
+            crear_lineas_pedido(pedido, self.carrito(2))
+
+    def consultas(self):
+        with CaptureQueriesContext(connection) as ctx:
+            respuesta = self.client.get('/caja/')
+        self.assertEqual(respuesta.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_consultas_no_crecen_con_los_pedidos(self):
+        self.completar(1)
+        pocos = self.consultas()
+        self.completar(6)
+        self.assertEqual(self.consultas(), pocos)
+
+
+class CajaTiempoRealTests(TestCase):
+
+    def test_abrir_y_cerrar_avisan_al_tema_caja(self):
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+        from pedidos.temas import TEMAS
+
+        capa = get_channel_layer()
+        canal = async_to_sync(capa.new_channel)()
+        async_to_sync(capa.group_add)(TEMAS['caja'], canal)
+
+        self.client.post('/caja/abrir/', {'monto_inicial_efectivo': '20', 'monto_inicial_transferencia': '0'})
+        abierta = async_to_sync(capa.receive)(canal)
+        self.client.post('/caja/cerrar/', {'monto_final_efectivo': '20'})
+        cerrada = async_to_sync(capa.receive)(canal)
+        async_to_sync(capa.group_discard)(TEMAS['caja'], canal)
 
-# Create your tests here.
+        self.assertEqual(abierta['type'], 'caja_actualizada')
+        self.assertTrue(abierta['caja']['abierta'])
+        self.assertEqual(abierta['caja']['efectivo'], {'monto_inicial': 20.0, 'total_ventas': 0.0})
+        self.assertEqual(cerrada['caja'], {'abierta': False})
@@ -6,8 +6,9 @@ from django.views.decorators.http import require_http_methods
 from django.utils import timezone
 from datetime import date
 from .models import CajaDiaria, CajaEfectivo, CajaTransferencia, Gasto
-from pedidos.models import Pedido
-from pedidos.views import obtener_productos_pedido
+from pedidos.models import Pedido, PedidoItem
+from pedidos.serializadores import con_lineas, obtener_productos_pedido
+from pedidos.temas import enviar_caja
 from menu.models import MenuDia
 from collections import defaultdict
 
@@ -32,10 +33,11 @@ def dashboard_caja(request):
     else:
         # Solo calcular si hay caja abierta
         # Obtener pedidos completados DESDE QUE SE ABRIÓ LA CAJA (no todo el día)
-        pedidos_hoy = Pedido.objects.filter(
+        # con_lineas: productos y platos precargados en consultas fijas
+        pedidos_hoy = con_lineas(Pedido.objects.filter(
             fecha_creacion__gte=caja_actual.fecha_apertura,
             estado='completado'
-        ).order_by('-fecha_creacion')
+        ).order_by('-fecha_creacion'))
         
         # Calcular totales REALES desde los pedidos completados del día
         total_efectivo = 0
@@ -91,35 +93,17 @@ def dashboard_caja(request):
     
     # Solo analizar productos si hay caja abierta
     if caja_actual and menu_hoy:
-        # Analizar almuerzos vendidos
+        # Analizar sopas y segundos vendidos (sueltos o dentro de un almuerzo)
+        # desde las líneas ya precargadas por con_lineas
         for pedido in pedidos_hoy:
-            for almuerzo in pedido.almuerzos.all():
-                sopa_nombre = almuerzo.sopa.sopa.nombre_plato
-                segundo_nombre = almuerzo.segundo.segundo.nombre_plato
-                
-                # Contar sopa
-                productos_vendidos[sopa_nombre]['cantidad'] += almuerzo.cantidad
-                productos_vendidos[sopa_nombre]['total_ventas'] += almuerzo.precio_unitario * almuerzo.cantidad
-                productos_vendidos[sopa_nombre]['tipo'] = 'Sopa'
-                
-                # Contar segundo
-                productos_vendidos[segundo_nombre]['cantidad'] += almuerzo.cantidad
-                productos_vendidos[segundo_nombre]['total_ventas'] += almuerzo.precio_unitario * almuerzo.cantidad
-                productos_vendidos[segundo_nombre]['tipo'] = 'Segundo'
-            
-            # Analizar sopas vendidas individualmente
-            for sopa in pedido.sopas.all():
-                sopa_nombre = sopa.sopa.sopa.nombre_plato
-                productos_vendidos[sopa_nombre]['cantidad'] += sopa.cantidad
-                productos_vendidos[sopa_nombre]['total_ventas'] += sopa.precio_unitario * sopa.cantidad
-                productos_vendidos[sopa_nombre]['tipo'] = 'Sopa'
-            
-            # Analizar segundos vendidos individualmente
-            for segundo in pedido.segundos.all():
-                segundo_nombre = segundo.segundo.segundo.nombre_plato
-                productos_vendidos[segundo_nombre]['cantidad'] += segundo.cantidad
-                productos_vendidos[segundo_nombre]['total_ventas'] += segundo.precio_unitario * segundo.cantidad
-                productos_vendidos[segundo_nombre]['tipo'] = 'Segundo'
+            for linea in pedido.items.all():
+                for componente in ('sopa', 'segundo'):
+                    if componente not in PedidoItem.COMPONENTES[linea.tipo]:
+                        continue
+                    nombre = getattr(getattr(linea, componente), componente).nombre_plato
+                    productos_vendidos[nombre]['cantidad'] += linea.cantidad
+                    productos_vendidos[nombre]['total_ventas'] += linea.precio_unitario * linea.cantidad
+                    productos_vendidos[nombre]['tipo'] = componente.capitalize()
     
     # Convertir a lista ordenada por cantidad vendida
     productos_ordenados = sorted(
@@ -246,6 +230,9 @@ def abrir_caja(request):
             monto_inicial=monto_inicial_transferencia
         )
         
+        # Avisar a las pantallas suscritas al tema 'caja'
+        enviar_caja()
+        
         return JsonResponse({
             'success': True,
             'message': 'Caja abierta exitosamente',
@@ -318,6 +305,8 @@ def cerrar_caja(request):
             caja_abierta.observaciones += f"\nCierre: {observaciones_cierre}"
         caja_abierta.save()
         
+        enviar_caja()
+        
         return JsonResponse({
             'success': True,
             'message': 'Caja cerrada exitosamente',
@@ -1,3 +1,83 @@
+import json
+import re
+from datetime import date
+from decimal import Decimal
+
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from menu.models import MenuDia, MenuDiaSopa, MenuDiaSegundo, MenuDiaJugo, Plato
+from pedidos.models import Pedido
+
+
+class InicioTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        menu = MenuDia.objects.create(fecha=date.today())
+        for i in range(2):
+            MenuDiaSopa.objects.create(menu=menu, sopa=Plato.objects.create(nombre_plato=f'Sopa {i}', tipo='sopa'), cantidad=20)
+            MenuDiaSegundo.objects.create(menu=menu, segundo=Plato.objects.create(nombre_plato=f'Segundo {i}', tipo='segundo'), cantidad=20)
+        MenuDiaJugo.objects.create(menu=menu, jugo=Plato.objects.create(nombre_plato='Jugo', tipo='jugo'))
+        Plato.objects.create(nombre_plato='Huevo', tipo='extra', precio=Decimal('0.50'))
+        for tipo in ('Servirse', 'Servirse', 'Llevar', 'Reservado'):
+            Pedido.objects.create(tipo=tipo, total=Decimal('3.50'))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_presupuesto_de_consultas(self):
+        self.client.get('/')
+        # Menú del día, 3 formularios del menú (sopas, segundos, jugos) y pedidos pendientes;
+        # las plantillas del menú, los precios y las opciones de los selects salen de la caché
+        with self.assertNumQueries(5):
+            respuesta = self.client.get('/')
+        self.assertContains(respuesta, '<span class="badge badge-servirse ms-1" id="contador-servirse">2</span>', html=True)
+        self.assertContains(respuesta, '<span class="badge badge-todos ms-1" id="contador-todos">4</span>', html=True)
+        self.assertContains(respuesta, 'Huevo')
+        self.assertContains(respuesta, '"Huevo": 0.5')
+
+    def stock_inicial(self, respuesta):
+        return json.loads(re.search(
+            r'<script id="stock-inicial" type="application/json">(.*?)</script>', respuesta.content.decode()
+        ).group(1))
+
+    def test_vender_no_invalida_el_fragmento(self):
+        from pedidos.versiones import version_menu
+        from pedidos.views import actualizar_cantidades_menu
+
+        self.client.get('/')
+        version = version_menu()
+        sopa = MenuDiaSopa.objects.first()
+        actualizar_cantidades_menu([{'tipo': 'Sopa', 'sopa_id': sopa.sopa_id, 'cantidad': 3}], 'restar')
+        self.assertEqual(version_menu(), version)
+        # Las cantidades van fuera del fragmento
+        self.assertEqual(self.stock_inicial(self.client.get('/'))['sopas'][str(sopa.id)], 17)
+
+    def test_fragmento_se_renueva_al_configurar_el_menu(self):
+        self.assertContains(self.client.get('/'), 'data-configurada="20"')
+        sopa = MenuDiaSopa.objects.first()
+        sopa.cantidad = 30
+        sopa.cantidad_actual = 30
+        sopa.save()
+        respuesta = self.client.get('/')
+        self.assertContains(respuesta, 'data-configurada="30"')
+        self.assertEqual(self.stock_inicial(respuesta)['sopas'][str(sopa.id)], 30)
+
+    def test_agua_se_agrega_una_vez(self):
+        self.client.get('/')
+        self.assertTrue(MenuDiaJugo.objects.filter(jugo__nombre_plato='Agua').exists())
+
+    def test_total_calculado_sin_extras(self):
+        from pedidos.models import PedidoItem
+
+        pedido = Pedido.objects.create(tipo='Llevar', total=Decimal('8.00'))
+        PedidoItem.objects.create(pedido=pedido, tipo='Almuerzo', cantidad=2, precio_unitario=Decimal('3.00'),
+                                  sopa=MenuDiaSopa.objects.first(), segundo=MenuDiaSegundo.objects.first())
+        PedidoItem.objects.create(pedido=pedido, tipo='Extra', cantidad=4, precio_unitario=Decimal('0.50'),
+                                  extra=Plato.objects.get(nombre_plato='Huevo'))
+
+        totales = {p.id: p.total_calculado for p in self.client.get('/').context['pedidos_llevar']}
+        self.assertEqual(totales[pedido.id], Decimal('6.00'))
+        # Sin líneas, cero
+        self.assertEqual(totales[Pedido.objects.get(tipo='Llevar', total=Decimal('3.50')).id], Decimal('0.00'))
@@ -7,6 +7,7 @@ urlpatterns = [
     path('menu/', views.menu, name='menu'),
     path('agregar-al-carrito/', pedidos_views.agregar_al_carrito, name='agregar_al_carrito'),
     path('guardar-pedido/', pedidos_views.guardar_pedido, name='guardar_pedido'),
+    path('v2/guardar-pedido/', pedidos_views.guardar_pedido_v2, name='guardar_pedido_v2'),
     path('marcar-completado/', pedidos_views.marcar_pedido_completado, name='marcar_pedido_completado'),
     path('obtener-pedido/<int:pedido_id>/', pedidos_views.obtener_pedido, name='obtener_pedido'),
     path('obtener-pedidos-pendientes/', pedidos_views.obtener_pedidos_pendientes, name='obtener_pedidos_pendientes'),
@@ -20,4 +21,7 @@ urlpatterns = [
     
     # URL para obtener contadores de tabs
     path('obtener-contadores-tabs/', pedidos_views.obtener_contadores_tabs, name='obtener_contadores_tabs'),
+
+    # Estado de la cola de tickets de cocina
+    path('estado-cola-impresion/', pedidos_views.estado_cola_impresion, name='estado_cola_impresion'),
 ]
@@ -1,14 +1,22 @@
+from django.core.cache import cache
+from django.db.models import DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
 from django.shortcuts import render, redirect
 from datetime import date
+from functools import partial
 from .forms import MenuDiaForm, MenuDiaSopaForm, MenuDiaSegundoForm, MenuDiaJugoForm
-from menu.models import MenuDia, MenuDiaSopa, MenuDiaSegundo, MenuDiaJugo, MenuDiaExtra, Producto, Plato
+from menu.catalogo import obtener_catalogo
+from menu.models import MenuDia, MenuDiaSopa, MenuDiaSegundo, MenuDiaJugo, MenuDiaExtra, Plato
+from menu.stock import stock_compacto
 from pedidos.models import Pedido
+from pedidos.versiones import version_menu
 
 import json
 from django.core.serializers.json import DjangoJSONEncoder
 from decimal import Decimal
 
 WATER_JUGO_NAME = 'Agua'
+TTL_AGUA = 60 * 60 * 24
 
 
 def asegurar_jugo_agua(menu):
@@ -20,6 +28,34 @@ def asegurar_jugo_agua(menu):
     MenuDiaJugo.objects.get_or_create(menu=menu, jugo=agua_plato)
     return agua_plato
 
+
+def asegurar_jugo_agua_una_vez(menu):
+    """
+    asegurar_jugo_agua solo la primera vez por menú: el agua no se puede quitar
+    del menú desde el formulario, así que basta con una marca en la caché.
+    """
+    clave = f'menu:agua:{menu.pk}'
+    if not cache.get(clave):
+        asegurar_jugo_agua(menu)
+        cache.set(clave, True, TTL_AGUA)
+
+
+def precios_json(catalogo):
+    """Precios de productos (servirse/llevar) y extras en JSON para el frontend"""
+    precios = {}
+    for producto in catalogo.productos():
+        tipo = producto.nombre_producto.lower()  # 'almuerzo', 'sopa', 'segundo'
+        precios[tipo] = {
+            'Servirse': float(producto.precio_servirse),
+            'Llevar': float(producto.precio_llevar)
+        }
+
+    # Agregar precios de extras (precio único, no diferencia servirse/llevar)
+    precios['extra'] = {}
+    for extra in catalogo.platos_por_tipo('extra'):
+        precios['extra'][extra.nombre_plato] = float(extra.precio)
+    return json.dumps(precios, cls=DjangoJSONEncoder)
+
 def crear_formularios_menu(menu, data=None):
     """
     Función helper para crear formularios del menú con o sin datos POST
@@ -53,6 +89,21 @@ def crear_formularios_menu(menu, data=None):
     
     return sopa_forms, segundo_forms, jugo_forms
 
+def opciones_desde_catalogo(forms_por_campo):
+    """
+    Opciones de los selects de platos desde el catálogo en memoria, en lugar de
+    una consulta por formulario (la validación sigue usando el queryset).
+
+    forms_por_campo: [(formularios, campo)]; el campo es también el tipo de plato.
+    """
+    catalogo = obtener_catalogo()
+    for forms, campo in forms_por_campo:
+        opciones = [('', '---------')] + [
+            (plato.pk, str(plato)) for plato in catalogo.platos_por_tipo(campo)
+        ]
+        for form in forms:
+            form.fields[campo].choices = opciones
+
 def menu(request):
     """
     Vista para mostrar la página del menú del día
@@ -136,8 +187,8 @@ def menu(request):
 def inicio(request):
     hoy = date.today()
     menu, _ = MenuDia.objects.get_or_create(fecha=hoy)
-    agua_plato = asegurar_jugo_agua(menu)
     if request.method == 'POST':
+        agua_plato = asegurar_jugo_agua(menu)
         form_postre = MenuDiaForm(request.POST, instance=menu)
         sopa_forms, segundo_forms, jugo_forms = crear_formularios_menu(menu, request.POST)
 
@@ -187,69 +238,52 @@ def inicio(request):
             return redirect('inicio')
 
     else:
+        asegurar_jugo_agua_una_vez(menu)
         form_postre = MenuDiaForm(instance=menu)
         sopa_forms, segundo_forms, jugo_forms = crear_formularios_menu(menu)
+        opciones_desde_catalogo([
+            ([form_postre], 'postre'), (sopa_forms, 'sopa'), (segundo_forms, 'segundo'), (jugo_forms, 'jugo'),
+        ])
 
-    # -------- Diccionario de precios --------
-    precios = {}
-    for producto in Producto.objects.all():
-        tipo = producto.nombre_producto.lower()  # 'almuerzo', 'sopa', 'segundo'
-        precios[tipo] = {
-            'Servirse': float(producto.precio_servirse),
-            'Llevar': float(producto.precio_llevar)
-        }
-    
-    # Agregar precios de extras (precio único, no diferencia servirse/llevar)
-    from menu.models import Plato
-    extras = Plato.objects.filter(tipo='extra')
-    precios['extra'] = {}
-    for extra in extras:
-        precios['extra'][extra.nombre_plato] = float(extra.precio)
-
-    # -------- Cargar pedidos pendientes por categoría --------
-    pedidos_todos = Pedido.objects.filter(estado='pendiente').prefetch_related(
-        'almuerzos__sopa', 'almuerzos__segundo', 'almuerzos__jugo',
-        'sopas__sopa', 'sopas__jugo',
-        'segundos__segundo', 'segundos__jugo'
-    ).order_by('-fecha_creacion')
+    catalogo = obtener_catalogo()
 
-    pedidos_servirse = pedidos_todos.filter(tipo='Servirse')
-    pedidos_llevar = pedidos_todos.filter(tipo='Llevar')
-    pedidos_reservados = pedidos_todos.filter(tipo='Reservado')
-
-    # Calcular totales para cada pedido
+    # -------- Pedidos pendientes: una consulta, separados por tipo en memoria --------
+    # total_calculado: almuerzos, sopas y segundos, sin extras (a diferencia de
+    # pedido.total), sumado en la misma consulta
+    pedidos_todos = list(
+        Pedido.objects.filter(estado='pendiente')
+        .annotate(total_calculado=Coalesce(
+            Sum(F('items__precio_unitario') * F('items__cantidad'), filter=~Q(items__tipo='Extra')),
+            Value(Decimal('0.00')),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        ))
+        .order_by('-fecha_creacion')
+    )
+    pedidos_por_tipo = {'Servirse': [], 'Llevar': [], 'Reservado': []}
     for pedido in pedidos_todos:
-        total_calculado = Decimal('0.00')
-        
-        # Sumar almuerzos
-        for almuerzo in pedido.almuerzos.all():
-            total_calculado += almuerzo.precio_unitario * Decimal(str(almuerzo.cantidad))
-        
-        # Sumar sopas
-        for sopa in pedido.sopas.all():
-            total_calculado += sopa.precio_unitario * Decimal(str(sopa.cantidad))
-        
-        # Sumar segundos
-        for segundo in pedido.segundos.all():
-            total_calculado += segundo.precio_unitario * Decimal(str(segundo.cantidad))
-        
-        pedido.total_calculado = total_calculado
+        pedidos_por_tipo.setdefault(pedido.tipo, []).append(pedido)
 
+    # Las plantillas del menú y los precios salen del caché de fragmentos
+    # (clave version_menu, que no cambia al vender); los querysets y
+    # precios_json solo se evalúan si el fragmento no está en la caché. Las
+    # cantidades van aparte (stock_inicial) y las pinta el navegador
     context = {
         'form_postre': form_postre,
         'sopa_forms': sopa_forms,
         'segundo_forms': segundo_forms,
         'jugo_forms': jugo_forms,
-        'sopas_dia': MenuDiaSopa.objects.filter(menu=menu),
-        'segundos_dia': MenuDiaSegundo.objects.filter(menu=menu),
-        'jugos_dia': MenuDiaJugo.objects.filter(menu=menu),
-        'extras_dia': Plato.objects.filter(tipo='extra'),  # Mostrar TODOS los extras siempre
+        'sopas_dia': MenuDiaSopa.objects.filter(menu=menu).select_related('sopa'),
+        'segundos_dia': MenuDiaSegundo.objects.filter(menu=menu).select_related('segundo'),
+        'jugos_dia': MenuDiaJugo.objects.filter(menu=menu).select_related('jugo'),
+        'extras_dia': catalogo.platos_por_tipo('extra'),  # Mostrar TODOS los extras siempre
         'mesas': range(1, 16),
-        'precios': json.dumps(precios, cls=DjangoJSONEncoder),  # Convierte el diccionario Python precios a formato JSON 
+        'precios': partial(precios_json, catalogo),
+        'version_menu': version_menu(),
+        'stock_inicial': stock_compacto(),
         'pedidos_todos': pedidos_todos,
-        'pedidos_servirse': pedidos_servirse,
-        'pedidos_llevar': pedidos_llevar,
-        'pedidos_reservados': pedidos_reservados,
+        'pedidos_servirse': pedidos_por_tipo['Servirse'],
+        'pedidos_llevar': pedidos_por_tipo['Llevar'],
+        'pedidos_reservados': pedidos_por_tipo['Reservado'],
     }
 
     return render(request, 'inicio/inicio.html', context)
@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class MenuConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'menu'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from .catalogo import invalidar_catalogo
+        from .models import MenuDia, MenuDiaSopa, MenuDiaSegundo, MenuDiaJugo, MenuDiaExtra, Plato, Producto
+        from .stock import invalidar_menu
+
+        for modelo in (Plato, Producto):
+            post_save.connect(invalidar_catalogo, sender=modelo, dispatch_uid=f'catalogo_{modelo.__name__}_save')
+            post_delete.connect(invalidar_catalogo, sender=modelo, dispatch_uid=f'catalogo_{modelo.__name__}_delete')
+
+        for modelo in (MenuDia, MenuDiaSopa, MenuDiaSegundo, MenuDiaJugo, MenuDiaExtra):
+            post_save.connect(invalidar_menu, sender=modelo, dispatch_uid=f'stock_{modelo.__name__}_save')
+            post_delete.connect(invalidar_menu, sender=modelo, dispatch_uid=f'stock_{modelo.__name__}_delete')
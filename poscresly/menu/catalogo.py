@@ -0,0 +1,94 @@
+"""
+Catálogo en memoria de Plato y Producto.
+
+Los platos y los precios cambian muy poco durante el día pero se leen en cada
+pedido. Cada proceso guarda una copia del catálogo y la reconstruye solo cuando
+cambia la versión, un contador compartido en la caché que las señales
+post_save/post_delete de Plato y Producto incrementan (ver apps.py).
+"""
+import threading
+
+from poscresly.versiones import ContadorVersion
+from .models import Plato, Producto
+
+CLAVE_VERSION = 'catalogo:version'
+
+_version = ContadorVersion(CLAVE_VERSION)
+
+
+def version_catalogo():
+    return _version.actual()
+
+
+def invalidar_catalogo(**kwargs):
+    """Receptor de señales: incrementa la versión del catálogo."""
+    _version.invalidar()
+
+
+class Catalogo:
+    """Copia de solo lectura de Plato y Producto con búsquedas por id, tipo y nombre."""
+
+    def __init__(self, version, platos, productos):
+        self.version = version
+        self._platos = {plato.id: plato for plato in platos}
+        self._por_tipo = {}
+        self._por_nombre = {}
+        for plato in self._platos.values():
+            self._por_tipo.setdefault(plato.tipo, []).append(plato)
+            self._por_nombre.setdefault((plato.tipo, plato.nombre_plato.lower()), plato)
+        self._productos = {producto.nombre_producto.lower(): producto for producto in productos}
+
+    def plato(self, plato_id, tipo=None):
+        plato = self._platos.get(plato_id)
+        if plato is not None and tipo is not None and plato.tipo != tipo:
+            return None
+        return plato
+
+    def platos(self, ids, tipo=None):
+        """{id: Plato} para los ids encontrados (como in_bulk)."""
+        encontrados = {}
+        for plato_id in ids:
+            plato = self.plato(plato_id, tipo)
+            if plato is not None:
+                encontrados[plato_id] = plato
+        return encontrados
+
+    def platos_por_tipo(self, tipo):
+        return list(self._por_tipo.get(tipo, []))
+
+    def plato_por_nombre(self, nombre, tipo):
+        return self._por_nombre.get((tipo, nombre.lower()))
+
+    def producto(self, nombre):
+        """Producto por nombre ('Almuerzo', 'sopa', ...); Producto.DoesNotExist si no existe."""
+        try:
+            return self._productos[nombre.lower()]
+        except KeyError:
+            raise Producto.DoesNotExist(f"No existe el producto '{nombre}'")
+
+    def productos(self):
+        return list(self._productos.values())
+
+
+_lock = threading.Lock()
+_compartido = None
+
+
+def obtener_catalogo():
+    """
+    Catálogo vigente. Solo consulta la base cuando la versión cambió.
+    """
+    global _compartido
+    version = version_catalogo()
+    catalogo = _compartido
+    if catalogo is None or catalogo.version != version:
+        with _lock:
+            catalogo = _compartido
+            if catalogo is None or catalogo.version != version:
+                catalogo = Catalogo(
+                    version,
+                    Plato.objects.order_by('id'),
+                    Producto.objects.order_by('id'),
+                )
+                _compartido = catalogo
+    return catalogo
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('menu', '0012_plato_precio'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='menudiasegundo',
+            index=models.Index(fields=['menu', 'segundo'], name='menudiasegundo_menu_segundo'),
+        ),
+        migrations.AddIndex(
+            model_name='menudiasopa',
+            index=models.Index(fields=['menu', 'sopa'], name='menudiasopa_menu_sopa'),
+        ),
+    ]
@@ -54,6 +54,12 @@ class MenuDiaSopa(models.Model):
     cantidad = models.PositiveIntegerField(default=0)
     cantidad_actual = models.PositiveIntegerField(default=0)  # Cantidad disponible actual
 
+    class Meta:
+        indexes = [
+            # Actualización de stock: menú del día + plato
+            models.Index(fields=['menu', 'sopa'], name='menudiasopa_menu_sopa'),
+        ]
+
     def __str__(self):
         return f"{self.sopa} para {self.menu.fecha}"
     
@@ -70,6 +76,12 @@ class MenuDiaSegundo(models.Model):
     cantidad = models.PositiveIntegerField(default=0)
     cantidad_actual = models.PositiveIntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            # Actualización de stock: menú del día + plato
+            models.Index(fields=['menu', 'segundo'], name='menudiasegundo_menu_segundo'),
+        ]
+
     def __str__(self):
         return f"{self.segundo} para {self.menu.fecha}"
     
@@ -0,0 +1,102 @@
+"""
+Stock del menú del día (sopas y segundos con sus cantidades).
+
+Lo leen las tablets al conectarse y las pantallas del menú, pero solo
+cambia al vender, anular o configurar el menú. La foto del stock se guarda en
+la caché bajo una versión que incrementan actualizar_cantidades_menu (UPDATE
+en lote, sin señales) y las señales post_save/post_delete de MenuDia,
+MenuDiaSopa, MenuDiaSegundo, MenuDiaJugo y MenuDiaExtra (ver apps.py).
+Los nombres de los platos salen del catálogo en memoria, así que la clave
+también incluye la versión del catálogo.
+
+Las señales incrementan además la versión de la configuración del menú (qué
+platos hay y cuántos se configuraron), que no cambia al vender: con ella se
+cachea lo que no depende de las cantidades (ver pedidos.versiones.version_menu).
+"""
+from datetime import date
+
+from django.core.cache import cache
+
+from poscresly.versiones import ContadorVersion
+from .catalogo import obtener_catalogo
+from .models import MenuDiaSopa, MenuDiaSegundo
+
+CLAVE_VERSION = 'menu:stock:version'
+CLAVE_VERSION_CONFIGURACION = 'menu:configuracion:version'
+TTL_STOCK = 60 * 60 * 24
+
+_version = ContadorVersion(CLAVE_VERSION)
+_version_configuracion = ContadorVersion(CLAVE_VERSION_CONFIGURACION)
+
+
+def version_stock():
+    return _version.actual()
+
+
+def version_configuracion():
+    return _version_configuracion.actual()
+
+
+def invalidar_stock(**kwargs):
+    """Incrementa la versión del stock (llamada directa al vender o anular)."""
+    _version.invalidar()
+
+
+def invalidar_menu(**kwargs):
+    """Receptor de señales del menú del día: cambia la configuración y el stock."""
+    _version.invalidar()
+    _version_configuracion.invalidar()
+
+
+def _filas(modelo, campo, hoy, catalogo):
+    filas = []
+    consulta = (
+        modelo.objects.filter(menu__fecha=hoy)
+        .order_by('id')
+        .values_list('id', f'{campo}_id', 'cantidad', 'cantidad_actual')
+    )
+    for fila_id, plato_id, cantidad, cantidad_actual in consulta:
+        plato = catalogo.plato(plato_id)
+        filas.append({
+            'id': fila_id,
+            'plato_id': plato_id,
+            'nombre': plato.nombre_plato if plato else '',
+            'cantidad_configurada': cantidad,
+            'cantidad_actual': cantidad_actual,
+            'cantidad_vendida': cantidad - cantidad_actual,
+        })
+    return filas
+
+
+def obtener_stock():
+    """
+    Stock del menú de hoy: {'version', 'fecha', 'sopas': [...], 'segundos': [...]}.
+
+    Cada fila: id (MenuDiaSopa/MenuDiaSegundo), plato_id, nombre,
+    cantidad_configurada, cantidad_actual y cantidad_vendida. Si no hay menú
+    para hoy las listas quedan vacías. Con la caché vigente no hay consultas.
+    """
+    hoy = date.today().isoformat()
+    version = version_stock()
+    catalogo = obtener_catalogo()
+    clave = f'menu:stock:{version}:{catalogo.version}:{hoy}'
+    stock = cache.get(clave)
+    if stock is None:
+        stock = {
+            'version': version,
+            'fecha': hoy,
+            'sopas': _filas(MenuDiaSopa, 'sopa', hoy, catalogo),
+            'segundos': _filas(MenuDiaSegundo, 'segundo', hoy, catalogo),
+        }
+        cache.set(clave, stock, TTL_STOCK)
+    return stock
+
+
+def stock_compacto():
+    """Stock completo en el formato de 'stock_actualizado': versión y {id: cantidad_actual} por tabla"""
+    stock = obtener_stock()
+    return {
+        'version': stock['version'],
+        'sopas': {fila['id']: fila['cantidad_actual'] for fila in stock['sopas']},
+        'segundos': {fila['id']: fila['cantidad_actual'] for fila in stock['segundos']},
+    }
@@ -1,3 +1,90 @@
+from datetime import date
+from decimal import Decimal
+
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from .catalogo import obtener_catalogo
+from .models import MenuDia, MenuDiaSopa, MenuDiaSegundo, Plato, Producto
+from .stock import obtener_stock
+
+
+class CatalogoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.extra = Plato.objects.create(nombre_plato='Huevo', tipo='extra', precio=Decimal('0.75'))
+        cls.sopa = Plato.objects.create(nombre_plato='Locro', tipo='sopa')
+        Producto.objects.create(nombre_producto='almuerzo', precio_servirse=Decimal('3.50'),
+                                precio_llevar=Decimal('3.75'))
+
+    def test_busquedas_sin_consultas(self):
+        obtener_catalogo()
+        with self.assertNumQueries(0):
+            catalogo = obtener_catalogo()
+            self.assertEqual(catalogo.plato(self.extra.id).nombre_plato, 'Huevo')
+            self.assertIsNone(catalogo.plato(self.sopa.id, tipo='extra'))
+            self.assertEqual(catalogo.platos([self.extra.id, self.sopa.id], tipo='extra'), {self.extra.id: self.extra})
+            self.assertEqual(catalogo.platos_por_tipo('sopa'), [self.sopa])
+            self.assertEqual(catalogo.plato_por_nombre('locro', 'sopa'), self.sopa)
+            self.assertEqual(catalogo.producto('Almuerzo').precio_servirse, Decimal('3.50'))
+
+        with self.assertRaises(Producto.DoesNotExist):
+            catalogo.producto('postre')
+
+    def test_cambios_invalidan_el_catalogo(self):
+        cache.clear()
+        anterior = obtener_catalogo()
+        # Mismo contador que el stock y los eventos: valor inicial exacto en JavaScript
+        self.assertLess(anterior.version, 2 ** 53)
+
+        self.extra.precio = Decimal('1.00')
+        self.extra.save()
+        catalogo = obtener_catalogo()
+        self.assertGreater(catalogo.version, anterior.version)
+        self.assertEqual(catalogo.plato(self.extra.id).precio, Decimal('1.00'))
+
+        self.sopa.delete()
+        self.assertIsNone(obtener_catalogo().plato(self.sopa.id))
+
+
+class StockTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.menu = MenuDia.objects.create(fecha=date.today())
+        cls.sopas = [
+            MenuDiaSopa.objects.create(menu=cls.menu, sopa=Plato.objects.create(nombre_plato=f'Sopa {i}', tipo='sopa'),
+                                       cantidad=10)
+            for i in range(3)
+        ]
+        cls.segundo = MenuDiaSegundo.objects.create(
+            menu=cls.menu, segundo=Plato.objects.create(nombre_plato='Seco', tipo='segundo'), cantidad=5)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_una_consulta_por_tabla_y_luego_cache(self):
+        obtener_catalogo()
+        with self.assertNumQueries(2):
+            stock = obtener_stock()
+        self.assertEqual([fila['nombre'] for fila in stock['sopas']], ['Sopa 0', 'Sopa 1', 'Sopa 2'])
+        self.assertEqual(stock['segundos'][0]['cantidad_vendida'], 0)
+        with self.assertNumQueries(0):
+            self.assertEqual(obtener_stock(), stock)
+
+    def test_se_invalida_al_vender_y_al_configurar(self):
+        from pedidos.views import actualizar_cantidades_menu
+
+        obtener_stock()
+        actualizar_cantidades_menu([{'tipo': 'Sopa', 'sopa_id': self.sopas[0].sopa_id, 'cantidad': 3}], 'restar')
+        self.assertEqual(obtener_stock()['sopas'][0]['cantidad_actual'], 7)
+
+        self.segundo.cantidad = 8
+        self.segundo.save()
+        self.assertEqual(obtener_stock()['segundos'][0]['cantidad_configurada'], 8)
+
+    def test_sin_menu_de_hoy(self):
+        self.menu.delete()
+        stock = obtener_stock()
+        self.assertEqual((stock['sopas'], stock['segundos']), ([], []))
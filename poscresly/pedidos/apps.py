@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class PedidosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'pedidos'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from .cambios import registrar_eliminacion
+        from .models import Pedido
+        from .versiones import marcar_cambio_pedidos
+
+        post_delete.connect(registrar_eliminacion, sender=Pedido, dispatch_uid='cambios_pedido_delete')
+
+        # Versión de pedidos para los ETag (la del stock la lleva menu.stock)
+        post_save.connect(marcar_cambio_pedidos, sender=Pedido, dispatch_uid='version_pedido_save')
+        post_delete.connect(marcar_cambio_pedidos, sender=Pedido, dispatch_uid='version_pedido_delete')
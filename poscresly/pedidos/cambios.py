@@ -0,0 +1,164 @@
+"""
+Sincronización incremental de pedidos pendientes ("cambios desde la versión N").
+
+Cada Pedido guarda la versión global (VersionCambios) de su último cambio; las
+eliminaciones dejan un PedidoEliminado con su propia versión. Con eso una
+tablet que ya tiene la lista puede pedir solo lo que cambió: los pedidos
+pendientes nuevos o modificados y los ids que debe quitar (completados,
+eliminados o que pasaron a otro tipo).
+
+Tomar una versión bloquea la fila de VersionCambios hasta el commit. Las
+escrituras de pedidos usan transaccion_versionada(): durante la transacción
+solo se anota qué cambió y la versión se toma en la última sentencia, así el
+bloqueo dura lo que tarda el commit y no toda la transacción.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.functions import Greatest
+
+from .models import Pedido, PedidoEliminado, VersionCambios
+
+# Filtro de tipo de obtener_pedidos_por_tipo -> Pedido.tipo
+TIPOS_FILTRO = {
+    'servirse': 'Servirse',
+    'llevar': 'Llevar',
+    'reservados': 'Reservado',
+}
+
+
+# Fila de VersionCambios con la versión más alta de los PedidoEliminado purgados
+CLAVE_PURGA = 'eliminados_purgados'
+
+# Cambios anotados por la transaccion_versionada() en curso de cada hilo
+_en_curso = threading.local()
+
+
+@contextmanager
+def transaccion_versionada():
+    """
+    transaction.atomic() en el que los cambios de pedidos toman su versión al final.
+
+    Pedido.save(), registrar_eliminacion y quien llame a diferir_version()
+    dentro del bloque solo anotan lo que cambió; al salir sin errores se toma
+    una sola versión y se asigna con un UPDATE por tabla, justo antes del
+    commit. Los bloques anidados se suman al más externo.
+    """
+    if getattr(_en_curso, 'pendientes', None) is not None:
+        with transaction.atomic():
+            yield
+        return
+
+    pendientes = {'pedidos': [], 'ids': set(), 'eliminados': []}
+    with transaction.atomic():
+        _en_curso.pendientes = pendientes
+        try:
+            yield
+        finally:
+            _en_curso.pendientes = None
+        _asignar_version(pendientes)
+
+
+def diferir_version(pedidos=(), ids=(), eliminados=()):
+    """
+    Anota pedidos (instancias o ids) y PedidoEliminado para versionarlos al
+    final de la transaccion_versionada() en curso.
+
+    Returns:
+        bool: False fuera de una transaccion_versionada() (no se anota nada:
+              quien llama asigna la versión en el momento)
+    """
+    pendientes = getattr(_en_curso, 'pendientes', None)
+    if pendientes is None:
+        return False
+    pendientes['pedidos'].extend(pedidos)
+    pendientes['ids'].update(ids)
+    pendientes['eliminados'].extend(eliminados)
+    return True
+
+
+def _asignar_version(pendientes):
+    ids = pendientes['ids'] | {pedido.pk for pedido in pendientes['pedidos']}
+    if not ids and not pendientes['eliminados']:
+        return
+    version = VersionCambios.siguiente()
+    if ids:
+        Pedido.objects.filter(id__in=ids).update(version=version)
+    if pendientes['eliminados']:
+        PedidoEliminado.objects.filter(
+            id__in=[eliminado.pk for eliminado in pendientes['eliminados']]
+        ).update(version=version)
+    for instancia in pendientes['pedidos'] + pendientes['eliminados']:
+        instancia.version = version
+
+
+def registrar_eliminacion(sender, instance, **kwargs):
+    """Receptor post_delete de Pedido: deja constancia de la baja con una versión nueva."""
+    eliminado = PedidoEliminado(pedido_id=instance.pk, tipo=instance.tipo, version=0)
+    if not diferir_version(eliminados=[eliminado]):
+        eliminado.version = VersionCambios.siguiente()
+    eliminado.save()
+
+
+def purgar_eliminados(antes):
+    """
+    Borra los PedidoEliminado registrados antes de `antes` (datetime).
+
+    Guarda la versión más alta borrada: una consulta con una versión anterior
+    ya no puede saber todas las bajas y recibe la lista completa.
+
+    Returns:
+        int: cantidad de registros borrados
+    """
+    with transaction.atomic():
+        maxima = PedidoEliminado.objects.filter(fecha__lt=antes).aggregate(maxima=Max('version'))['maxima']
+        if maxima is None:
+            return 0
+        VersionCambios.objects.get_or_create(clave=CLAVE_PURGA)
+        VersionCambios.objects.filter(clave=CLAVE_PURGA).update(
+            ultima_version=Greatest('ultima_version', maxima)
+        )
+        borrados, _ = PedidoEliminado.objects.filter(version__lte=maxima).delete()
+    return borrados
+
+
+def cambios_desde(version, tipo='todos'):
+    """
+    Cambios en los pedidos pendientes (del tipo indicado) posteriores a `version`.
+
+    La versión actual se lee antes que los cambios: si algo se confirma en el
+    medio, llega ahora y otra vez en la siguiente consulta, pero nunca se pierde.
+
+    Returns:
+        dict: {'version': versión actual,
+               'pedidos': [Pedido pendientes nuevos o modificados],
+               'eliminados': [ids que ya no pertenecen a la lista]}
+        None si `version` es anterior a las bajas purgadas (ver purgar_eliminados):
+        hay que enviar la lista completa.
+    """
+    if version < VersionCambios.actual(CLAVE_PURGA):
+        return None
+
+    actual = VersionCambios.actual()
+    tipo_pedido = TIPOS_FILTRO.get(tipo)
+
+    pedidos = []
+    eliminados = []
+    # Se revisan todos los cambiados (no solo los pendientes del tipo) para
+    # poder quitar los que se completaron o cambiaron de tipo
+    for pedido in Pedido.objects.filter(version__gt=version).order_by('-fecha_creacion'):
+        if pedido.estado == 'pendiente' and (tipo_pedido is None or pedido.tipo == tipo_pedido):
+            pedidos.append(pedido)
+        else:
+            eliminados.append(pedido.id)
+        actual = max(actual, pedido.version)
+
+    for pedido_id, version_eliminado in (
+        PedidoEliminado.objects.filter(version__gt=version).values_list('pedido_id', 'version')
+    ):
+        eliminados.append(pedido_id)
+        actual = max(actual, version_eliminado)
+
+    return {'version': actual, 'pedidos': pedidos, 'eliminados': eliminados}
@@ -1,104 +1,228 @@
-import json
 import os
 from urllib.parse import parse_qs
 
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from .models import Pedido
+from .contadores import obtener_contadores
+from .eventos import eventos_desde
+from .formato_ws import LARGAS, codificar, decodificar, elegir_subprotocolo
+from .foto import foto_pendientes
+from .temas import TEMAS, TEMAS_PEDIDOS, mensaje_caja
+
+class FormatoMixin:
+    """
+    Formato de los frames de la conexión: msgpack abreviado si el cliente
+    ofrece el subprotocolo (ver formato_ws), si no texto JSON.
+    """
+    binario = False
+
+    async def aceptar(self):
+        subprotocolo = elegir_subprotocolo(self.scope.get('subprotocols'))
+        self.binario = subprotocolo is not None
+        await self.accept(subprotocolo)
+
+    async def enviar_mensaje(self, mensaje):
+        await self.enviar_codificado(codificar(mensaje, self.binario))
+
+    async def enviar_bienvenida(self, mensaje):
+        # Sin abreviar y con la tabla de claves, para que el cliente expanda el resto
+        if self.binario:
+            mensaje = {**mensaje, 'claves': LARGAS}
+        await self.enviar_codificado(codificar(mensaje, self.binario, abreviado=False))
+
+    async def enviar_codificado(self, contenido):
+        if self.binario:
+            await self.send(bytes_data=contenido)
+        else:
+            await self.send(text_data=contenido)
+
+
+class PedidosConsumer(FormatoMixin, AsyncWebsocketConsumer):
+    # Campos comunes que acompañan a cada evento (ver pedidos.publicador)
+    CAMPOS_EVENTO = ('contadores', 'version', 'seq')
 
-class PedidosConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        # Aceptar la conexión WebSocket
-        await self.accept()
+        # Aceptar la conexión WebSocket (JSON o msgpack, según el subprotocolo)
+        await self.aceptar()
         
-        # Unirse al grupo "pedidos" para recibir actualizaciones
-        await self.channel_layer.group_add("pedidos", self.channel_name)
+        # Unirse a los temas de la URL (?temas=llevar,caja); por defecto, al
+        # grupo "pedidos" completo (ver pedidos.temas)
+        self.temas = set()
+        temas = [tema for tema in self._get_temas() if tema in TEMAS] or ['pedidos']
+        for tema in temas:
+            await self.channel_layer.group_add(TEMAS[tema], self.channel_name)
+        self.temas.update(temas)
         
         # Enviar mensaje de confirmación
-        await self.send(text_data=json.dumps({
+        await self.enviar_bienvenida({
             'type': 'connection_established',
-            'message': 'Conectado al sistema de pedidos'
-        }))
+            'message': 'Conectado al sistema de pedidos',
+            'temas': sorted(self.temas),
+        })
+
+        if 'pedidos' in self.temas:
+            # Reconexión (?ultimo_seq=N): solo los eventos perdidos; si no están
+            # en el registro, o es la primera conexión, la foto de los pendientes
+            await self.enviar_desde(self._get_ultimo_seq())
+            await self.enviar_estado(self.temas)
+        else:
+            await self.enviar_estado(self.temas, foto=True)
 
     async def disconnect(self, close_code):
-        # Salir del grupo "pedidos"
-        await self.channel_layer.group_discard("pedidos", self.channel_name)
+        # Salir de los grupos de los temas
+        for tema in getattr(self, 'temas', ()):
+            await self.channel_layer.group_discard(TEMAS[tema], self.channel_name)
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            data = json.loads(text_data)
+            data = decodificar(text_data if text_data is not None else bytes_data)
             message_type = data.get('type')
             
             if message_type == 'get_pedidos':
-                # Obtener todos los pedidos y enviarlos
-                pedidos = await self.get_pedidos()
-                await self.send(text_data=json.dumps({
-                    'type': 'pedidos_data',
-                    'pedidos': pedidos
-                }))
+                # Reenviar la foto de los pedidos pendientes
+                await self.enviar_foto()
+            elif message_type == 'reanudar':
+                # Eventos posteriores al último que vio la tablet
+                await self.enviar_desde(data.get('ultimo_seq'))
+            elif message_type in ('suscribir', 'desuscribir'):
+                await self.cambiar_temas(message_type, data.get('temas'))
                 
-        except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
+        except (ValueError, AttributeError):
+            await self.enviar_mensaje({
                 'type': 'error',
                 'message': 'Formato de mensaje inválido'
-            }))
+            })
+
+    async def cambiar_temas(self, accion, temas):
+        if not isinstance(temas, list) or not temas:
+            error = 'Lista de temas requerida'
+        else:
+            desconocidos = [tema for tema in temas if tema not in TEMAS]
+            error = f'Temas desconocidos: {desconocidos}' if desconocidos else None
+        if error:
+            await self.enviar_mensaje({'type': 'error', 'message': error})
+            return
+
+        nuevos, foto = [], False
+        if accion == 'suscribir':
+            nuevos = [tema for tema in temas if tema not in self.temas]
+            for tema in nuevos:
+                await self.channel_layer.group_add(TEMAS[tema], self.channel_name)
+            # La foto solo si es el primer tema de pedidos de la conexión
+            foto = not any(tema in TEMAS_PEDIDOS for tema in self.temas)
+            self.temas.update(nuevos)
+        else:
+            for tema in temas:
+                if tema in self.temas:
+                    await self.channel_layer.group_discard(TEMAS[tema], self.channel_name)
+                    self.temas.discard(tema)
+
+        await self.enviar_mensaje({'type': 'suscripciones', 'temas': sorted(self.temas)})
+        if nuevos:
+            await self.enviar_estado(nuevos, foto=foto)
+
+    async def enviar_estado(self, temas, foto=False):
+        """Estado actual de los temas recién suscritos (la foto, si se pide y hay temas de pedidos)."""
+        if foto and any(tema in TEMAS_PEDIDOS for tema in temas):
+            await self.enviar_foto()
+            # La foto ya va seguida de los contadores
+            temas = [tema for tema in temas if tema != 'contadores']
+        for mensaje in await self.estado_temas(temas):
+            await getattr(self, mensaje['type'])(mensaje)
+
+    async def enviar_foto(self):
+        # La foto compartida no trae los contadores (pueden ir un paso detrás de
+        # la versión de datos): se leen al enviarla, después de la foto
+        await self.enviar_codificado(await self.get_pedidos())
+        contadores = await database_sync_to_async(obtener_contadores)()
+        await self.enviar_mensaje({'type': 'contadores_actualizados', 'contadores': contadores})
+
+    async def enviar_desde(self, ultimo_seq):
+        eventos = None
+        if isinstance(ultimo_seq, int):
+            eventos = await database_sync_to_async(eventos_desde)(ultimo_seq)
+        if eventos is None:
+            await self.enviar_foto()
+            return
+        for evento in eventos:
+            # Mismo formato que en vivo, marcado como reenviado
+            await getattr(self, evento['type'])({**evento, 'reenviado': True})
+
+    async def enviar_evento(self, event, **datos):
+        mensaje = {'type': event['type'], **datos}
+        for campo in self.CAMPOS_EVENTO:
+            # Los envíos de los temas no traen todos los campos
+            if campo in event:
+                mensaje[campo] = event[campo]
+        if event.get('reenviado'):
+            mensaje['reenviado'] = True
+        await self.enviar_mensaje(mensaje)
 
     async def pedido_actualizado(self, event):
         # Enviar actualización de pedido a todos los clientes conectados
-        await self.send(text_data=json.dumps({
-            'type': 'pedido_actualizado',
-            'pedido': event['pedido']
-        }))
+        await self.enviar_evento(event, pedido=event['pedido'])
 
     async def pedido_creado(self, event):
         # Enviar nuevo pedido a todos los clientes conectados
-        await self.send(text_data=json.dumps({
-            'type': 'pedido_creado',
-            'pedido': event['pedido']
-        }))
+        await self.enviar_evento(event, pedido=event['pedido'])
 
     async def pedido_eliminado(self, event):
         # Enviar notificación de pedido eliminado a todos los clientes conectados
-        await self.send(text_data=json.dumps({
-            'type': 'pedido_eliminado',
-            'pedido': event['pedido']
-        }))
+        await self.enviar_evento(event, pedido=event['pedido'])
 
     async def pedidos_marcados_completados(self, event):
         # Enviar notificación de pedidos marcados como completados a todos los clientes conectados
-        await self.send(text_data=json.dumps({
-            'type': 'pedidos_marcados_completados',
-            'pedidos_ids': event['pedidos_ids'],
-            'cantidad': event['cantidad']
-        }))
+        await self.enviar_evento(event, pedidos_ids=event['pedidos_ids'], cantidad=event['cantidad'])
+
+    async def pedidos_batch(self, event):
+        # Eventos de una ventana del publicador, ya sin los superados (ver pedidos.publicador)
+        await self.enviar_evento(event, eventos=event['eventos'])
+
+    async def stock_actualizado(self, event):
+        # Filas de stock que cambiaron (grupo completo y tema 'stock')
+        await self.enviar_evento(event, stock=event['stock'])
+
+    async def contadores_actualizados(self, event):
+        # Tema 'contadores'
+        await self.enviar_evento(event)
+
+    async def caja_actualizada(self, event):
+        # Tema 'caja'
+        await self.enviar_evento(event, caja=event['caja'])
+
+    def _get_temas(self):
+        query_string = self.scope.get("query_string", b"").decode()
+        valor = parse_qs(query_string).get("temas", [""])[0]
+        return [tema.strip() for tema in valor.split(",") if tema.strip()]
+
+    def _get_ultimo_seq(self):
+        query_string = self.scope.get("query_string", b"").decode()
+        valor = parse_qs(query_string).get("ultimo_seq", [""])[0]
+        try:
+            return int(valor)
+        except ValueError:
+            return None
+
+    @database_sync_to_async
+    def estado_temas(self, temas):
+        from menu.stock import stock_compacto
+
+        mensajes = []
+        if 'stock' in temas:
+            mensajes.append({'type': 'stock_actualizado', 'stock': stock_compacto()})
+        if 'contadores' in temas:
+            mensajes.append({'type': 'contadores_actualizados', 'contadores': obtener_contadores()})
+        if 'caja' in temas:
+            mensajes.append(mensaje_caja())
+        return mensajes
 
     @database_sync_to_async
     def get_pedidos(self):
-        # Obtener todos los pedidos del día actual
-        from django.utils import timezone
-        today = timezone.now().date()
-        
-        pedidos = Pedido.objects.filter(fecha_creacion__date=today).order_by('-fecha_creacion')
-        
-        pedidos_data = []
-        for pedido in pedidos:
-            pedidos_data.append({
-                'id': pedido.id,
-                'numero_dia': pedido.numero_dia,
-                'tipo': pedido.tipo,
-                'subtipo': pedido.subtipo,
-                'forma_pago': pedido.forma_pago,
-                'total': float(pedido.total),
-                'estado_pedido': pedido.estado_pedido,
-                'fecha_creacion': pedido.fecha_creacion.isoformat(),
-                'contacto': pedido.contacto,
-                'observaciones_generales': pedido.observaciones_generales,
-            })
-        
-        return pedidos_data
+        # Foto ya codificada: se arma una vez por versión de datos y formato, no por cliente
+        return foto_pendientes(self.binario)
 
 
-class ImpresionConsumer(AsyncWebsocketConsumer):
+class ImpresionConsumer(FormatoMixin, AsyncWebsocketConsumer):
     async def connect(self):
         token = self._get_token()
         expected_token = os.getenv('TABLET_PRINT_TOKEN', '').strip()
@@ -107,19 +231,19 @@ class ImpresionConsumer(AsyncWebsocketConsumer):
             await self.close(code=4001)
             return
 
-        await self.accept()
+        await self.aceptar()
         await self.channel_layer.group_add("impresion", self.channel_name)
-        await self.send(text_data=json.dumps({
+        await self.enviar_bienvenida({
             'type': 'connection_established',
             'message': 'Conectado al canal de impresión'
-        }))
+        })
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard("impresion", self.channel_name)
 
     async def print_job(self, event):
         payload = event.get('payload', {})
-        await self.send(text_data=json.dumps(payload))
+        await self.enviar_mensaje(payload)
 
     def _get_token(self):
         query_string = self.scope.get("query_string", b"").decode()
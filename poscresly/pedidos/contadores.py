@@ -0,0 +1,91 @@
+"""
+Contadores de pedidos pendientes por tipo.
+
+Se guardan en la caché y se ajustan en +1/-1 cuando un pedido se crea, cambia
+de tipo, se completa o se elimina (al confirmarse la transacción), en lugar de
+contar la tabla de pedidos en cada consulta. Si faltan en la caché se
+recalculan con un solo GROUP BY; además expiran cada pocos minutos para que
+cualquier desvío (p. ej. un cambio hecho desde el admin) se corrija solo.
+
+El recuento nunca pisa un ajuste: se guarda con cache.add (solo lo que falta)
+y se descarta si mientras tanto se aplicó algún ajuste (contador de
+generación), porque pudo haber contado la tabla antes de ese cambio.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+from poscresly.versiones import ContadorVersion
+
+from .models import Pedido
+
+# Tipo de pedido -> clave del contador en la respuesta (y en las tabs del frontend)
+CLAVES_TIPO = {
+    'Servirse': 'servirse',
+    'Llevar': 'llevar',
+    'Reservado': 'reservados',
+}
+PREFIJO = 'contadores:pendientes:'
+TTL_CONTADORES = 5 * 60
+# Aumenta con cada ajuste aplicado
+_generacion = ContadorVersion(f'{PREFIJO}generacion')
+
+
+def _clave(tipo):
+    return f'{PREFIJO}{tipo}'
+
+
+def recalcular_contadores():
+    """Cuenta los pendientes por tipo en una consulta y guarda lo que falte en la caché."""
+    generacion = _generacion.actual()
+    conteos = dict.fromkeys(CLAVES_TIPO, 0)
+    filas = (
+        Pedido.objects.filter(estado='pendiente')
+        .values_list('tipo')
+        .annotate(cantidad=Count('id'))
+        .order_by()
+    )
+    for tipo, cantidad in filas:
+        if tipo in conteos:
+            conteos[tipo] = cantidad
+    if _generacion.actual() == generacion:
+        for tipo, cantidad in conteos.items():
+            cache.add(_clave(tipo), cantidad, TTL_CONTADORES)
+    return conteos
+
+
+def obtener_contadores():
+    """
+    Contadores para las tabs: {'todos', 'servirse', 'llevar', 'reservados'}.
+    Normalmente es una sola lectura de la caché, sin consultas.
+    """
+    guardados = cache.get_many([_clave(tipo) for tipo in CLAVES_TIPO])
+    if len(guardados) == len(CLAVES_TIPO):
+        conteos = {tipo: guardados[_clave(tipo)] for tipo in CLAVES_TIPO}
+    else:
+        conteos = recalcular_contadores()
+    contadores = {CLAVES_TIPO[tipo]: max(cantidad, 0) for tipo, cantidad in conteos.items()}
+    contadores['todos'] = sum(contadores.values())
+    return contadores
+
+
+def _ajustar(deltas):
+    _generacion.incrementar()
+    for tipo, delta in deltas.items():
+        if tipo not in CLAVES_TIPO or not delta:
+            continue
+        try:
+            cache.incr(_clave(tipo), delta)
+        except ValueError:
+            # El contador no está en la caché: se recalculará en la próxima lectura
+            cache.delete_many([_clave(t) for t in CLAVES_TIPO])
+            return
+
+
+def ajustar_contadores(deltas):
+    """
+    Suma `deltas` ({tipo: +n/-n}) a los contadores cuando la transacción
+    actual se confirme (si se revierte, los contadores no cambian).
+    """
+    deltas = dict(deltas)
+    transaction.on_commit(lambda: _ajustar(deltas))
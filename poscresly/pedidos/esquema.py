@@ -0,0 +1,254 @@
+"""
+Lectura y validación del cuerpo JSON de guardar_pedido_v2.
+
+El esquema se declara con `Campo` y se compila una sola vez (al importar el
+módulo) en funciones que validan y normalizan el pedido completo en una pasada,
+acumulando todos los errores con su línea y campo en lugar de detenerse en el
+primero. Para decodificar se usa orjson si está instalado.
+"""
+import json
+from decimal import Decimal, InvalidOperation
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depende del entorno
+    orjson = None
+
+TIPOS_PEDIDO = ('Servirse', 'Llevar', 'Reservado')
+FORMAS_PAGO = ('Efectivo', 'Transferencia')
+TIPOS_PRODUCTO = ('Almuerzo', 'Sopa', 'Segundo', 'Extra')
+
+# Componentes obligatorios según el tipo de producto
+REQUERIDOS_POR_TIPO = {
+    'Almuerzo': ('sopa_id', 'segundo_id', 'jugo_id'),
+    'Sopa': ('sopa_id', 'jugo_id'),
+    'Segundo': ('segundo_id', 'jugo_id'),
+    'Extra': ('extras_ids',),
+}
+
+MAX_PRODUCTOS = 200
+
+
+class ErrorJSON(ValueError):
+    """El cuerpo no es JSON válido."""
+
+
+def decodificar_json(contenido):
+    """bytes/str -> objeto Python (orjson si está disponible)."""
+    try:
+        if orjson is not None:
+            return orjson.loads(contenido)
+        return json.loads(contenido)
+    except ValueError as e:
+        raise ErrorJSON(str(e))
+
+
+def codificar_json(data):
+    """Objeto Python -> bytes (orjson si está disponible)."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False).encode()
+
+
+class Campo:
+    """Definición de un campo del esquema."""
+
+    def __init__(self, tipo, requerido=False, nulo=False, defecto=None, opciones=None,
+                 minimo=None, max_largo=None, items=None):
+        self.tipo = tipo
+        self.requerido = requerido
+        self.nulo = nulo
+        self.defecto = defecto
+        self.opciones = opciones
+        self.minimo = minimo
+        self.max_largo = max_largo
+        self.items = items
+
+
+ESQUEMA_PRODUCTO = {
+    'tipo': Campo(str, requerido=True, opciones=TIPOS_PRODUCTO),
+    'cantidad': Campo(int, defecto=1, minimo=1),
+    'precio_unitario': Campo(Decimal, requerido=True, minimo=0),
+    'observacion': Campo(str, nulo=True, defecto='', max_largo=200),
+    'sopa_id': Campo(int, nulo=True, minimo=1),
+    'segundo_id': Campo(int, nulo=True, minimo=1),
+    'jugo_id': Campo(int, nulo=True, minimo=1),
+    'extras_ids': Campo(list, nulo=True, items=Campo(int, minimo=1)),
+    'componentes': Campo(list, nulo=True, items=Campo(str)),
+}
+
+ESQUEMA_PEDIDO = {
+    'tipo_pedido': Campo(str, requerido=True, opciones=TIPOS_PEDIDO),
+    'forma_pago': Campo(str, defecto='Efectivo', opciones=FORMAS_PAGO),
+    'mesa': Campo(int, nulo=True, minimo=1),
+    'cliente': Campo(str, nulo=True, max_largo=100),
+    'subtipo_reservado': Campo(str, nulo=True, max_largo=20),
+    'observaciones_generales': Campo(str, nulo=True),
+    'pedido_id': Campo(int, nulo=True, minimo=1),
+    'es_agregar_productos': Campo(bool, defecto=False),
+    'imprimir': Campo(bool, defecto=True),
+}
+
+_NOMBRES_TIPO = {str: 'texto', int: 'entero', Decimal: 'número', bool: 'booleano', list: 'lista'}
+
+
+def _convertir_entero(valor):
+    # bool es subclase de int en Python: se rechaza explícitamente
+    if valor.__class__ is int:
+        return valor
+    raise TypeError
+
+
+def _convertir_decimal(valor):
+    clase = valor.__class__
+    if clase is not int and clase is not float and clase is not str:
+        raise TypeError
+    try:
+        valor = Decimal(str(valor))
+    except InvalidOperation:
+        raise TypeError
+    if not valor.is_finite():
+        raise TypeError
+    return valor
+
+
+def _convertidor(tipo):
+    if tipo is int:
+        return _convertir_entero
+    if tipo is Decimal:
+        return _convertir_decimal
+
+    def convertir(valor):
+        if isinstance(valor, tipo):
+            return valor
+        raise TypeError
+    return convertir
+
+
+def _compilar_campo(campo):
+    """
+    Devuelve una función valor -> (valor_normalizado, mensaje_error | None).
+
+    Las opciones del campo se resuelven aquí, una vez, para que la función
+    devuelta solo haga las comprobaciones que el campo necesita.
+    """
+    convertir = _convertidor(campo.tipo)
+    esperado = f"Se esperaba {_NOMBRES_TIPO[campo.tipo]}"
+    nulo_permitido = campo.nulo or not campo.requerido
+    defecto = campo.defecto
+    comprobaciones = []
+    if campo.opciones is not None:
+        opciones = frozenset(campo.opciones)
+        mensaje_opciones = f"Valor no permitido (opciones: {', '.join(campo.opciones)})"
+        comprobaciones.append(lambda v: None if v in opciones else mensaje_opciones)
+    if campo.minimo is not None:
+        minimo = campo.minimo
+        mensaje_minimo = f"Debe ser mayor o igual a {minimo}"
+        comprobaciones.append(lambda v: None if v >= minimo else mensaje_minimo)
+    if campo.max_largo is not None:
+        max_largo = campo.max_largo
+        mensaje_largo = f"Máximo {max_largo} caracteres"
+        comprobaciones.append(lambda v: None if len(v) <= max_largo else mensaje_largo)
+    if campo.items is not None:
+        validar_item = _compilar_campo(campo.items)
+
+        def comprobar_items(v):
+            # Los elementos son enteros o textos: no cambian al validarse
+            for item in v:
+                error = validar_item(item)[1]
+                if error:
+                    return f"Elemento inválido: {error}"
+            return None
+        comprobaciones.append(comprobar_items)
+
+    def validar(valor):
+        if valor is None:
+            if nulo_permitido:
+                return defecto, None
+            return None, "Campo requerido"
+        try:
+            valor = convertir(valor)
+        except TypeError:
+            return None, esperado
+        for comprobar in comprobaciones:
+            error = comprobar(valor)
+            if error:
+                return None, error
+        return valor, None
+
+    return validar
+
+
+def _compilar_objeto(esquema):
+    """Devuelve una función dict -> (dict_normalizado, [(campo, mensaje)])."""
+    validadores = [(nombre, campo.requerido, _compilar_campo(campo)) for nombre, campo in esquema.items()]
+
+    def validar(objeto):
+        if not isinstance(objeto, dict):
+            return None, [(None, "Se esperaba un objeto")]
+        normalizado = {}
+        errores = []
+        for nombre, requerido, validar_campo in validadores:
+            valor = objeto.get(nombre)
+            if valor is None and requerido:
+                errores.append((nombre, "Campo requerido"))
+                continue
+            valor, error = validar_campo(valor)
+            if error:
+                errores.append((nombre, error))
+            else:
+                normalizado[nombre] = valor
+        return normalizado, errores
+
+    return validar
+
+
+_validar_pedido = _compilar_objeto(ESQUEMA_PEDIDO)
+_validar_producto = _compilar_objeto(ESQUEMA_PRODUCTO)
+
+
+def validar_pedido(data):
+    """
+    Valida y normaliza el cuerpo de guardar_pedido_v2.
+
+    Returns:
+        tuple: (datos, errores). `datos` tiene el formato que espera
+        registrar_pedido (productos con extras_ids '1,2'); `errores` es una
+        lista de {'campo', 'mensaje'} y, para productos, también 'linea'.
+    """
+    datos, errores_pedido = _validar_pedido(data)
+    errores = [{'campo': campo, 'mensaje': mensaje} for campo, mensaje in errores_pedido]
+    if datos is None:
+        return None, errores
+
+    productos = data.get('productos')
+    if not isinstance(productos, list) or not productos:
+        errores.append({'campo': 'productos', 'mensaje': "Se esperaba una lista con al menos un producto"})
+        return None, errores
+    if len(productos) > MAX_PRODUCTOS:
+        errores.append({'campo': 'productos', 'mensaje': f"Máximo {MAX_PRODUCTOS} productos"})
+        return None, errores
+
+    normalizados = []
+    for linea, producto in enumerate(productos):
+        producto_normalizado, errores_producto = _validar_producto(producto)
+        if producto_normalizado is not None and not errores_producto:
+            for campo in REQUERIDOS_POR_TIPO[producto_normalizado['tipo']]:
+                if not producto_normalizado.get(campo):
+                    errores_producto.append((campo, f"Requerido para {producto_normalizado['tipo']}"))
+        if errores_producto:
+            errores.extend(
+                {'linea': linea, 'campo': campo, 'mensaje': mensaje} for campo, mensaje in errores_producto
+            )
+            continue
+        if producto_normalizado['extras_ids']:
+            producto_normalizado['extras_ids'] = ','.join(str(i) for i in producto_normalizado['extras_ids'])
+        normalizados.append(producto_normalizado)
+
+    if errores:
+        return None, errores
+
+    datos['productos'] = normalizados
+    if datos['mesa'] is not None:
+        datos['mesa'] = str(datos['mesa'])
+    return datos, []
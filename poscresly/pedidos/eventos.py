@@ -0,0 +1,66 @@
+"""
+Registro de los eventos del WebSocket de pedidos, con número de secuencia.
+
+Cada evento que se envía al grupo 'pedidos' recibe un número creciente y se
+guarda en un buffer circular de la caché (TAMANO_BUFFER posiciones: el evento
+N ocupa la posición N % TAMANO_BUFFER). Una tablet que se reconecta manda el
+último número que vio y recibe solo los eventos que se perdió; si el hueco ya
+no está en el buffer (o la caché se vació) se le manda la foto completa.
+
+Con Redis la caché es compartida, así que el registro sirve para todos los
+procesos; con LocMem (desarrollo) vale para el proceso actual.
+"""
+from django.core.cache import cache
+
+from poscresly.versiones import ContadorVersion
+
+CLAVE_SECUENCIA = 'ws:eventos:secuencia'
+PREFIJO = 'ws:eventos:'
+TAMANO_BUFFER = 500
+TTL_EVENTOS = 60 * 60
+
+
+def _clave(secuencia):
+    return f'{PREFIJO}{secuencia % TAMANO_BUFFER}'
+
+
+# Si la caché se vació el contador parte de un valor nuevo: los números que
+# tengan las tablets quedan fuera del buffer y reciben la foto completa
+_secuencia = ContadorVersion(CLAVE_SECUENCIA)
+
+
+def secuencia_actual():
+    return _secuencia.actual()
+
+
+def registrar_evento(mensaje):
+    """
+    Asigna el siguiente número de secuencia al mensaje ('seq') y lo guarda en
+    el buffer. Devuelve el mensaje con el número agregado.
+    """
+    secuencia = _secuencia.incrementar()
+    mensaje = {**mensaje, 'seq': secuencia}
+    cache.set(_clave(secuencia), mensaje, TTL_EVENTOS)
+    return mensaje
+
+
+def eventos_desde(ultimo):
+    """
+    Eventos con número mayor que `ultimo`, en orden.
+
+    Returns:
+        list | None: None si falta alguno (hueco más viejo que el buffer,
+        expirado o número desconocido): la tablet necesita la foto completa.
+    """
+    actual = secuencia_actual()
+    if ultimo > actual or actual - ultimo > TAMANO_BUFFER:
+        return None
+    secuencias = range(ultimo + 1, actual + 1)
+    guardados = cache.get_many([_clave(secuencia) for secuencia in secuencias])
+    eventos = []
+    for secuencia in secuencias:
+        evento = guardados.get(_clave(secuencia))
+        if evento is None or evento.get('seq') != secuencia:
+            return None
+        eventos.append(evento)
+    return eventos
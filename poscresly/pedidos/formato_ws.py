@@ -0,0 +1,133 @@
+"""
+Formato de los mensajes del WebSocket: JSON (por defecto) o msgpack compacto.
+
+Un cliente que ofrece el subprotocolo SUBPROTOCOLO_MSGPACK recibe frames
+binarios msgpack en los que las claves largas (numero_pedido_completo,
+observaciones_generales, las de cada producto...) van abreviadas según CLAVES.
+El primer mensaje de la conexión ('connection_established') va sin abreviar y
+trae la tabla en 'claves' (abreviada -> larga), así el cliente no la repite.
+Si el cliente no ofrece el subprotocolo, o msgpack no está instalado, todo
+sigue en texto JSON como antes. Los mensajes del cliente al servidor pueden
+llegar en cualquiera de los dos formatos.
+"""
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - depende del entorno (viene con channels_redis)
+    msgpack = None
+
+SUBPROTOCOLO_MSGPACK = 'cresly.msgpack.v1'
+
+# Clave larga -> abreviada. Las abreviadas no coinciden con ninguna clave real;
+# las claves que no están en la tabla se envían tal cual.
+CLAVES = {
+    # Sobre de los eventos
+    'type': 't',
+    'pedido': 'p',
+    'pedidos': 'ps',
+    'pedidos_ids': 'pi',
+    'eventos': 'ev',
+    'contadores': 'c',
+    'stock': 'st',
+    'version': 'v',
+    'seq': 'sq',
+    'reenviado': 'r',
+    'tipo_anterior': 'ta',
+    # Pedido (serializar_pedido_para_websocket / serializar_pedidos)
+    'id': 'i',
+    'numero_dia': 'nd',
+    'numero_pedido_completo': 'n',
+    'tipo': 'tp',
+    'subtipo': 'su',
+    'subtipo_reservado': 'sr',
+    'forma_pago': 'fp',
+    'total': 'to',
+    'estado_pedido': 'ep',
+    'estado': 'e',
+    'fecha_creacion': 'f',
+    'contacto': 'co',
+    'observaciones_generales': 'og',
+    'mesa': 'm',
+    'productos': 'pr',
+    # Productos
+    'sopa_id': 'so',
+    'segundo_id': 'se',
+    'jugo_id': 'j',
+    'extra_id': 'x',
+    'cantidad': 'ca',
+    'precio_unitario': 'pu',
+    'observacion': 'o',
+    'componentes': 'cm',
+    # Stock compacto
+    'sopas': 'ss',
+    'segundos': 'sg',
+    # Trabajos de impresión
+    'contenido': 'ct',
+    'es_agregar_productos': 'ea',
+    'impresoras': 'im',
+}
+LARGAS = {corta: larga for larga, corta in CLAVES.items()}
+
+_CONTENEDORES = (dict, list, tuple)
+
+
+def _abreviar(obj, tabla):
+    # Solo se recorren los contenedores (la foto tiene miles de valores sueltos)
+    if type(obj) is dict:
+        return {
+            tabla.get(clave, clave): _abreviar(valor, tabla) if type(valor) in _CONTENEDORES else valor
+            for clave, valor in obj.items()
+        }
+    return [_abreviar(valor, tabla) if type(valor) in _CONTENEDORES else valor for valor in obj]
+
+
+def abreviar(obj):
+    """Reemplaza las claves largas por las abreviadas, en todo el mensaje."""
+    return _abreviar(obj, CLAVES) if type(obj) in _CONTENEDORES else obj
+
+
+def _expandir_dict(obj):
+    return {LARGAS.get(clave, clave): valor for clave, valor in obj.items()}
+
+
+def _msgpack_default(valor):
+    # Mismos criterios que DjangoJSONEncoder (Decimal como texto, fechas ISO)
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return str(valor)
+    raise TypeError(f'No se puede codificar {type(valor).__name__}')
+
+
+def elegir_subprotocolo(ofrecidos):
+    """Subprotocolo a aceptar entre los que ofrece el cliente (None = JSON)."""
+    if msgpack is not None and SUBPROTOCOLO_MSGPACK in (ofrecidos or ()):
+        return SUBPROTOCOLO_MSGPACK
+    return None
+
+
+def codificar(mensaje, binario, abreviado=True):
+    """Mensaje -> bytes msgpack (abreviado, salvo que se pida lo contrario) o texto JSON."""
+    if binario:
+        return msgpack.packb(abreviar(mensaje) if abreviado else mensaje, default=_msgpack_default)
+    return json.dumps(mensaje, cls=DjangoJSONEncoder)
+
+
+def decodificar(contenido):
+    """Frame del cliente (texto JSON o bytes msgpack abreviado) -> mensaje."""
+    if isinstance(contenido, (bytes, bytearray)):
+        if msgpack is None:
+            raise ValueError('msgpack no está instalado')
+        # object_hook expande cada mapa mientras se decodifica (sin otra pasada)
+        return msgpack.unpackb(contenido, strict_map_key=False, object_hook=_expandir_dict)
+    return json.loads(contenido)
+
+
+def texto_a_binario(texto):
+    """Mensaje ya codificado en JSON (p. ej. la foto compartida) -> msgpack abreviado."""
+    return codificar(json.loads(texto), binario=True)
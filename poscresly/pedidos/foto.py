@@ -0,0 +1,76 @@
+"""
+Foto de los pedidos pendientes para las tablets que se conectan al WebSocket.
+
+La foto es el mensaje 'pedidos_data' ya codificado (texto JSON, o msgpack
+para los clientes que lo negocian: ver formato_ws). Se arma una sola vez por
+versión de datos (versiones.CLAVE_PEDIDOS) con el serializador en lote y se
+comparte: cada proceso guarda la última en memoria y entre
+procesos se reparte por la caché. Así, cuando todas las tablets se reconectan
+a la vez (p. ej. tras un corte del Wi-Fi) la foto se arma una vez, no N.
+"""
+import json
+import threading
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .eventos import secuencia_actual
+from .formato_ws import texto_a_binario
+from .models import Pedido, VersionCambios
+from .serializadores import serializar_pedidos
+from .versiones import CLAVE_PEDIDOS, version_datos
+
+TTL_FOTO = 60 * 60
+
+_lock = threading.Lock()
+_compartidas = {}  # formato -> (versión de datos, contenido)
+
+
+def armar_foto():
+    """
+    Mensaje 'pedidos_data' con los pendientes, su versión de cambios y el
+    número del último evento (desde ahí sigue la tablet). Sin los contadores:
+    se ajustan al confirmar, después de que cambia la versión de datos, y
+    quedarían viejos en la foto compartida (el consumer los envía aparte).
+    """
+    # La secuencia y la versión se leen antes que la lista (ver cambios.cambios_desde):
+    # un cambio en el medio llega otra vez como evento o delta, nunca se pierde
+    seq = secuencia_actual()
+    version = VersionCambios.actual()
+    pedidos = Pedido.objects.filter(estado='pendiente').order_by('-fecha_creacion')
+    return json.dumps({
+        'type': 'pedidos_data',
+        'seq': seq,
+        'version': version,
+        'pedidos': serializar_pedidos(pedidos),
+    }, cls=DjangoJSONEncoder)
+
+
+def foto_pendientes(binario=False):
+    """
+    Foto vigente, lista para enviar por el WebSocket: texto JSON o, para los
+    clientes msgpack (ver formato_ws), bytes abreviados armados desde el JSON.
+    Solo se arma si cambió la versión de datos de pedidos.
+    """
+    version = version_datos(CLAVE_PEDIDOS)
+    formato = 'msgpack' if binario else 'json'
+    foto = _compartidas.get(formato)
+    if foto is None or foto[0] != version:
+        with _lock:
+            foto = _compartidas.get(formato)
+            if foto is None or foto[0] != version:
+                foto = (version, _foto_en_cache(version, binario))
+                _compartidas[formato] = foto
+    return foto[1]
+
+
+def _foto_en_cache(version, binario):
+    clave = f'pedidos:foto:{version}' + (':msgpack' if binario else '')
+    contenido = cache.get(clave)
+    if contenido is None:
+        if binario:
+            contenido = texto_a_binario(_foto_en_cache(version, False))
+        else:
+            contenido = armar_foto()
+        cache.set(clave, contenido, TTL_FOTO)
+    return contenido
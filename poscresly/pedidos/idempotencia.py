@@ -0,0 +1,130 @@
+"""
+Envíos idempotentes de pedidos.
+
+Las tablets reintentan los POST cuando el Wi-Fi falla. Con una clave de
+idempotencia (cabecera Idempotency-Key o campo idempotency_key) la primera
+respuesta se guarda en la caché por unos minutos y los reintentos la reciben
+tal cual, sin volver a tocar la base de datos, el stock, el WebSocket ni la
+impresora. Mientras la primera petición sigue en curso, los duplicados esperan
+su resultado (un solo vuelo por clave).
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.core.cache import cache
+from django.http import JsonResponse
+
+logger = logging.getLogger(__name__)
+
+CABECERA_CLAVE = 'HTTP_IDEMPOTENCY_KEY'
+CAMPO_CLAVE = 'idempotency_key'
+
+# Tiempo que se guarda la respuesta y tiempo máximo del candado en vuelo (segundos)
+TTL_RESPUESTA = 10 * 60
+TTL_CANDADO = 30
+ESPERA_DUPLICADO = 10
+INTERVALO_ESPERA = 0.05
+
+
+def obtener_clave(request):
+    clave = request.META.get(CABECERA_CLAVE)
+    if not clave and request.content_type != 'application/json':
+        clave = request.POST.get(CAMPO_CLAVE)
+    clave = (clave or '').strip()
+    return clave[:128] or None
+
+
+def _huella(request):
+    """Hash del cuerpo sin la clave, para detectar una clave reutilizada con otros datos."""
+    if request.content_type == 'application/json':
+        return hashlib.sha256(request.body).hexdigest()
+    datos = sorted((k, v) for k, v in request.POST.lists() if k != CAMPO_CLAVE)
+    return hashlib.sha256(json.dumps(datos).encode()).hexdigest()
+
+
+def _respuesta_guardada(guardada, huella):
+    if guardada['huella'] != huella:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'La clave de idempotencia ya se usó con otros datos',
+        }, status=422)
+    respuesta = JsonResponse(guardada['data'], status=guardada['status_code'])
+    respuesta['Idempotent-Replay'] = 'true'
+    return respuesta
+
+
+def _para_guardar(respuesta, huella, prefijo):
+    """Datos a guardar de una respuesta, o None si no debe guardarse."""
+    if respuesta.status_code >= 500:
+        return None
+    try:
+        data = json.loads(respuesta.content)
+    except ValueError:
+        logger.warning("Respuesta no JSON en %s; no se guarda para reintentos", prefijo)
+        return None
+    return {'huella': huella, 'status_code': respuesta.status_code, 'data': data}
+
+
+def _en_proceso():
+    return JsonResponse({
+        'status': 'error',
+        'message': 'El pedido aún se está procesando, intente de nuevo',
+    }, status=409)
+
+
+def idempotente(prefijo):
+    """
+    Decorador para vistas POST async que devuelven JsonResponse.
+
+    Sin clave la vista se ejecuta normalmente. Con clave:
+    - si ya hay respuesta guardada, se devuelve sin ejecutar la vista;
+    - si otra petición con la misma clave está en curso, se espera su respuesta;
+    - si no, se ejecuta la vista y se guarda la respuesta (salvo errores 5xx,
+      que pueden reintentarse).
+    """
+    def decorador(vista):
+        if not iscoroutinefunction(vista):
+            raise TypeError(f'idempotente requiere una vista async ({vista.__name__})')
+
+        @wraps(vista)
+        async def envoltura(request, *args, **kwargs):
+            clave = obtener_clave(request)
+            if not clave:
+                return await vista(request, *args, **kwargs)
+
+            clave_respuesta = f'idem:{prefijo}:{clave}'
+            clave_candado = f'{clave_respuesta}:candado'
+            huella = _huella(request)
+
+            guardada = await cache.aget(clave_respuesta)
+            if guardada:
+                return _respuesta_guardada(guardada, huella)
+
+            # cache.add es atómico: solo una petición obtiene el candado
+            if not await cache.aadd(clave_candado, 1, TTL_CANDADO):
+                limite = time.monotonic() + ESPERA_DUPLICADO
+                while time.monotonic() < limite:
+                    await asyncio.sleep(INTERVALO_ESPERA)
+                    guardada = await cache.aget(clave_respuesta)
+                    if guardada:
+                        return _respuesta_guardada(guardada, huella)
+                    if await cache.aget(clave_candado) is None:
+                        break
+                return _en_proceso()
+
+            try:
+                respuesta = await vista(request, *args, **kwargs)
+                guardar = _para_guardar(respuesta, huella, prefijo)
+                if guardar:
+                    await cache.aset(clave_respuesta, guardar, TTL_RESPUESTA)
+                return respuesta
+            finally:
+                await cache.adelete(clave_candado)
+
+        return envoltura
+    return decorador
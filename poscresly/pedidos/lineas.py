@@ -0,0 +1,407 @@
+"""
+Persistencia en lote de las líneas (productos) de un pedido.
+
+Las líneas del carrito llegan con IDs de Plato; aquí se resuelven contra el
+menú del día y se insertan con un número fijo de consultas, sin importar
+cuántas líneas tenga el pedido.
+
+Todas las líneas viven en PedidoItem. Para editar pedidos,
+`calcular_diff_lineas` compara el carrito con las líneas guardadas y produce
+los conjuntos a insertar, actualizar y eliminar, junto con los deltas de stock
+y el nuevo total; `aplicar_diff_lineas` los aplica con un bulk_create, un
+bulk_update y un delete() filtrado.
+"""
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+
+from django.db.models import CharField, Value
+
+from menu.catalogo import obtener_catalogo
+from menu.models import MenuDiaSopa, MenuDiaSegundo, MenuDiaJugo
+from .models import PedidoItem
+
+# Tipo de producto -> componentes del menú del día que usa
+COMPONENTES = PedidoItem.COMPONENTES
+
+
+def ids_extras(producto):
+    """Lista de Plato IDs de un producto Extra ('3,5,8' -> [3, 5, 8])."""
+    extras_ids = producto.get('extras_ids') or producto.get('extra_id') or ''
+    return [int(x) for x in str(extras_ids).split(',') if x.strip().isdigit()]
+
+
+def _plato_id(producto, campo):
+    try:
+        return int(producto.get(campo))
+    except (TypeError, ValueError):
+        return None
+
+
+def _cantidad(producto):
+    try:
+        return int(producto.get('cantidad', 1))
+    except (TypeError, ValueError):
+        return 1
+
+
+def resolver_componentes_menu(productos_carrito, fecha=None):
+    """
+    Resuelve en UNA consulta los MenuDiaSopa/Segundo/Jugo del día para los
+    Plato IDs del carrito.
+
+    Returns:
+        dict: {'sopa': {plato_id: menu_dia_id}, 'segundo': {...}, 'jugo': {...},
+               'nombres': {plato_id: nombre_plato}}
+    """
+    fecha = fecha or date.today()
+    ids = {'sopa': set(), 'segundo': set(), 'jugo': set()}
+
+    for producto in productos_carrito:
+        tipo = producto.get('tipo')
+        if tipo in ('Almuerzo', 'Sopa'):
+            ids['sopa'].add(_plato_id(producto, 'sopa_id'))
+        if tipo in ('Almuerzo', 'Segundo'):
+            ids['segundo'].add(_plato_id(producto, 'segundo_id'))
+        if tipo in ('Almuerzo', 'Sopa', 'Segundo'):
+            ids['jugo'].add(_plato_id(producto, 'jugo_id'))
+
+    componentes = {'sopa': {}, 'segundo': {}, 'jugo': {}, 'nombres': {}}
+    for clave in ids:
+        ids[clave].discard(None)
+    if not any(ids.values()):
+        return componentes
+
+    consultas = [
+        modelo.objects.filter(menu__fecha=fecha, **{f'{campo}_id__in': ids[clave]})
+        .annotate(componente=Value(clave, output_field=CharField()))
+        .values_list('componente', f'{campo}_id', 'id')
+        for clave, modelo, campo in (
+            ('sopa', MenuDiaSopa, 'sopa'),
+            ('segundo', MenuDiaSegundo, 'segundo'),
+            ('jugo', MenuDiaJugo, 'jugo'),
+        )
+    ]
+    union = consultas[0].union(*consultas[1:], all=True).order_by('id')
+
+    catalogo = obtener_catalogo()
+    for clave, plato_id, menu_dia_id in union:
+        # Si un plato está repetido en el menú, se usa el primer registro
+        componentes[clave].setdefault(plato_id, menu_dia_id)
+        componentes['nombres'][plato_id] = _nombre_plato(catalogo, plato_id)
+    return componentes
+
+
+def _cargar_extras(productos_carrito):
+    ids = {i for p in productos_carrito if p.get('tipo') == 'Extra' for i in ids_extras(p)}
+    return obtener_catalogo().platos(ids, tipo='extra') if ids else {}
+
+
+def construir_lineas_pedido(pedido, productos_carrito, componentes=None, extras=None):
+    """
+    Construye (sin guardar) las líneas para los productos dados, en el orden
+    del carrito; se omiten las que no están en el menú de hoy.
+
+    Returns:
+        list[PedidoItem]: listo para bulk_create
+    """
+    if componentes is None:
+        componentes = resolver_componentes_menu(productos_carrito)
+    if extras is None:
+        extras = _cargar_extras(productos_carrito)
+
+    lineas = []
+
+    for producto in productos_carrito:
+        tipo = producto.get('tipo')
+        cantidad = _cantidad(producto)
+        observacion = producto.get('observacion', '')
+        sopa_id = componentes['sopa'].get(_plato_id(producto, 'sopa_id'))
+        segundo_id = componentes['segundo'].get(_plato_id(producto, 'segundo_id'))
+        jugo_id = componentes['jugo'].get(_plato_id(producto, 'jugo_id'))
+
+        if tipo == 'Almuerzo':
+            if sopa_id and segundo_id and jugo_id:
+                lineas.append(PedidoItem(
+                    pedido=pedido, tipo=tipo, sopa_id=sopa_id, segundo_id=segundo_id, jugo_id=jugo_id,
+                    cantidad=cantidad, precio_unitario=producto['precio_unitario'],
+                    observacion=observacion,
+                ))
+        elif tipo == 'Sopa':
+            if sopa_id and jugo_id:
+                lineas.append(PedidoItem(
+                    pedido=pedido, tipo=tipo, sopa_id=sopa_id, jugo_id=jugo_id,
+                    cantidad=cantidad, precio_unitario=producto['precio_unitario'],
+                    observacion=observacion,
+                ))
+        elif tipo == 'Segundo':
+            if segundo_id and jugo_id:
+                lineas.append(PedidoItem(
+                    pedido=pedido, tipo=tipo, segundo_id=segundo_id, jugo_id=jugo_id,
+                    cantidad=cantidad, precio_unitario=producto['precio_unitario'],
+                    observacion=observacion,
+                ))
+        elif tipo == 'Extra':
+            # Un registro por cada extra seleccionado, con el precio del plato
+            for extra_id in ids_extras(producto):
+                extra_plato = extras.get(extra_id)
+                if extra_plato:
+                    lineas.append(PedidoItem(
+                        pedido=pedido, tipo=tipo, extra=extra_plato, cantidad=cantidad,
+                        precio_unitario=extra_plato.precio, observacion=observacion,
+                    ))
+
+    return lineas
+
+
+def crear_lineas_pedido(pedido, productos_carrito):
+    """
+    Guarda todas las líneas del carrito con un número fijo de consultas:
+    una para resolver el menú del día y un solo bulk_create (los extras
+    salen del catálogo).
+
+    Returns:
+        list[PedidoItem]: líneas creadas
+    """
+    lineas = construir_lineas_pedido(pedido, productos_carrito)
+    if lineas:
+        PedidoItem.objects.bulk_create(lineas)
+    return lineas
+
+
+# ===== DIFF DE LÍNEAS PARA EDICIÓN =====
+
+def _clave_carrito(producto, extra_id=None):
+    """Clave de una línea del carrito: (tipo, sopa, segundo, jugo, extra) en Plato IDs."""
+    tipo = producto.get('tipo')
+    if tipo == 'Extra':
+        return (tipo, None, None, None, extra_id)
+    componentes = COMPONENTES[tipo]
+    return (
+        tipo,
+        _plato_id(producto, 'sopa_id') if 'sopa' in componentes else None,
+        _plato_id(producto, 'segundo_id') if 'segundo' in componentes else None,
+        _plato_id(producto, 'jugo_id') if 'jugo' in componentes else None,
+        None,
+    )
+
+
+def _clave_linea(linea):
+    """Misma clave que `_clave_carrito`, calculada desde una línea guardada."""
+    if linea.tipo == 'Extra':
+        return (linea.tipo, None, None, None, linea.extra_id)
+    componentes = COMPONENTES[linea.tipo]
+    return (
+        linea.tipo,
+        linea.sopa.sopa_id if 'sopa' in componentes else None,
+        linea.segundo.segundo_id if 'segundo' in componentes else None,
+        linea.jugo.jugo_id if linea.jugo_id else None,
+        None,
+    )
+
+
+def _cargar_lineas_guardadas(pedido):
+    """
+    Líneas actuales del pedido con sus componentes del menú en una consulta;
+    los nombres de los platos salen del catálogo.
+    """
+    return list(
+        PedidoItem.objects.filter(pedido=pedido)
+        .select_related('sopa', 'segundo', 'jugo').order_by('id')
+    )
+
+
+def _nombre_plato(catalogo, plato_id):
+    plato = catalogo.plato(plato_id)
+    return plato.nombre_plato if plato else None
+
+
+def _nombres_linea(linea, catalogo):
+    if linea.tipo == 'Extra':
+        return {linea.extra_id: _nombre_plato(catalogo, linea.extra_id)}
+    nombres = {}
+    for campo in COMPONENTES[linea.tipo]:
+        if getattr(linea, f'{campo}_id') is None:
+            continue  # Componente opcional sin elegir (p. ej. sin jugo)
+        plato_id = getattr(getattr(linea, campo), f'{campo}_id')
+        nombres[plato_id] = _nombre_plato(catalogo, plato_id)
+    return nombres
+
+
+def _producto_dict(clave, cantidad, precio_unitario, observacion, nombres):
+    """Mismo formato que pedidos.serializadores.convertir_producto_a_dict."""
+    tipo, sopa, segundo, jugo, extra = clave
+    producto = {'tipo': tipo}
+    if tipo == 'Extra':
+        producto['extra_id'] = extra
+        ids = [extra]
+    else:
+        ids = [i for i in (sopa, segundo, jugo) if i is not None]
+        if sopa is not None:
+            producto['sopa_id'] = sopa
+        if segundo is not None:
+            producto['segundo_id'] = segundo
+        producto['jugo_id'] = jugo
+    producto.update({
+        'cantidad': cantidad,
+        'precio_unitario': float(precio_unitario),
+        'observacion': observacion or '',
+        'componentes': [nombres.get(i) for i in ids],
+    })
+    return producto
+
+
+def _delta_stock(stock, clave, delta):
+    tipo, sopa, segundo, _, _ = clave
+    if delta and tipo != 'Extra':
+        stock[(tipo.lower(), sopa, segundo)] += delta
+
+
+def calcular_diff_lineas(pedido, productos_carrito, agregar=False, lineas_guardadas=None):
+    """
+    Compara el carrito con las líneas guardadas del pedido.
+
+    Las líneas se identifican por (tipo, sopa, segundo, jugo, extra) en Plato
+    IDs. En modo edición el carrito reemplaza al pedido: las líneas que ya no
+    vienen se eliminan. Con `agregar=True` el carrito se suma a lo existente.
+
+    Returns:
+        dict con:
+            insertar:   [PedidoItem nuevos]
+            actualizar: [PedidoItem con cantidad/observación nuevas]
+            eliminar:   [ids de PedidoItem]
+            stock:      productos con cantidades con signo para
+                        actualizar_cantidades_menu(..., 'restar')
+            total:      Decimal con el total final del pedido
+            productos:  líneas finales en formato convertir_producto_a_dict
+    """
+    if lineas_guardadas is None:
+        lineas_guardadas = _cargar_lineas_guardadas(pedido) if pedido.pk else []
+
+    extras = _cargar_extras(productos_carrito)
+
+    # Carrito normalizado: una entrada por línea (cada extra es su propia línea)
+    entrantes = defaultdict(list)
+    for producto in productos_carrito:
+        tipo = producto.get('tipo')
+        if tipo not in COMPONENTES:
+            continue
+        if tipo == 'Extra':
+            for extra_id in ids_extras(producto):
+                if extra_id in extras:
+                    entrantes[_clave_carrito(producto, extra_id)].append(
+                        (producto, extras[extra_id].precio))
+        else:
+            entrantes[_clave_carrito(producto)].append(
+                (producto, Decimal(str(producto.get('precio_unitario', 0)))))
+
+    catalogo = obtener_catalogo()
+    guardadas = defaultdict(list)
+    nombres = {}
+    for linea in lineas_guardadas:
+        guardadas[_clave_linea(linea)].append(linea)
+        nombres.update(_nombres_linea(linea, catalogo))
+
+    insertar = []
+    actualizar = []
+    eliminar = []
+    stock = defaultdict(int)
+    finales = []  # (clave, cantidad, precio, observacion, linea o None)
+    por_insertar = []
+
+    for clave in list(guardadas) + [c for c in entrantes if c not in guardadas]:
+        existentes = guardadas.get(clave, [])
+        nuevos = entrantes.get(clave, [])
+
+        for i, linea in enumerate(existentes):
+            if i >= len(nuevos):
+                # Ya no viene en el carrito
+                if agregar:
+                    finales.append((clave, linea.cantidad, linea.precio_unitario, linea.observacion, linea))
+                else:
+                    eliminar.append(linea.id)
+                    _delta_stock(stock, clave, -linea.cantidad)
+                continue
+
+            producto, _ = nuevos[i]
+            cantidad = _cantidad(producto)
+            observacion = producto.get('observacion', '')
+            if agregar:
+                cantidad_final = linea.cantidad + max(cantidad, 0)
+                observacion = observacion or linea.observacion
+            else:
+                cantidad_final = cantidad
+
+            if cantidad_final <= 0:
+                eliminar.append(linea.id)
+                _delta_stock(stock, clave, -linea.cantidad)
+                continue
+
+            if cantidad_final != linea.cantidad or (observacion or '') != (linea.observacion or ''):
+                _delta_stock(stock, clave, cantidad_final - linea.cantidad)
+                linea.cantidad = cantidad_final
+                linea.observacion = observacion
+                actualizar.append(linea)
+            finales.append((clave, linea.cantidad, linea.precio_unitario, linea.observacion, linea))
+
+        for producto, precio in nuevos[len(existentes):]:
+            if _cantidad(producto) > 0:
+                por_insertar.append((clave, producto, precio))
+
+    if por_insertar:
+        carrito_nuevo = []
+        for clave, producto, _ in por_insertar:
+            if clave[0] == 'Extra':
+                producto = {**producto, 'extras_ids': str(clave[4])}
+            carrito_nuevo.append(producto)
+        componentes = resolver_componentes_menu(carrito_nuevo)
+        nombres.update(componentes['nombres'])
+        nombres.update({plato.id: plato.nombre_plato for plato in extras.values()})
+        lineas_nuevas = construir_lineas_pedido(pedido, carrito_nuevo, componentes, extras)
+
+        # construir_lineas_pedido conserva el orden y omite lo que no está en el menú de hoy
+        pendientes = iter(lineas_nuevas)
+        for clave, producto, precio in por_insertar:
+            resuelto = all(
+                componentes[campo].get(valor) for campo, valor
+                in zip(('sopa', 'segundo', 'jugo'), clave[1:4])
+                if campo in COMPONENTES[clave[0]]
+            )
+            if not resuelto:
+                continue
+            linea = next(pendientes)
+            insertar.append(linea)
+            _delta_stock(stock, clave, linea.cantidad)
+            finales.append((clave, linea.cantidad, linea.precio_unitario, linea.observacion, None))
+
+    orden = list(COMPONENTES)
+    finales.sort(key=lambda f: (orden.index(f[0][0]), f[4] is None, f[4].id if f[4] else 0))
+
+    total = sum(
+        (Decimal(str(precio)) * cantidad for _, cantidad, precio, _, _ in finales),
+        Decimal('0.00'),
+    )
+    return {
+        'insertar': insertar,
+        'actualizar': actualizar,
+        'eliminar': eliminar,
+        'stock': [
+            {'tipo': tipo, 'sopa_id': sopa, 'segundo_id': segundo, 'cantidad': delta}
+            for (tipo, sopa, segundo), delta in stock.items() if delta
+        ],
+        'total': total,
+        'productos': [
+            _producto_dict(clave, cantidad, precio, observacion, nombres)
+            for clave, cantidad, precio, observacion, _ in finales
+        ],
+    }
+
+
+def aplicar_diff_lineas(diff):
+    """Aplica un diff con a lo sumo un delete(), un bulk_update y un bulk_create."""
+    if diff['eliminar']:
+        PedidoItem.objects.filter(id__in=diff['eliminar']).delete()
+    if diff['actualizar']:
+        PedidoItem.objects.bulk_update(diff['actualizar'], ['cantidad', 'observacion'])
+    if diff['insertar']:
+        PedidoItem.objects.bulk_create(diff['insertar'])
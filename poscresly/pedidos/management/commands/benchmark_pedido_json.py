@@ -0,0 +1,64 @@
+import json
+import timeit
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from pedidos import esquema
+
+
+def _cuerpo(lineas):
+    productos = []
+    for i in range(lineas):
+        tipo = ('Almuerzo', 'Sopa', 'Segundo', 'Extra')[i % 4]
+        producto = {'tipo': tipo, 'cantidad': 1 + i % 3, 'precio_unitario': 3.5, 'observacion': 'sin sal' if i % 5 == 0 else ''}
+        if tipo == 'Extra':
+            producto['extras_ids'] = [10 + i % 4, 20 + i % 4]
+        else:
+            producto.update({'sopa_id': 1 + i % 2, 'segundo_id': 3 + i % 3, 'jugo_id': 7})
+        productos.append(producto)
+    return {'tipo_pedido': 'Servirse', 'mesa': 4, 'forma_pago': 'Efectivo', 'productos': productos}
+
+
+def _v1(productos_carrito):
+    """Lectura de guardar_pedido: json.loads + Decimal(str(...)) por línea."""
+    productos = json.loads(productos_carrito)
+    for producto in productos:
+        Decimal(str(producto.get('precio_unitario', 0)))
+        int(producto.get('cantidad', 1))
+    return productos
+
+
+class Command(BaseCommand):
+    help = 'Mide el costo de leer y validar el cuerpo de un pedido (formulario v1 vs JSON v2)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lineas', type=int, default=20, help='Productos por pedido (por defecto 20)')
+        parser.add_argument('--repeticiones', type=int, default=2000, help='Iteraciones por caso (por defecto 2000)')
+
+    def handle(self, *args, **options):
+        lineas = options['lineas']
+        repeticiones = options['repeticiones']
+        data = _cuerpo(lineas)
+        cuerpo = json.dumps(data).encode()
+        productos_form = json.dumps(data['productos'])
+
+        datos, errores = esquema.validar_pedido(json.loads(cuerpo))
+        if errores:
+            self.stderr.write(self.style.ERROR(f"El pedido de prueba no es válido: {errores}"))
+            return
+
+        casos = [
+            ('v1 formulario (json + Decimal por línea)', lambda: _v1(productos_form)),
+            ('v2 json stdlib + esquema', lambda: esquema.validar_pedido(json.loads(cuerpo))),
+            ('v2 solo esquema', lambda: esquema.validar_pedido(data)),
+        ]
+        if esquema.orjson is not None:
+            casos.insert(2, ('v2 orjson + esquema', lambda: esquema.validar_pedido(esquema.orjson.loads(cuerpo))))
+        else:
+            self.stdout.write(self.style.WARNING('orjson no está instalado; se omite ese caso'))
+
+        self.stdout.write(f"Pedido de {lineas} productos ({len(cuerpo)} bytes), {repeticiones} repeticiones\n")
+        for nombre, funcion in casos:
+            segundos = min(timeit.repeat(funcion, number=repeticiones, repeat=3))
+            self.stdout.write(f"  {nombre:<45} {segundos / repeticiones * 1e6:8.1f} µs/pedido")
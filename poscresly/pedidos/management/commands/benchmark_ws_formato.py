@@ -0,0 +1,95 @@
+import json
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from pedidos import esquema, formato_ws
+
+
+def _producto(i):
+    tipo = ('Almuerzo', 'Sopa', 'Segundo', 'Extra')[i % 4]
+    producto = {
+        'tipo': tipo,
+        'cantidad': 1 + i % 3,
+        'precio_unitario': 3.5,
+        'observacion': 'sin sal' if i % 5 == 0 else '',
+    }
+    if tipo == 'Extra':
+        producto.update({'extra_id': 10 + i % 4, 'componentes': ['Porción de maduro']})
+    else:
+        producto.update({
+            'sopa_id': 1 + i % 2,
+            'segundo_id': 3 + i % 3,
+            'jugo_id': 7,
+            'componentes': ['Sopa de quinua', 'Seco de pollo', 'Jugo de naranjilla'],
+        })
+    return producto
+
+
+def _foto(pedidos, lineas):
+    """Mensaje 'pedidos_data' con la forma de serializar_pedidos."""
+    return {
+        'type': 'pedidos_data',
+        'seq': 1234,
+        'version': 5678,
+        'contadores': {'todos': pedidos, 'servirse': pedidos // 2, 'llevar': pedidos - pedidos // 2, 'reservados': 0},
+        'pedidos': [{
+            'id': 1000 + n,
+            'numero_dia': n + 1,
+            'numero_pedido_completo': f'S-{n + 1:03d}',
+            'tipo': ('Servirse', 'Llevar')[n % 2],
+            'subtipo_reservado': None,
+            'forma_pago': 'Efectivo',
+            'total': 12.5,
+            'estado': 'pendiente',
+            'fecha_creacion': '2025-10-06T12:34:56.789012-05:00',
+            'contacto': 'Ana' if n % 2 else None,
+            'observaciones_generales': 'Mesa del fondo' if n % 3 == 0 else '',
+            'mesa': n % 12 + 1,
+            'productos': [_producto(i) for i in range(lineas)],
+            'version': 5000 + n,
+        } for n in range(pedidos)],
+    }
+
+
+class Command(BaseCommand):
+    help = 'Compara tamaño de frame y tiempo de codificar/decodificar la foto del WebSocket (JSON vs msgpack)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pedidos', type=int, default=40, help='Pedidos pendientes en la foto (por defecto 40)')
+        parser.add_argument('--lineas', type=int, default=4, help='Productos por pedido (por defecto 4)')
+        parser.add_argument('--repeticiones', type=int, default=200, help='Iteraciones por caso (por defecto 200)')
+
+    def handle(self, *args, **options):
+        repeticiones = options['repeticiones']
+        foto = _foto(options['pedidos'], options['lineas'])
+
+        casos = [
+            ('json (actual)', lambda m: formato_ws.codificar(m, False), json.loads),
+        ]
+        if esquema.orjson is not None:
+            casos.append(('orjson', esquema.orjson.dumps, esquema.orjson.loads))
+        if formato_ws.msgpack is not None:
+            msgpack = formato_ws.msgpack
+            casos += [
+                ('msgpack claves largas', msgpack.packb, msgpack.unpackb),
+                ('msgpack abreviado (subprotocolo)', lambda m: formato_ws.codificar(m, True), formato_ws.decodificar),
+            ]
+        else:
+            self.stdout.write(self.style.WARNING('msgpack no está instalado; se omiten esos casos'))
+
+        self.stdout.write(
+            f"Foto de {options['pedidos']} pedidos x {options['lineas']} productos, {repeticiones} repeticiones\n"
+        )
+        self.stdout.write(f"  {'formato':<36} {'bytes':>8} {'codificar':>12} {'decodificar':>12}")
+        for nombre, codificar, decodificar in casos:
+            frame = codificar(foto)
+            if decodificar(frame) != json.loads(formato_ws.codificar(foto, False)):
+                self.stderr.write(self.style.ERROR(f"{nombre}: el mensaje no vuelve igual al decodificar"))
+                continue
+            t_codificar = min(timeit.repeat(lambda: codificar(foto), number=repeticiones, repeat=3))
+            t_decodificar = min(timeit.repeat(lambda: decodificar(frame), number=repeticiones, repeat=3))
+            self.stdout.write(
+                f"  {nombre:<36} {len(frame):>8} "
+                f"{t_codificar / repeticiones * 1e6:9.1f} µs {t_decodificar / repeticiones * 1e6:9.1f} µs"
+            )
@@ -0,0 +1,21 @@
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from pedidos.cambios import purgar_eliminados
+
+
+class Command(BaseCommand):
+    help = 'Borra los registros de pedidos eliminados (PedidoEliminado) de días anteriores (correr a diario)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=1,
+                            help='Días que se conservan, contando el de hoy (por defecto 1: solo hoy)')
+
+    def handle(self, *args, **options):
+        dias = max(options['dias'], 1)
+        desde = timezone.localdate() - timedelta(days=dias - 1)
+        antes = timezone.make_aware(datetime.combine(desde, time.min))
+        borrados = purgar_eliminados(antes)
+        self.stdout.write(self.style.SUCCESS(f"{borrados} registros de pedidos eliminados borrados (anteriores a {desde})"))
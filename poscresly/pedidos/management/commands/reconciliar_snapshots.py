@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from pedidos.cambios import diferir_version, transaccion_versionada
+from pedidos.models import Pedido
+from pedidos.serializadores import con_lineas, obtener_productos_pedido
+from pedidos.versiones import CLAVE_PEDIDOS, marcar_cambio
+
+
+class Command(BaseCommand):
+    help = 'Regenera Pedido.productos_snapshot desde las líneas del pedido (PedidoItem)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--todos', action='store_true',
+                            help='Revisar todos los pedidos (por defecto solo los pendientes)')
+        parser.add_argument('--lote', type=int, default=500, help='Pedidos por lote (por defecto 500)')
+        parser.add_argument('--simular', action='store_true',
+                            help='Solo informar los pedidos con diferencias, sin guardar')
+
+    def handle(self, *args, **options):
+        pedidos = Pedido.objects.order_by('id')
+        if not options['todos']:
+            pedidos = pedidos.filter(estado='pendiente')
+
+        revisados = 0
+        corregidos = 0
+        ultimo_id = 0
+        while True:
+            lote = list(con_lineas(pedidos.filter(id__gt=ultimo_id))[:options['lote']])
+            if not lote:
+                break
+            ultimo_id = lote[-1].id
+
+            cambiados = []
+            for pedido in lote:
+                productos = obtener_productos_pedido(pedido)
+                if pedido.productos_snapshot != productos:
+                    pedido.productos_snapshot = productos
+                    cambiados.append(pedido)
+                    self.stdout.write(f"Pedido {pedido.id} (#{pedido.numero_pedido_completo}): snapshot desactualizado")
+            revisados += len(lote)
+            corregidos += len(cambiados)
+
+            if cambiados and not options['simular']:
+                with transaccion_versionada():
+                    Pedido.objects.bulk_update(cambiados, ['productos_snapshot'])
+                    # Nueva versión para que las tablets reciban el snapshot corregido
+                    diferir_version(pedidos=cambiados)
+                    marcar_cambio(CLAVE_PEDIDOS)
+
+        accion = 'con diferencias' if options['simular'] else 'corregidos'
+        self.stdout.write(self.style.SUCCESS(f"{revisados} pedidos revisados, {corregidos} {accion}"))
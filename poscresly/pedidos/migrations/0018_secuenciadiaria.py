@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:40
+
+from django.db import migrations, models
+from django.db.models import Max
+from django.db.models.functions import TruncDate
+
+
+def inicializar_secuencias(apps, schema_editor):
+    """Crea la secuencia de cada día con el último numero_dia ya asignado"""
+    Pedido = apps.get_model('pedidos', 'Pedido')
+    SecuenciaDiaria = apps.get_model('pedidos', 'SecuenciaDiaria')
+
+    ultimos = (
+        Pedido.objects.annotate(dia=TruncDate('fecha_creacion'))
+        .values('dia')
+        .annotate(ultimo=Max('numero_dia'))
+    )
+    SecuenciaDiaria.objects.bulk_create([
+        SecuenciaDiaria(fecha=fila['dia'], ultimo_numero=fila['ultimo'])
+        for fila in ultimos
+        if fila['dia'] is not None
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0017_pedidoextra'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SecuenciaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(unique=True)),
+                ('ultimo_numero', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(inicializar_secuencias, migrations.RunPython.noop),
+    ]
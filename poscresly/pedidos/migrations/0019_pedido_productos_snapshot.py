@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0018_secuenciadiaria'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pedido',
+            name='productos_snapshot',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('menu', '0012_plato_precio'),
+        ('pedidos', '0019_pedido_productos_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PedidoItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('Almuerzo', 'Almuerzo'), ('Sopa', 'Sopa'), ('Segundo', 'Segundo'), ('Extra', 'Extra')], max_length=10)),
+                ('postre', models.CharField(blank=True, default='', max_length=100)),
+                ('cantidad', models.PositiveIntegerField(default=1)),
+                ('precio_unitario', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('observacion', models.CharField(blank=True, max_length=200, null=True)),
+                ('extra', models.ForeignKey(blank=True, limit_choices_to={'tipo': 'extra'}, null=True, on_delete=django.db.models.deletion.PROTECT, to='menu.plato')),
+                ('jugo', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='menu.menudiajugo')),
+                ('pedido', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='pedidos.pedido')),
+                ('segundo', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='menu.menudiasegundo')),
+                ('sopa', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='menu.menudiasopa')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['pedido', 'tipo'], name='pedidos_item_pedido_tipo')],
+            },
+        ),
+    ]
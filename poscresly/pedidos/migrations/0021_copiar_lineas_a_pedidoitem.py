@@ -0,0 +1,73 @@
+from django.db import migrations
+
+LOTE = 2000
+
+# Tabla anterior -> (tipo, campos FK propios de la línea)
+TABLAS_LINEAS = (
+    ('PedidoAlmuerzo', 'Almuerzo', ('sopa_id', 'segundo_id', 'jugo_id')),
+    ('PedidoSopa', 'Sopa', ('sopa_id', 'jugo_id')),
+    ('PedidoSegundo', 'Segundo', ('segundo_id', 'jugo_id')),
+    ('PedidoExtra', 'Extra', ('extra_id',)),
+)
+
+
+def copiar_a_items(apps, schema_editor):
+    """Mueve las líneas de las 4 tablas a PedidoItem, tabla por tabla y en orden de id"""
+    PedidoItem = apps.get_model('pedidos', 'PedidoItem')
+    for nombre_modelo, tipo, campos in TABLAS_LINEAS:
+        modelo = apps.get_model('pedidos', nombre_modelo)
+        lote = []
+        for linea in modelo.objects.order_by('id').iterator(chunk_size=LOTE):
+            item = PedidoItem(
+                pedido_id=linea.pedido_id,
+                tipo=tipo,
+                postre=getattr(linea, 'postre', '') or '',
+                cantidad=linea.cantidad,
+                precio_unitario=linea.precio_unitario,
+                observacion=linea.observacion,
+            )
+            for campo in campos:
+                setattr(item, campo, getattr(linea, campo))
+            lote.append(item)
+            if len(lote) >= LOTE:
+                PedidoItem.objects.bulk_create(lote)
+                lote = []
+        PedidoItem.objects.bulk_create(lote)
+        modelo.objects.all().delete()
+
+
+def copiar_a_tablas(apps, schema_editor):
+    """Reverso: mueve cada PedidoItem de vuelta a la tabla de su tipo"""
+    PedidoItem = apps.get_model('pedidos', 'PedidoItem')
+    for nombre_modelo, tipo, campos in TABLAS_LINEAS:
+        modelo = apps.get_model('pedidos', nombre_modelo)
+        tiene_postre = any(f.name == 'postre' for f in modelo._meta.fields)
+        lote = []
+        for item in PedidoItem.objects.filter(tipo=tipo).order_by('id').iterator(chunk_size=LOTE):
+            linea = modelo(
+                pedido_id=item.pedido_id,
+                cantidad=item.cantidad,
+                precio_unitario=item.precio_unitario,
+                observacion=item.observacion,
+            )
+            if tiene_postre:
+                linea.postre = item.postre
+            for campo in campos:
+                setattr(linea, campo, getattr(item, campo))
+            lote.append(linea)
+            if len(lote) >= LOTE:
+                modelo.objects.bulk_create(lote)
+                lote = []
+        modelo.objects.bulk_create(lote)
+    PedidoItem.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0020_pedidoitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(copiar_a_items, copiar_a_tablas),
+    ]
@@ -0,0 +1,102 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:58
+
+import pedidos.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0021_copiar_lineas_a_pedidoitem'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='pedidoextra',
+            name='extra',
+        ),
+        migrations.RemoveField(
+            model_name='pedidoextra',
+            name='pedido',
+        ),
+        migrations.RemoveField(
+            model_name='pedidosegundo',
+            name='jugo',
+        ),
+        migrations.RemoveField(
+            model_name='pedidosegundo',
+            name='pedido',
+        ),
+        migrations.RemoveField(
+            model_name='pedidosegundo',
+            name='segundo',
+        ),
+        migrations.RemoveField(
+            model_name='pedidosopa',
+            name='jugo',
+        ),
+        migrations.RemoveField(
+            model_name='pedidosopa',
+            name='pedido',
+        ),
+        migrations.RemoveField(
+            model_name='pedidosopa',
+            name='sopa',
+        ),
+        migrations.DeleteModel(
+            name='PedidoAlmuerzo',
+        ),
+        migrations.DeleteModel(
+            name='PedidoExtra',
+        ),
+        migrations.DeleteModel(
+            name='PedidoSegundo',
+        ),
+        migrations.DeleteModel(
+            name='PedidoSopa',
+        ),
+        migrations.CreateModel(
+            name='PedidoAlmuerzo',
+            fields=[
+            ],
+            options={
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=(pedidos.models.LineaPorTipo, 'pedidos.pedidoitem'),
+        ),
+        migrations.CreateModel(
+            name='PedidoExtra',
+            fields=[
+            ],
+            options={
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=(pedidos.models.LineaPorTipo, 'pedidos.pedidoitem'),
+        ),
+        migrations.CreateModel(
+            name='PedidoSegundo',
+            fields=[
+            ],
+            options={
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=(pedidos.models.LineaPorTipo, 'pedidos.pedidoitem'),
+        ),
+        migrations.CreateModel(
+            name='PedidoSopa',
+            fields=[
+            ],
+            options={
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=(pedidos.models.LineaPorTipo, 'pedidos.pedidoitem'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0022_lineas_como_proxies'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PedidoEliminado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pedido_id', models.BigIntegerField()),
+                ('tipo', models.CharField(max_length=20)),
+                ('version', models.PositiveBigIntegerField(db_index=True)),
+                ('fecha', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VersionCambios',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=30, unique=True)),
+                ('ultima_version', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='pedido',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='pedido',
+            name='version',
+            field=models.PositiveBigIntegerField(db_index=True, default=0),
+        ),
+    ]
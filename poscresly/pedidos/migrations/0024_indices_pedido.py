@@ -0,0 +1,26 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:09
+
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0023_version_cambios'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['estado', 'tipo', '-fecha_creacion'], name='pedido_estado_tipo_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(condition=models.Q(('estado', 'pendiente')), fields=['-fecha_creacion'], name='pedido_pendiente_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(django.db.models.functions.datetime.TruncDate('fecha_creacion'), models.F('estado'), name='pedido_dia_estado'),
+        ),
+    ]
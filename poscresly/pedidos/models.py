@@ -1,7 +1,92 @@
-from django.db import models, transaction
+from django.db import connection, models, transaction
+from django.db.models import F
+from django.db.models.functions import TruncDate
 from menu.models import MenuDiaSopa, MenuDiaSegundo, MenuDiaJugo, Plato
 from django.utils import timezone
 
+class SecuenciaDiaria(models.Model):
+    """Último número de pedido asignado en cada día."""
+    fecha = models.DateField(unique=True)
+    ultimo_numero = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.fecha} - {self.ultimo_numero}"
+
+    @classmethod
+    def reservar(cls, fecha, cantidad=1):
+        """
+        Reserva `cantidad` números consecutivos para el día y retorna el primero.
+
+        En PostgreSQL/SQLite es un único INSERT ... ON CONFLICT DO UPDATE ...
+        RETURNING: solo se bloquea la fila del día y no se recorren los pedidos.
+        Para inserciones en lote se reserva un bloque: los números asignados son
+        primero, primero + 1, ..., primero + cantidad - 1.
+        """
+        if cantidad < 1:
+            raise ValueError("cantidad debe ser mayor que 0")
+
+        if connection.vendor in ('postgresql', 'sqlite'):
+            tabla = connection.ops.quote_name(cls._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {tabla} (fecha, ultimo_numero) VALUES (%s, %s) "
+                    f"ON CONFLICT (fecha) DO UPDATE "
+                    f"SET ultimo_numero = {tabla}.ultimo_numero + EXCLUDED.ultimo_numero "
+                    f"RETURNING ultimo_numero",
+                    [fecha, cantidad],
+                )
+                ultimo = cursor.fetchone()[0]
+        else:
+            with transaction.atomic():
+                secuencia, _ = cls.objects.select_for_update().get_or_create(fecha=fecha)
+                cls.objects.filter(pk=secuencia.pk).update(ultimo_numero=F('ultimo_numero') + cantidad)
+                ultimo = secuencia.ultimo_numero + cantidad
+
+        return ultimo - cantidad + 1
+
+
+class VersionCambios(models.Model):
+    """
+    Contador global y monótono de cambios en pedidos (una fila por `clave`).
+
+    Cada pedido creado, editado, completado o eliminado toma el siguiente
+    número. El UPDATE deja bloqueada la fila hasta el commit, así que las
+    versiones se confirman en orden: quien pide "los cambios después de N" no
+    puede saltarse un cambio con un número menor que aún no se confirmaba.
+    Por eso las escrituras lo piden al final (ver cambios.transaccion_versionada).
+    """
+    clave = models.CharField(max_length=30, unique=True)
+    ultima_version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.clave} - {self.ultima_version}"
+
+    @classmethod
+    def siguiente(cls, clave='pedidos'):
+        """Incrementa el contador y retorna la nueva versión (misma técnica que SecuenciaDiaria)."""
+        if connection.vendor in ('postgresql', 'sqlite'):
+            tabla = connection.ops.quote_name(cls._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {tabla} (clave, ultima_version) VALUES (%s, 1) "
+                    f"ON CONFLICT (clave) DO UPDATE "
+                    f"SET ultima_version = {tabla}.ultima_version + 1 "
+                    f"RETURNING ultima_version",
+                    [clave],
+                )
+                return cursor.fetchone()[0]
+
+        with transaction.atomic():
+            contador, _ = cls.objects.select_for_update().get_or_create(clave=clave)
+            cls.objects.filter(pk=contador.pk).update(ultima_version=F('ultima_version') + 1)
+            return contador.ultima_version + 1
+
+    @classmethod
+    def actual(cls, clave='pedidos'):
+        """Última versión confirmada (0 si todavía no hubo cambios)."""
+        return cls.objects.filter(clave=clave).values_list('ultima_version', flat=True).first() or 0
+
+
 class Pedido( models.Model):
     
     TIPO_CHOICES = [
@@ -31,62 +116,163 @@ class Pedido( models.Model):
     observaciones_generales = models.TextField(blank=True, null=True)  # Observaciones generales del pedido
     total = models.DecimalField(max_digits=10, decimal_places=2, default=0)  # Total del pedido
     numero_dia = models.PositiveIntegerField(default=1)  # Número de pedido del día (se reinicia cada día)
+    # Copia de los productos (formato de convertir_producto_a_dict) escrita al guardar el pedido.
+    # Las lecturas la usan en lugar de las 4 tablas de líneas; None = aún no generada
+    productos_snapshot = models.JSONField(blank=True, null=True)
+    updated_at = models.DateTimeField(default=timezone.now)  # Última modificación
+    version = models.PositiveBigIntegerField(default=0, db_index=True)  # VersionCambios del último cambio
+
+    class Meta:
+        indexes = [
+            # Listas por tipo: estado + tipo, ordenadas por fecha de creación
+            models.Index(fields=['estado', 'tipo', '-fecha_creacion'], name='pedido_estado_tipo_fecha'),
+            # Pendientes (tab "Todos", contadores): solo una pequeña parte de la tabla
+            models.Index(fields=['-fecha_creacion'], condition=models.Q(estado='pendiente'),
+                         name='pedido_pendiente_fecha'),
+            # fecha_creacion__date=... (caja, consumer) con el estado
+            models.Index(TruncDate('fecha_creacion'), 'estado', name='pedido_dia_estado'),
+        ]
 
     def __str__(self):
         return f"{self.tipo} - {self.forma_pago} - {self.fecha} - {self.estado}"
     
     def save(self, *args, **kwargs):
         if not self.pk:
-            today = timezone.localdate()
-            with transaction.atomic():
-                ultimo_pedido_hoy = (
-                    Pedido.objects.select_for_update()
-                    .filter(fecha_creacion__date=today)
-                    .order_by('-numero_dia')
-                    .first()
-                )
-                self.numero_dia = (ultimo_pedido_hoy.numero_dia + 1) if ultimo_pedido_hoy else 1
-                super().save(*args, **kwargs)
-            return
-
+            # Número del día desde la secuencia diaria (un solo UPDATE atómico)
+            self.numero_dia = SecuenciaDiaria.reservar(timezone.localdate())
+        # Cada guardado es un cambio visible para la sincronización por versión
+        # (dentro de una transaccion_versionada se asigna al final)
+        from .cambios import diferir_version
+        if not diferir_version(pedidos=[self]):
+            self.version = VersionCambios.siguiente()
+        self.updated_at = timezone.now()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'version', 'updated_at'}
         super().save(*args, **kwargs)
     
     @property
     def numero_pedido_completo(self):
         """Retorna el número de pedido del día formateado: 001, 002, 003..."""
         return f"{self.numero_dia:03d}"
+
+    # Líneas por tipo (antes related_name de cada tabla; ver PedidoItem)
+    @property
+    def almuerzos(self):
+        return PedidoAlmuerzo.objects.filter(pedido=self)
+
+    @property
+    def sopas(self):
+        return PedidoSopa.objects.filter(pedido=self)
+
+    @property
+    def segundos(self):
+        return PedidoSegundo.objects.filter(pedido=self)
+
+    @property
+    def extras(self):
+        return PedidoExtra.objects.filter(pedido=self)
     
-class PedidoAlmuerzo(models.Model):
-    pedido = models.ForeignKey(Pedido, on_delete=models.CASCADE, related_name='almuerzos')
-    sopa = models.ForeignKey(MenuDiaSopa, on_delete=models.PROTECT)
-    segundo = models.ForeignKey(MenuDiaSegundo, on_delete=models.PROTECT)
-    jugo = models.ForeignKey(MenuDiaJugo, on_delete=models.PROTECT)
-    postre = models.CharField(max_length=100)  
-    cantidad = models.PositiveIntegerField(default=1)
-    precio_unitario = models.DecimalField(max_digits=10, decimal_places=2, default=0)
-    observacion = models.CharField(max_length=200, blank=True, null=True)
+class PedidoEliminado(models.Model):
+    """Registro de un pedido eliminado, para informar la baja en la sincronización por versión."""
+    pedido_id = models.BigIntegerField()
+    tipo = models.CharField(max_length=20)
+    version = models.PositiveBigIntegerField(db_index=True)
+    fecha = models.DateTimeField(default=timezone.now)
 
-class PedidoSopa(models.Model):
-    pedido = models.ForeignKey(Pedido, on_delete=models.CASCADE, related_name='sopas')
-    sopa = models.ForeignKey(MenuDiaSopa, on_delete=models.PROTECT)
-    jugo = models.ForeignKey(MenuDiaJugo, on_delete=models.PROTECT)
-    postre = models.CharField(max_length=100)
-    cantidad = models.PositiveIntegerField(default=1)
-    precio_unitario = models.DecimalField(max_digits=10, decimal_places=2, default=0)
-    observacion = models.CharField(max_length=200, blank=True, null=True)
+    def __str__(self):
+        return f"Pedido {self.pedido_id} eliminado (versión {self.version})"
 
-class PedidoSegundo(models.Model):
-    pedido = models.ForeignKey(Pedido, on_delete=models.CASCADE, related_name='segundos')
-    segundo = models.ForeignKey(MenuDiaSegundo, on_delete=models.PROTECT)
-    jugo = models.ForeignKey(MenuDiaJugo, on_delete=models.PROTECT)
-    postre = models.CharField(max_length=100)
-    cantidad = models.PositiveIntegerField(default=1)
-    precio_unitario = models.DecimalField(max_digits=10, decimal_places=2, default=0)
-    observacion = models.CharField(max_length=200, blank=True, null=True)
 
-class PedidoExtra(models.Model):
-    pedido = models.ForeignKey(Pedido, on_delete=models.CASCADE, related_name='extras')
-    extra = models.ForeignKey(Plato, on_delete=models.PROTECT, limit_choices_to={'tipo': 'extra'})
+class PedidoItem(models.Model):
+    """
+    Línea de un pedido (almuerzo, sopa, segundo o extra) en una sola tabla.
+
+    `tipo` indica qué componentes usa la línea: sopa, segundo y jugo apuntan al
+    menú del día y `extra` al Plato; los que no aplican quedan en NULL.
+    """
+    TIPOS = [
+        ('Almuerzo', 'Almuerzo'),
+        ('Sopa', 'Sopa'),
+        ('Segundo', 'Segundo'),
+        ('Extra', 'Extra'),
+    ]
+    # Componentes del menú del día que usa cada tipo (en el orden en que se imprimen)
+    COMPONENTES = {
+        'Almuerzo': ('sopa', 'segundo', 'jugo'),
+        'Sopa': ('sopa', 'jugo'),
+        'Segundo': ('segundo', 'jugo'),
+        'Extra': (),
+    }
+
+    pedido = models.ForeignKey(Pedido, on_delete=models.CASCADE, related_name='items')
+    tipo = models.CharField(max_length=10, choices=TIPOS)
+    sopa = models.ForeignKey(MenuDiaSopa, on_delete=models.PROTECT, blank=True, null=True)
+    segundo = models.ForeignKey(MenuDiaSegundo, on_delete=models.PROTECT, blank=True, null=True)
+    jugo = models.ForeignKey(MenuDiaJugo, on_delete=models.PROTECT, blank=True, null=True)
+    extra = models.ForeignKey(Plato, on_delete=models.PROTECT, blank=True, null=True,
+                              limit_choices_to={'tipo': 'extra'})
+    postre = models.CharField(max_length=100, blank=True, default='')
     cantidad = models.PositiveIntegerField(default=1)
     precio_unitario = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     observacion = models.CharField(max_length=200, blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['pedido', 'tipo'], name='pedidos_item_pedido_tipo'),
+        ]
+
+    def __str__(self):
+        return f"{self.cantidad}x {self.tipo} (pedido {self.pedido_id})"
+
+
+# ===== COMPATIBILIDAD CON LAS TABLAS ANTERIORES =====
+# Antes cada tipo de línea tenía su propia tabla. Ahora son proxies de
+# PedidoItem filtrados por tipo: PedidoAlmuerzo.objects.filter(pedido=...),
+# los formularios y pedido.almuerzos/sopas/segundos/extras siguen funcionando.
+
+class LineasPorTipoManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().filter(tipo=self.model.TIPO)
+
+
+class LineaPorTipo:
+    """Fija el tipo del proxy en las instancias nuevas (también con bulk_create)."""
+    TIPO = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.tipo:
+            self.tipo = self.TIPO
+
+
+class PedidoAlmuerzo(LineaPorTipo, PedidoItem):
+    TIPO = 'Almuerzo'
+    objects = LineasPorTipoManager()
+
+    class Meta:
+        proxy = True
+
+
+class PedidoSopa(LineaPorTipo, PedidoItem):
+    TIPO = 'Sopa'
+    objects = LineasPorTipoManager()
+
+    class Meta:
+        proxy = True
+
+
+class PedidoSegundo(LineaPorTipo, PedidoItem):
+    TIPO = 'Segundo'
+    objects = LineasPorTipoManager()
+
+    class Meta:
+        proxy = True
+
+
+class PedidoExtra(LineaPorTipo, PedidoItem):
+    TIPO = 'Extra'
+    objects = LineasPorTipoManager()
+
+    class Meta:
+        proxy = True
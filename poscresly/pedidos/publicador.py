@@ -0,0 +1,191 @@
+"""
+Publicación de eventos al grupo 'pedidos' del WebSocket, agrupados por ventana.
+
+En hora pico se crean, editan y completan pedidos en ráfaga; enviar cada
+cambio por separado obliga a todas las tablets a procesar una seguidilla de
+mensajes chicos. El publicador junta los eventos de una ventana corta
+(settings.WS_VENTANA_AGRUPACION_MS), descarta las actualizaciones de un pedido
+que quedaron superadas por otra más nueva y manda un solo mensaje
+'pedidos_batch'. Versión y contadores se calculan una vez por ventana; los
+avisos de stock de la ventana se juntan en uno solo.
+Cada envío va al grupo completo y, ya separado, a los temas (ver pedidos.temas).
+
+Con ventana 0 cada evento se envía solo, en el momento (como antes).
+"""
+import asyncio
+import logging
+import weakref
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from menu.stock import version_stock
+from .contadores import obtener_contadores
+from .eventos import registrar_evento
+from .models import VersionCambios
+from .temas import TEMAS, grupos_de_evento
+
+logger = logging.getLogger(__name__)
+
+GRUPO = TEMAS['pedidos']
+# Campos que el publicador agrega a cada envío del grupo completo
+CAMPOS_ENVIO = ('contadores', 'version', 'seq')
+
+
+def _completar(mensaje):
+    """Versión de cambios, contadores y versión del stock actuales (síncrona)."""
+    try:
+        mensaje['version'] = VersionCambios.actual()
+        mensaje['contadores'] = obtener_contadores()
+        eventos = mensaje['eventos'] if mensaje['type'] == 'pedidos_batch' else [mensaje]
+        for evento in eventos:
+            if evento['type'] == 'stock_actualizado':
+                evento['stock'] = {'version': version_stock(), **evento['stock']}
+    except Exception as e:
+        logger.warning("No se pudieron obtener la versión o los contadores para el WebSocket: %s", e)
+    try:
+        # Número de secuencia y registro para reenviarlo a quien se reconecte
+        mensaje = registrar_evento(mensaje)
+    except Exception as e:
+        logger.warning("No se pudo registrar el evento del WebSocket: %s", e)
+    return mensaje
+
+
+class PublicadorPedidos:
+    """
+    Junta los eventos de una ventana y los envía en un 'pedidos_batch'.
+
+    Pendientes por pedido: de varios eventos del mismo pedido queda el último
+    (un creado seguido de actualizaciones sigue siendo 'pedido_creado', con los
+    datos más nuevos). Los completados en lote se acumulan en un solo evento y
+    quitan las actualizaciones pendientes de esos pedidos; los avisos de stock
+    también, con la cantidad más nueva de cada fila.
+    """
+
+    def __init__(self, ventana):
+        self.ventana = ventana
+        self._pendientes = {}  # clave -> evento, en orden de llegada
+        self._tarea = None
+        # Lo último enviado al tema 'contadores' (solo se avisan cambios)
+        self._contadores = None
+
+    async def publicar(self, mensaje):
+        if self.ventana <= 0:
+            await self.enviar(mensaje)
+            return
+        self._agregar(mensaje)
+        if self._tarea is None:
+            self._tarea = asyncio.ensure_future(self._vaciar_despues())
+
+    def _agregar(self, mensaje):
+        tipo = mensaje['type']
+        if tipo == 'pedidos_marcados_completados':
+            ids = list(mensaje.get('pedidos_ids') or [])
+            for pedido_id in ids:
+                self._pendientes.pop(('pedido', str(pedido_id)), None)
+            anterior = self._pendientes.pop(('completados',), None)
+            if anterior:
+                ids = anterior['pedidos_ids'] + ids
+                mensaje = {**mensaje, 'cantidad': anterior['cantidad'] + mensaje.get('cantidad', 0)}
+            self._pendientes[('completados',)] = {**mensaje, 'pedidos_ids': ids}
+            return
+        if tipo == 'stock_actualizado':
+            anterior = self._pendientes.pop(('stock',), None)
+            if anterior:
+                mensaje = {**mensaje, 'stock': {
+                    clave: {**anterior['stock'].get(clave, {}), **mensaje['stock'].get(clave, {})}
+                    for clave in ('sopas', 'segundos')
+                }}
+            # Al final: las tablets aplican el stock después de los pedidos de la ventana
+            self._pendientes[('stock',)] = mensaje
+            return
+
+        pedido = mensaje.get('pedido') or {}
+        clave = ('pedido', str(pedido.get('id')))
+        anterior = self._pendientes.pop(clave, None)
+        if anterior:
+            if anterior['type'] == 'pedido_creado' and tipo == 'pedido_actualizado':
+                # Para las tablets sigue siendo un pedido nuevo
+                mensaje = {**mensaje, 'type': 'pedido_creado'}
+            # El tema del tipo que tenía antes de la ventana también debe enterarse
+            tipo_previo = anterior.get('tipo_anterior') or (anterior.get('pedido') or {}).get('tipo')
+            if anterior['type'] != 'pedido_creado' and tipo_previo != pedido.get('tipo'):
+                mensaje = {**mensaje, 'tipo_anterior': tipo_previo}
+            else:
+                mensaje = {k: v for k, v in mensaje.items() if k != 'tipo_anterior'}
+        self._pendientes[clave] = mensaje
+
+    async def _vaciar_despues(self):
+        try:
+            await asyncio.sleep(self.ventana / 1000)
+        except asyncio.CancelledError:
+            # Se cancela al cerrar el loop: lo pendiente se envía igual
+            self._tarea = None
+            await self.vaciar()
+            raise
+        self._tarea = None
+        await self.vaciar()
+
+    async def vaciar(self):
+        """Envía ya lo pendiente (un evento solo va tal cual, varios en un lote)."""
+        eventos = list(self._pendientes.values())
+        self._pendientes = {}
+        if not eventos:
+            return
+        if len(eventos) == 1:
+            await self.enviar(eventos[0])
+        else:
+            await self.enviar({'type': 'pedidos_batch', 'eventos': eventos})
+
+    async def enviar(self, mensaje):
+        """Completa el mensaje, lo registra y lo envía al grupo 'pedidos' y a los temas."""
+        from channels.layers import get_channel_layer
+
+        mensaje = await sync_to_async(_completar)(mensaje)
+        try:
+            channel_layer = get_channel_layer()
+            if channel_layer:
+                await channel_layer.group_send(GRUPO, mensaje)
+                logger.debug("Mensaje enviado por WebSocket: %s", mensaje['type'])
+                await self._enviar_temas(channel_layer, mensaje)
+            else:
+                logger.warning("No hay channel layer configurado")
+        except Exception as e:
+            logger.warning("Error al enviar mensaje por WebSocket: %s", e)
+
+    async def _enviar_temas(self, channel_layer, mensaje):
+        if mensaje['type'] == 'pedidos_batch':
+            eventos = mensaje['eventos']
+        else:
+            eventos = [{k: v for k, v in mensaje.items() if k not in CAMPOS_ENVIO}]
+
+        # Cada tema recibe solo sus eventos (uno suelto o en lote)
+        por_grupo = defaultdict(list)
+        for evento in eventos:
+            for grupo in grupos_de_evento(evento):
+                por_grupo[grupo].append(evento)
+        for grupo, propios in por_grupo.items():
+            envio = propios[0] if len(propios) == 1 else {'type': 'pedidos_batch', 'eventos': propios}
+            await channel_layer.group_send(grupo, {**envio, 'version': mensaje.get('version')})
+
+        contadores = mensaje.get('contadores')
+        if contadores and contadores != self._contadores:
+            self._contadores = contadores
+            await channel_layer.group_send(
+                TEMAS['contadores'], {'type': 'contadores_actualizados', 'contadores': contadores}
+            )
+
+
+# Un publicador por event loop (las tareas de la ventana viven en su loop)
+_publicadores = weakref.WeakKeyDictionary()
+
+
+def publicador_pedidos():
+    loop = asyncio.get_running_loop()
+    publicador = _publicadores.get(loop)
+    ventana = getattr(settings, 'WS_VENTANA_AGRUPACION_MS', 75)
+    if publicador is None or publicador.ventana != ventana:
+        publicador = PublicadorPedidos(ventana)
+        _publicadores[loop] = publicador
+    return publicador
@@ -0,0 +1,163 @@
+"""
+Serialización de pedidos con sus productos.
+
+Las listas de pedidos se cargan con `con_lineas`: un prefetch de PedidoItem
+con select_related hasta Plato, de modo que serializar N pedidos cuesta
+siempre 1 + 1 consultas y convertir_producto_a_dict no dispara cargas
+perezosas al recorrer item.sopa.sopa.nombre_plato.
+
+Los pedidos guardan además una copia de sus productos en
+Pedido.productos_snapshot (se escribe al guardar o editar el pedido). Las
+lecturas usan esa copia y solo recurren a las líneas para los pedidos que aún
+no la tienen; el comando `reconciliar_snapshots` la regenera desde las líneas.
+"""
+from decimal import Decimal
+
+from django.db.models import Prefetch, prefetch_related_objects
+
+from .models import PedidoItem
+
+# Orden en que se listan los productos de un pedido
+ORDEN_TIPOS = {tipo: i for i, tipo in enumerate(PedidoItem.COMPONENTES)}
+
+
+def _items_con_platos():
+    return PedidoItem.objects.select_related(
+        'sopa__sopa', 'segundo__segundo', 'jugo__jugo', 'extra').order_by('id')
+
+
+def _prefetch_lineas():
+    return Prefetch('items', queryset=_items_con_platos())
+
+
+def con_lineas(pedidos):
+    """Agrega al queryset de pedidos el prefetch de todas sus líneas y platos."""
+    return pedidos.prefetch_related(_prefetch_lineas())
+
+
+def convertir_producto_a_dict(producto_obj, tipo):
+    """Convierte una línea (PedidoItem) de BD a diccionario JSON"""
+    if tipo == 'Almuerzo':
+        return {
+            'tipo': 'Almuerzo',
+            'sopa_id': producto_obj.sopa.sopa.id,  # Plato ID
+            'segundo_id': producto_obj.segundo.segundo.id,  # Plato ID
+            'jugo_id': producto_obj.jugo.jugo.id,  # Plato ID
+            'cantidad': producto_obj.cantidad,
+            'precio_unitario': float(producto_obj.precio_unitario),
+            'observacion': producto_obj.observacion or '',
+            'componentes': [
+                producto_obj.sopa.sopa.nombre_plato,
+                producto_obj.segundo.segundo.nombre_plato,
+                producto_obj.jugo.jugo.nombre_plato
+            ]
+        }
+    elif tipo == 'Sopa':
+        return {
+            'tipo': 'Sopa',
+            'sopa_id': producto_obj.sopa.sopa.id,  # Plato ID
+            'jugo_id': producto_obj.jugo.jugo.id,  # Plato ID
+            'cantidad': producto_obj.cantidad,
+            'precio_unitario': float(producto_obj.precio_unitario),
+            'observacion': producto_obj.observacion or '',
+            'componentes': [
+                producto_obj.sopa.sopa.nombre_plato,
+                producto_obj.jugo.jugo.nombre_plato
+            ]
+        }
+    elif tipo == 'Segundo':
+        return {
+            'tipo': 'Segundo',
+            'segundo_id': producto_obj.segundo.segundo.id,  # Plato ID
+            'jugo_id': producto_obj.jugo.jugo.id,  # Plato ID
+            'cantidad': producto_obj.cantidad,
+            'precio_unitario': float(producto_obj.precio_unitario),
+            'observacion': producto_obj.observacion or '',
+            'componentes': [
+                producto_obj.segundo.segundo.nombre_plato,
+                producto_obj.jugo.jugo.nombre_plato
+            ]
+        }
+    elif tipo == 'Extra':
+        return {
+            'tipo': 'Extra',
+            'extra_id': producto_obj.extra_id,  # Plato ID
+            'cantidad': producto_obj.cantidad,
+            'precio_unitario': float(producto_obj.precio_unitario),
+            'observacion': producto_obj.observacion or '',
+            'componentes': [
+                producto_obj.extra.nombre_plato
+            ]
+        }
+    return None
+
+
+def lineas_pedido(pedido):
+    """
+    Líneas del pedido ordenadas por tipo (almuerzos, sopas, segundos, extras):
+    las precargadas si las hay; si no, con sus platos en una consulta.
+    """
+    if 'items' in getattr(pedido, '_prefetched_objects_cache', {}):
+        lineas = pedido.items.all()
+    else:
+        lineas = _items_con_platos().filter(pedido=pedido)
+    return sorted(lineas, key=lambda linea: ORDEN_TIPOS[linea.tipo])
+
+
+def obtener_productos_pedido(pedido):
+    """Obtiene todos los productos de un pedido en formato JSON"""
+    return [convertir_producto_a_dict(linea, linea.tipo) for linea in lineas_pedido(pedido)]
+
+
+def productos_de_pedido(pedido):
+    """Productos del pedido desde su snapshot; si no lo tiene, desde las líneas."""
+    if pedido.productos_snapshot is not None:
+        return pedido.productos_snapshot
+    return obtener_productos_pedido(pedido)
+
+
+def precargar_lineas_sin_snapshot(pedidos):
+    """Prefetch de líneas solo para los pedidos que no tienen snapshot."""
+    sin_snapshot = [pedido for pedido in pedidos if pedido.productos_snapshot is None]
+    if sin_snapshot:
+        prefetch_related_objects(sin_snapshot, _prefetch_lineas())
+
+
+def total_lineas(productos):
+    """Total de un pedido a partir de sus productos serializados."""
+    return sum(
+        (Decimal(str(p['precio_unitario'])) * p['cantidad'] for p in productos),
+        Decimal('0.00'),
+    )
+
+
+def serializar_pedidos(pedidos):
+    """
+    Serializa una lista de pedidos. Con snapshot es una sola consulta; las
+    líneas de los pedidos sin snapshot se precargan juntas.
+
+    Returns:
+        list[dict]: Un dict por pedido con sus productos y el total de sus líneas
+    """
+    pedidos = list(pedidos)
+    precargar_lineas_sin_snapshot(pedidos)
+    datos = []
+    for pedido in pedidos:
+        productos = productos_de_pedido(pedido)
+        datos.append({
+            'id': pedido.id,
+            'numero_dia': pedido.numero_dia,
+            'numero_pedido_completo': pedido.numero_pedido_completo,
+            'tipo': pedido.tipo,
+            'forma_pago': pedido.forma_pago,
+            'mesa': pedido.numero_mesa,
+            'contacto': pedido.contacto,
+            'subtipo_reservado': pedido.subtipo_reservado,
+            'observaciones_generales': pedido.observaciones_generales,
+            'fecha_creacion': pedido.fecha_creacion.isoformat(),
+            'estado': pedido.estado,
+            'productos': productos,
+            'total': float(total_lineas(productos)),
+            'version': pedido.version,
+        })
+    return datos
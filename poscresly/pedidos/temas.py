@@ -0,0 +1,95 @@
+"""
+Temas del WebSocket de pedidos (un grupo del channel layer por tema).
+
+'pedidos' es el canal completo que usan las tablets: todos los eventos, con
+contadores y número de secuencia. Las pantallas especializadas se
+suscriben solo a lo que muestran y no reciben ni procesan el resto:
+
+- 'servirse', 'llevar', 'reservados': eventos de los pedidos de ese tipo
+  (un cambio de tipo llega a los dos temas, el anterior y el nuevo)
+- 'stock': 'stock_actualizado' con las cantidades de sopas y segundos que
+  cambiaron (también va al grupo completo: ver mensaje_stock)
+- 'contadores': 'contadores_actualizados' con los pendientes por tipo
+- 'caja': 'caja_actualizada' con los totales de la caja abierta
+
+Los temas no llevan número de secuencia: al suscribirse (o reconectarse) la
+pantalla recibe el estado actual de cada tema.
+"""
+import logging
+
+from .contadores import CLAVES_TIPO
+
+logger = logging.getLogger(__name__)
+
+TEMAS = {
+    'pedidos': 'pedidos',
+    'servirse': 'pedidos.servirse',
+    'llevar': 'pedidos.llevar',
+    'reservados': 'pedidos.reservados',
+    'stock': 'pedidos.stock',
+    'contadores': 'pedidos.contadores',
+    'caja': 'pedidos.caja',
+}
+# Temas que reciben eventos de pedidos (y la foto de pendientes al suscribirse)
+TEMAS_PEDIDOS = ('pedidos', *CLAVES_TIPO.values())
+
+
+def grupos_de_evento(evento):
+    """Grupos de los temas (tipos de pedido o stock) que deben recibir el evento."""
+    if evento['type'] == 'stock_actualizado':
+        return [TEMAS['stock']]
+    if evento['type'] == 'pedidos_marcados_completados':
+        # Solo trae los IDs: lo reciben todos los tipos (cada pantalla quita los suyos)
+        return [TEMAS[tema] for tema in CLAVES_TIPO.values()]
+    tipos = {(evento.get('pedido') or {}).get('tipo'), evento.get('tipo_anterior')}
+    return [TEMAS[tema] for tipo, tema in CLAVES_TIPO.items() if tipo in tipos]
+
+
+def mensaje_stock(actualizadas):
+    """
+    Mensaje 'stock_actualizado' con las filas que devolvió
+    actualizar_cantidades_menu (None si no cambió ninguna).
+
+    Se publica como cualquier evento de pedidos (ver pedidos.publicador): queda
+    en el registro para las reconexiones y el publicador le agrega la versión
+    del stock al enviarlo, para que la tablet descarte lo que llegue fuera de orden.
+    """
+    if not (actualizadas['sopas'] or actualizadas['segundos']):
+        return None
+    return {'type': 'stock_actualizado', 'stock': {
+        clave: {fila['id']: fila['cantidad_actual'] for fila in filas}
+        for clave, filas in actualizadas.items()
+    }}
+
+
+def mensaje_caja():
+    """Mensaje 'caja_actualizada' con los totales actuales (síncrona)."""
+    from caja.resumen import resumen_caja
+
+    return {'type': 'caja_actualizada', 'caja': resumen_caja()}
+
+
+async def aenviar_caja():
+    """Avisa a las pantallas suscritas a 'caja' (desde vistas async)."""
+    from asgiref.sync import sync_to_async
+    from channels.layers import get_channel_layer
+
+    try:
+        channel_layer = get_channel_layer()
+        if channel_layer:
+            await channel_layer.group_send(TEMAS['caja'], await sync_to_async(mensaje_caja)())
+    except Exception as e:
+        logger.warning("Error al enviar los totales de caja por WebSocket: %s", e)
+
+
+def enviar_caja():
+    """Versión síncrona de aenviar_caja (vistas de caja)."""
+    from asgiref.sync import async_to_sync
+    from channels.layers import get_channel_layer
+
+    try:
+        channel_layer = get_channel_layer()
+        if channel_layer:
+            async_to_sync(channel_layer.group_send)(TEMAS['caja'], mensaje_caja())
+    except Exception as e:
+        logger.warning("Error al enviar los totales de caja por WebSocket: %s", e)
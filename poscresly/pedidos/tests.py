@@ -1,3 +1,1342 @@
-from django.test import TestCase
+import asyncio
+import json
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from menu.catalogo import obtener_catalogo
+from menu.models import MenuDia, MenuDiaSopa, MenuDiaSegundo, MenuDiaJugo, Plato
+from .lineas import aplicar_diff_lineas, calcular_diff_lineas, crear_lineas_pedido
+from .models import (
+    Pedido, PedidoAlmuerzo, PedidoSopa, PedidoSegundo, PedidoExtra, SecuenciaDiaria, VersionCambios,
+)
+from .serializadores import obtener_productos_pedido
+
+
+class MenuDelDiaMixin:
+    """Crea un menú de hoy con 2 sopas, 2 segundos, 1 jugo y 2 extras."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.menu = MenuDia.objects.create(fecha=date.today())
+        cls.sopas = [Plato.objects.create(nombre_plato=f'Sopa {i}', tipo='sopa') for i in range(2)]
+        cls.segundos = [Plato.objects.create(nombre_plato=f'Segundo {i}', tipo='segundo') for i in range(2)]
+        cls.jugo = Plato.objects.create(nombre_plato='Jugo', tipo='jugo')
+        cls.extras = [
+            Plato.objects.create(nombre_plato=f'Extra {i}', tipo='extra', precio=Decimal('1.50'))
+            for i in range(2)
+        ]
+        for sopa in cls.sopas:
+            MenuDiaSopa.objects.create(menu=cls.menu, sopa=sopa, cantidad=50)
+        for segundo in cls.segundos:
+            MenuDiaSegundo.objects.create(menu=cls.menu, segundo=segundo, cantidad=50)
+        MenuDiaJugo.objects.create(menu=cls.menu, jugo=cls.jugo)
+
+    def carrito(self, repeticiones=1):
+        """Carrito con un producto de cada tipo, repetido `repeticiones` veces."""
+        productos = []
+        for i in range(repeticiones):
+            sopa = self.sopas[i % 2].id
+            segundo = self.segundos[i % 2].id
+            productos += [
+                {'tipo': 'Almuerzo', 'sopa_id': sopa, 'segundo_id': segundo, 'jugo_id': self.jugo.id,
+                 'cantidad': 1, 'precio_unitario': 3.5, 'observacion': ''},
+                {'tipo': 'Sopa', 'sopa_id': sopa, 'jugo_id': self.jugo.id,
+                 'cantidad': 2, 'precio_unitario': 1.5, 'observacion': 'sin sal'},
+                {'tipo': 'Segundo', 'segundo_id': segundo, 'jugo_id': self.jugo.id,
+                 'cantidad': 1, 'precio_unitario': 2.5, 'observacion': ''},
+                {'tipo': 'Extra', 'extras_ids': f'{self.extras[0].id},{self.extras[1].id}',
+                 'cantidad': 1, 'precio_unitario': 3.0, 'observacion': ''},
+            ]
+        return productos
+
+
+class CrearLineasPedidoTests(MenuDelDiaMixin, TestCase):
+
+    def test_consultas_fijas_sin_importar_cantidad_de_lineas(self):
+        pedido_corto = Pedido.objects.create(tipo='Servirse')
+        pedido_largo = Pedido.objects.create(tipo='Servirse')
+        obtener_catalogo()
+
+        # 1 resolución del menú + 1 bulk_create (extras y nombres salen del catálogo)
+        with self.assertNumQueries(2):
+            crear_lineas_pedido(pedido_corto, self.carrito(1))
+        with self.assertNumQueries(2):
+            crear_lineas_pedido(pedido_largo, self.carrito(6))
+
+        self.assertEqual(pedido_largo.almuerzos.count(), 6)
+        self.assertEqual(pedido_largo.sopas.count(), 6)
+        self.assertEqual(pedido_largo.segundos.count(), 6)
+        self.assertEqual(pedido_largo.extras.count(), 12)
+
+    def test_resuelve_componentes_del_menu_de_hoy(self):
+        # Un menú anterior con los mismos platos no debe usarse
+        menu_viejo = MenuDia.objects.create(fecha=date(2020, 1, 1))
+        MenuDiaSopa.objects.create(menu=menu_viejo, sopa=self.sopas[0], cantidad=5)
+
+        pedido = Pedido.objects.create(tipo='Llevar')
+        crear_lineas_pedido(pedido, self.carrito(1))
+
+        almuerzo = PedidoAlmuerzo.objects.get(pedido=pedido)
+        self.assertEqual(almuerzo.sopa.menu, self.menu)
+        self.assertEqual(PedidoSopa.objects.get(pedido=pedido).observacion, 'sin sal')
+        self.assertEqual(PedidoSegundo.objects.get(pedido=pedido).segundo.segundo, self.segundos[0])
+        self.assertEqual(
+            set(PedidoExtra.objects.filter(pedido=pedido).values_list('precio_unitario', flat=True)),
+            {Decimal('1.50')},
+        )
+
+    def test_solo_extras_no_consulta_el_menu(self):
+        pedido = Pedido.objects.create(tipo='Llevar')
+        obtener_catalogo()
+        with CaptureQueriesContext(connection) as ctx:
+            crear_lineas_pedido(pedido, self.carrito(1)[3:])
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+
+class SecuenciaDiariaTests(TestCase):
+
+    def test_numeracion_consecutiva_por_dia(self):
+        pedidos = [Pedido.objects.create(tipo='Servirse') for _ in range(3)]
+        self.assertEqual([p.numero_dia for p in pedidos], [1, 2, 3])
+        self.assertEqual(pedidos[2].numero_pedido_completo, '003')
+
+    def test_reservar_bloque(self):
+        hoy = date.today()
+        self.assertEqual(SecuenciaDiaria.reservar(hoy), 1)
+        self.assertEqual(SecuenciaDiaria.reservar(hoy, cantidad=5), 2)
+        self.assertEqual(SecuenciaDiaria.reservar(hoy), 7)
+        # Cada día empieza en 1
+        self.assertEqual(SecuenciaDiaria.reservar(date(2020, 1, 1)), 1)
+
+    def test_reservar_es_una_sola_consulta(self):
+        with self.assertNumQueries(1):
+            SecuenciaDiaria.reservar(date.today())
+
+
+class DiffLineasTests(MenuDelDiaMixin, TestCase):
+
+    def editar(self, pedido, carrito, agregar=False):
+        diff = calcular_diff_lineas(pedido, carrito, agregar=agregar)
+        aplicar_diff_lineas(diff)
+        return diff
+
+    def consultas_edicion(self, repeticiones):
+        pedido = Pedido.objects.create(tipo='Reservado')
+        crear_lineas_pedido(pedido, self.carrito(repeticiones))
+        carrito = self.carrito(repeticiones)
+        carrito[0]['cantidad'] = 4      # actualizar
+        del carrito[1]                  # eliminar
+        carrito.append({'tipo': 'Sopa', 'sopa_id': self.sopas[1].id, 'jugo_id': self.jugo.id,
+                        'cantidad': 1, 'precio_unitario': 1.5, 'observacion': 'nueva'})  # insertar
+        with CaptureQueriesContext(connection) as ctx:
+            self.editar(pedido, carrito)
+        return len(ctx.captured_queries)
+
+    def test_consultas_fijas_al_editar(self):
+        self.assertEqual(self.consultas_edicion(1), self.consultas_edicion(8))
+
+    def test_edicion_reemplaza_lineas_y_calcula_stock(self):
+        pedido = Pedido.objects.create(tipo='Servirse')
+        crear_lineas_pedido(pedido, self.carrito(1))
+        original = PedidoAlmuerzo.objects.get(pedido=pedido)
+
+        carrito = self.carrito(1)
+        carrito[0]['cantidad'] = 3
+        carrito = carrito[:1] + carrito[2:3]  # sin la sopa ni los extras
+        diff = self.editar(pedido, carrito)
+
+        # La línea existente se actualiza en su lugar, no se recrea
+        self.assertEqual(PedidoAlmuerzo.objects.get(pedido=pedido).id, original.id)
+        self.assertFalse(pedido.sopas.exists())
+        self.assertFalse(pedido.extras.exists())
+        self.assertEqual(diff['total'], Decimal('3.5') * 3 + Decimal('2.5'))
+        self.assertEqual(len(diff['productos']), 2)
+        stock = {(p['tipo'], p['sopa_id'], p['segundo_id']): p['cantidad'] for p in diff['stock']}
+        self.assertEqual(stock, {
+            ('almuerzo', self.sopas[0].id, self.segundos[0].id): 2,
+            ('sopa', self.sopas[0].id, None): -2,
+        })
+
+    def test_lineas_sin_jugo(self):
+        # Líneas guardadas sin jugo (desde el admin o anteriores a que fuera obligatorio)
+        pedido = Pedido.objects.create(tipo='Servirse')
+        crear_lineas_pedido(pedido, self.carrito(1))
+        pedido.items.update(jugo=None)
+        original = PedidoAlmuerzo.objects.get(pedido=pedido)
+
+        carrito = [{k: v for k, v in producto.items() if k != 'jugo_id'} for producto in self.carrito(1)]
+
+        carrito[0]['cantidad'] = 2
+        diff = self.editar(pedido, carrito)
+
+        # Sin jugo las líneas se reconocen igual y se actualizan en su lugar
+        self.assertEqual(PedidoAlmuerzo.objects.get(pedido=pedido).id, original.id)
+        self.assertEqual(PedidoAlmuerzo.objects.get(pedido=pedido).cantidad, 2)
+        self.assertEqual((diff['insertar'], diff['eliminar']), ([], []))
+        self.assertEqual(len(diff['productos']), 5)
+        self.assertIsNone(diff['productos'][0]['jugo_id'])
+
+    def test_agregar_suma_sin_eliminar(self):
+        pedido = Pedido.objects.create(tipo='Llevar')
+        crear_lineas_pedido(pedido, self.carrito(1))
+
+        diff = self.editar(pedido, self.carrito(1)[:1], agregar=True)
+
+        self.assertEqual(PedidoAlmuerzo.objects.get(pedido=pedido).cantidad, 2)
+        self.assertTrue(pedido.sopas.exists())
+        self.assertEqual(pedido.extras.count(), 2)
+        self.assertEqual(diff['stock'], [
+            {'tipo': 'almuerzo', 'sopa_id': self.sopas[0].id, 'segundo_id': self.segundos[0].id, 'cantidad': 1},
+        ])
+        self.assertEqual(diff['total'], Decimal('3.5') * 2 + Decimal('1.5') * 2 + Decimal('2.5') + Decimal('3.00'))
+
+
+class ActualizarCantidadesMenuTests(MenuDelDiaMixin, TestCase):
+
+    def test_un_update_por_tabla_con_deltas_agregados(self):
+        from .views import actualizar_cantidades_menu
+
+        with self.assertNumQueries(2):
+            actualizadas = actualizar_cantidades_menu(self.carrito(6), 'restar')
+
+        sopas = {f['plato_id']: f['cantidad_actual'] for f in actualizadas['sopas']}
+        segundos = {f['plato_id']: f['cantidad_actual'] for f in actualizadas['segundos']}
+        # Cada repetición: almuerzo (1) + sopa (2) o + segundo (1); 3 repeticiones por plato
+        self.assertEqual(sopas, {self.sopas[0].id: 41, self.sopas[1].id: 41})
+        self.assertEqual(segundos, {self.segundos[0].id: 44, self.segundos[1].id: 44})
+        self.assertEqual(MenuDiaSopa.objects.get(sopa=self.sopas[0]).cantidad_actual, 41)
+
+    def test_stock_no_baja_de_cero(self):
+        from .views import actualizar_cantidades_menu
+
+        actualizar_cantidades_menu([{'tipo': 'sopa', 'sopa_id': self.sopas[0].id, 'cantidad': 80}], 'restar')
+        self.assertEqual(MenuDiaSopa.objects.get(sopa=self.sopas[0]).cantidad_actual, 0)
+
+    def test_sin_deltas_no_consulta(self):
+        from .views import actualizar_cantidades_menu
+
+        with self.assertNumQueries(0):
+            actualizar_cantidades_menu(self.carrito(1)[3:], 'restar')
+
+
+class TicketsCocinaTests(MenuDelDiaMixin, TestCase):
+
+    def test_componer_ticket(self):
+        from .tickets import ANCHO_TICKET, componer_ticket_cocina
+
+        pedido_data = {'tipo': 'Servirse', 'mesa': '4', 'numero_pedido_completo': '007',
+                       'observaciones_generales': 'rápido'}
+        productos = [{'tipo': 'Almuerzo', 'cantidad': 2, 'componentes': ['Sopa 0', 'Segundo 0'],
+                      'observacion': 'sin sal'}]
+        lineas = componer_ticket_cocina(pedido_data, productos, hora='12:30')
+
+        self.assertEqual(lineas[0], 'SERVIRSE' + ' ' * 29 + 'MESA: 4')
+        self.assertEqual(len(lineas[1]), ANCHO_TICKET)
+        self.assertTrue(lineas[1].endswith('Hora: 12:30'))
+        self.assertEqual(lineas[2:], ['  rápido', '-' * ANCHO_TICKET, '2x Almuerzo',
+                                      '  - Sopa 0', '  - Segundo 0', '  Obs: sin sal', ''])
+
+    def test_ticket_se_envia_despues_del_commit(self):
+        from unittest import mock
+        from .tickets import cola_tickets
+
+        with mock.patch('pedidos.views.enviar_trabajo_impresion') as enviar:
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                respuesta = self.client.post('/guardar-pedido/', {
+                    'tipo_pedido': 'Llevar', 'cliente': 'Ana', 'forma_pago': 'efectivo',
+                    'productos_carrito': json.dumps(self.carrito(1)),
+                })
+            self.assertEqual(respuesta.json()['status'], 'ok')
+            # Nada se envía mientras la transacción no se confirma
+            enviar.assert_not_called()
+
+            procesados = cola_tickets.estadisticas()['procesados']
+            for callback in callbacks:
+                callback()
+            cola_tickets.esperar()
+
+        contenido = enviar.call_args.args[1]
+        self.assertIn('  - Extra 0', contenido)
+        self.assertTrue(contenido[0].endswith('ANA'))
+        self.assertEqual(cola_tickets.estadisticas()['procesados'], procesados + 1)
+
+        estado = self.client.get('/estado-cola-impresion/').json()
+        self.assertEqual(estado['cola']['pendientes'], 0)
+
+
+class GuardarPedidoIdempotenteTests(MenuDelDiaMixin, TestCase):
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def enviar(self, clave, **extra):
+        datos = {'tipo_pedido': 'Servirse', 'mesa': '2', 'forma_pago': 'efectivo',
+                 'imprimir': 'false', 'productos_carrito': json.dumps(self.carrito(1))}
+        datos.update(extra)
+        return self.client.post('/guardar-pedido/', datos, HTTP_IDEMPOTENCY_KEY=clave)
+
+    def test_reintento_devuelve_la_misma_respuesta_sin_consultas(self):
+        primera = self.enviar('abc')
+        with self.assertNumQueries(0):
+            reintento = self.enviar('abc')
+
+        self.assertEqual(reintento.json(), primera.json())
+        self.assertEqual(reintento['Idempotent-Replay'], 'true')
+        self.assertEqual(Pedido.objects.count(), 1)
+        self.assertEqual(MenuDiaSopa.objects.get(sopa=self.sopas[0]).cantidad_actual, 47)
+
+    def test_misma_clave_con_otros_datos(self):
+        self.enviar('abc')
+        respuesta = self.enviar('abc', mesa='3')
+        self.assertEqual(respuesta.status_code, 422)
+        self.assertEqual(Pedido.objects.count(), 1)
+
+    def test_sin_clave_no_deduplica(self):
+        self.enviar('')
+        self.enviar('')
+        self.assertEqual(Pedido.objects.count(), 2)
+
+    def test_duplicado_en_curso_espera_el_resultado(self):
+        from django.core.cache import cache
+        from unittest import mock
+        from . import idempotencia
+
+        # Otra petición con la misma clave tiene el candado y termina mientras esta espera
+        cache.add('idem:guardar_pedido:abc:candado', 1)
+        guardada = {'huella': 'h', 'status_code': 200, 'data': {'status': 'ok', 'pedido_id': 99}}
+
+        async def terminar_primera(_):
+            await cache.aset('idem:guardar_pedido:abc', guardada)
+
+        with mock.patch.object(idempotencia, '_huella', return_value='h'), \
+                mock.patch.object(idempotencia.asyncio, 'sleep', side_effect=terminar_primera):
+            respuesta = self.enviar('abc')
+
+        self.assertEqual(respuesta.json()['pedido_id'], 99)
+        self.assertFalse(Pedido.objects.exists())
+
+
+class GuardarPedidoSinCatalogoTests(MenuDelDiaMixin, TestCase):
+
+    def test_guardar_no_consulta_platos_ni_productos(self):
+        from menu.models import Producto
+        Producto.objects.create(nombre_producto='almuerzo', precio_servirse=Decimal('3.50'),
+                                precio_llevar=Decimal('3.75'))
+        obtener_catalogo()
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post('/agregar-al-carrito/', {'tipo': 'Almuerzo'})
+            self.client.post('/agregar-al-carrito/', {
+                'tipo': 'Extra', 'extras_ids': f'{self.extras[0].id},{self.extras[1].id}'})
+            respuesta = self.client.post('/guardar-pedido/', {
+                'tipo_pedido': 'Servirse', 'mesa': '1', 'forma_pago': 'efectivo', 'imprimir': 'false',
+                'productos_carrito': json.dumps(self.carrito(2)),
+            })
+
+        self.assertEqual(respuesta.json()['status'], 'ok')
+        tablas = ' '.join(q['sql'] for q in ctx.captured_queries)
+        self.assertNotIn('"menu_plato"', tablas)
+        self.assertNotIn('"menu_producto"', tablas)
+
+
+class GuardarPedidoV2Tests(MenuDelDiaMixin, TestCase):
+
+    def cuerpo(self, **extra):
+        productos = self.carrito(1)
+        productos[3]['extras_ids'] = [self.extras[0].id, self.extras[1].id]
+        data = {'tipo_pedido': 'Llevar', 'cliente': 'Ana', 'imprimir': False, 'productos': productos}
+        data.update(extra)
+        return data
+
+    def enviar(self, data):
+        return self.client.post('/v2/guardar-pedido/', json.dumps(data), content_type='application/json')
+
+    def test_crea_pedido_desde_json(self):
+        respuesta = self.enviar(self.cuerpo())
+
+        self.assertEqual(respuesta.status_code, 200)
+        pedido = Pedido.objects.get(id=respuesta.json()['pedido_id'])
+        self.assertEqual(pedido.total, Decimal('3.5') + Decimal('3.0') + Decimal('2.5') + Decimal('3.00'))
+        self.assertEqual(pedido.forma_pago, 'Efectivo')
+        self.assertEqual(pedido.extras.count(), 2)
+
+    def test_errores_por_linea(self):
+        data = self.cuerpo(tipo_pedido='Domicilio')
+        data['productos'][0]['cantidad'] = 0
+        del data['productos'][1]['sopa_id']
+        data['productos'][3]['extras_ids'] = ['a']
+
+        respuesta = self.enviar(data)
+
+        self.assertEqual(respuesta.status_code, 400)
+        errores = {(e.get('linea'), e['campo']) for e in respuesta.json()['errores']}
+        self.assertEqual(errores, {(None, 'tipo_pedido'), (0, 'cantidad'), (1, 'sopa_id'), (3, 'extras_ids')})
+        self.assertFalse(Pedido.objects.exists())
+
+    def test_cuerpo_invalido(self):
+        respuesta = self.client.post('/v2/guardar-pedido/', '{"tipo_pedido":', content_type='application/json')
+        self.assertEqual(respuesta.status_code, 400)
+        respuesta = self.client.post('/v2/guardar-pedido/', {'tipo_pedido': 'Llevar'})
+        self.assertEqual(respuesta.status_code, 415)
+
+
+# Los eventos se leen de a uno: sin la ventana del publicador
+@override_settings(WS_VENTANA_AGRUPACION_MS=0)
+class PedidosAsyncTests(MenuDelDiaMixin, TestCase):
+
+    def crear(self):
+        respuesta = self.client.post('/guardar-pedido/', {
+            'tipo_pedido': 'Servirse', 'mesa': '1', 'forma_pago': 'Efectivo', 'imprimir': 'false',
+            'productos_carrito': json.dumps(self.carrito(1)),
+        })
+        return Pedido.objects.get(id=respuesta.json()['pedido_id'])
+
+    def ventas_efectivo(self):
+        from caja.models import CajaEfectivo
+        return CajaEfectivo.objects.get(caja_diaria__estado='abierta').total_ventas
+
+    def test_completar_suma_a_caja_una_sola_vez(self):
+        pedido = self.crear()
+        for _ in range(2):
+            respuesta = self.client.post('/marcar-completado/', {'pedido_id': pedido.id})
+            self.assertEqual(respuesta.json()['status'], 'ok')
+
+        self.assertEqual(self.ventas_efectivo(), pedido.total)
+        self.assertEqual(self.client.post('/marcar-completado/', {'pedido_id': 999}).status_code, 404)
+
+    def test_completar_varios_suma_a_caja(self):
+        pedidos = [self.crear(), self.crear()]
+        respuesta = self.client.post('/marcar-pedidos-completados/',
+                                     json.dumps({'pedido_ids': [p.id for p in pedidos]}),
+                                     content_type='application/json')
+
+        self.assertEqual(respuesta.json()['pedidos_actualizados'], 2)
+        self.assertEqual(self.ventas_efectivo(), sum(p.total for p in pedidos))
+        self.assertFalse(Pedido.objects.filter(estado='pendiente').exists())
+
+    def test_eliminar_devuelve_stock_y_notifica(self):
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+
+        pedido = self.crear()
+        capa = get_channel_layer()
+        canal = async_to_sync(capa.new_channel)()
+        async_to_sync(capa.group_add)('pedidos', canal)
+
+        respuesta = self.client.post('/eliminar-pedido/', {'pedido_id': pedido.id})
+
+        self.assertEqual(respuesta.json()['status'], 'ok')
+        self.assertFalse(Pedido.objects.filter(id=pedido.id).exists())
+        self.assertEqual(MenuDiaSopa.objects.get(sopa=self.sopas[0]).cantidad_actual, 50)
+        mensaje = async_to_sync(capa.receive)(canal)
+        self.assertEqual(mensaje['type'], 'pedido_eliminado')
+        self.assertEqual(mensaje['pedido']['id'], pedido.id)
+        async_to_sync(capa.group_discard)('pedidos', canal)
+
+    def test_eliminar_dos_veces_devuelve_el_stock_una_vez(self):
+        from .models import PedidoEliminado
+        from .views import _eliminar_pedido_en_bd
+
+        pedido = self.crear()
+        completado = self.crear()
+        self.assertEqual(MenuDiaSopa.objects.get(sopa=self.sopas[0]).cantidad_actual, 44)
+
+        for _ in range(2):
+            respuesta = self.client.post('/eliminar-pedido/', {'pedido_id': pedido.id})
+        self.assertEqual(respuesta.status_code, 404)
+        self.assertEqual(MenuDiaSopa.objects.get(sopa=self.sopas[0]).cantidad_actual, 47)
+        self.assertEqual(PedidoEliminado.objects.filter(pedido_id=pedido.id).count(), 1)
+
+        # Eliminación que llega después de completar (leyó el pedido aún pendiente):
+        # el pedido se vuelve a leer dentro de la transacción y no se toca el stock
+        self.client.post('/marcar-completado/', {'pedido_id': completado.id})
+        with self.assertRaises(Pedido.DoesNotExist):
+            _eliminar_pedido_en_bd(completado.id)
+        self.assertEqual(MenuDiaSopa.objects.get(sopa=self.sopas[0]).cantidad_actual, 47)
+        self.assertTrue(Pedido.objects.filter(id=completado.id).exists())
+
+
+class SerializarPedidosTests(MenuDelDiaMixin, TestCase):
+
+    def crear_pedidos(self, cantidad, estado='pendiente'):
+        for _ in range(cantidad):
+            pedido = Pedido.objects.create(tipo='Servirse', estado=estado)
+            crear_lineas_pedido(pedido, self.carrito(2))
+
+    def consultas(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            respuesta = self.client.get(url)
+        self.assertEqual(respuesta.json()['status'], 'ok')
+        return len(ctx.captured_queries), respuesta.json()['pedidos']
+
+    def test_listas_con_consultas_fijas(self):
+        for url in ('/obtener-pedidos-pendientes/', '/obtener-pedidos-por-tipo/?tipo=servirse'):
+            Pedido.objects.all().delete()
+            self.crear_pedidos(1)
+            pocos, _ = self.consultas(url)
+            self.crear_pedidos(7)
+            muchos, pedidos = self.consultas(url)
+
+            self.assertEqual(pocos, muchos, url)
+            self.assertEqual(len(pedidos), 8)
+            self.assertEqual(len(pedidos[0]['productos']), 10)
+            self.assertEqual(pedidos[0]['productos'][0]['componentes'], ['Sopa 0', 'Segundo 0', 'Jugo'])
+            self.assertEqual(pedidos[0]['total'], 2 * (3.5 + 1.5 * 2 + 2.5) + 4 * 1.5)
+
+
+class SnapshotProductosTests(MenuDelDiaMixin, TestCase):
+
+    def guardar(self, productos=None, **extra):
+        data = {'tipo_pedido': 'Servirse', 'mesa': '2', 'forma_pago': 'Efectivo', 'imprimir': 'false',
+                'productos_carrito': json.dumps(productos or self.carrito(2))}
+        data.update(extra)
+        respuesta = self.client.post('/guardar-pedido/', data)
+        return Pedido.objects.get(id=respuesta.json()['pedido_id'])
+
+    def test_guardar_escribe_snapshot(self):
+        pedido = self.guardar()
+        self.assertEqual(pedido.productos_snapshot, obtener_productos_pedido(pedido))
+
+        pedido = self.guardar(pedido_id=pedido.id, productos=self.carrito(1))
+        # Almuerzo, sopa, segundo y una línea por cada uno de los 2 extras
+        self.assertEqual(len(pedido.productos_snapshot), 5)
+        self.assertEqual(pedido.productos_snapshot, obtener_productos_pedido(pedido))
+
+    def test_lecturas_en_una_consulta(self):
+        pedido = self.guardar()
+        for _ in range(3):
+            self.guardar()
+
+        # Versión actual + lista
+        with self.assertNumQueries(2):
+            datos = self.client.get('/obtener-pedidos-por-tipo/?tipo=servirse').json()
+        self.assertEqual(len(datos['pedidos']), 4)
+        self.assertEqual(datos['pedidos'][-1]['productos'], pedido.productos_snapshot)
+
+        with self.assertNumQueries(1):
+            datos = self.client.get(f'/obtener-pedido/{pedido.id}/').json()
+        self.assertEqual(datos['pedido']['productos'], pedido.productos_snapshot)
+
+    def test_reconciliar_regenera_snapshots(self):
+        desactualizado = self.guardar()
+        sin_snapshot = self.guardar()
+        correcto = self.guardar()
+        Pedido.objects.filter(id=desactualizado.id).update(productos_snapshot=[])
+        Pedido.objects.filter(id=sin_snapshot.id).update(productos_snapshot=None)
+
+        salida = StringIO()
+        call_command('reconciliar_snapshots', stdout=salida)
+
+        self.assertIn('3 pedidos revisados, 2 corregidos', salida.getvalue())
+        for pedido in (desactualizado, sin_snapshot, correcto):
+            pedido.refresh_from_db()
+            self.assertEqual(pedido.productos_snapshot, obtener_productos_pedido(pedido))
+
+
+class PedidoItemTests(MenuDelDiaMixin, TestCase):
+
+    def test_proxies_por_tipo(self):
+        pedido = Pedido.objects.create(tipo='Servirse')
+        crear_lineas_pedido(pedido, self.carrito(1))
+        sopa = PedidoSopa.objects.create(
+            pedido=pedido, sopa=MenuDiaSopa.objects.first(), jugo=MenuDiaJugo.objects.first(),
+            precio_unitario=Decimal('1.50'))
+
+        self.assertEqual(sopa.tipo, 'Sopa')
+        self.assertEqual(pedido.items.count(), 6)
+        self.assertEqual(pedido.sopas.count(), 2)
+        self.assertEqual(PedidoExtra.objects.filter(pedido=pedido).count(), 2)
+        self.assertEqual(
+            [p['tipo'] for p in obtener_productos_pedido(pedido)],
+            ['Almuerzo', 'Sopa', 'Sopa', 'Segundo', 'Extra', 'Extra'],
+        )
+
+    def test_cargar_y_totalizar_en_una_consulta(self):
+        from .views import calcular_total_pedido
+
+        pedido = Pedido.objects.create(tipo='Servirse')
+        crear_lineas_pedido(pedido, self.carrito(3))
+
+        with self.assertNumQueries(1):
+            productos = obtener_productos_pedido(pedido)
+        with self.assertNumQueries(1):
+            total = calcular_total_pedido(pedido)
+        self.assertEqual(len(productos), 15)
+        self.assertEqual(total, 3 * (Decimal('3.5') + Decimal('3.0') + Decimal('2.5') + Decimal('3.00')))
+
+
+class MigracionPedidoItemTests(TransactionTestCase):
+    """0021 mueve las líneas de las 4 tablas a PedidoItem (y el reverso las devuelve)."""
+    antes = [('pedidos', '0020_pedidoitem')]
+    despues = [('pedidos', '0021_copiar_lineas_a_pedidoitem')]
+
+    def migrar(self, destino):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(destino)
+        return executor.loader.project_state(destino).apps
+
+    def tearDown(self):
+        self.migrar(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_copia_lineas(self):
+        apps = self.migrar(self.antes)
+        menu = apps.get_model('menu', 'MenuDia').objects.create(fecha=date.today())
+        plato = apps.get_model('menu', 'Plato')
+        sopa = apps.get_model('menu', 'MenuDiaSopa').objects.create(
+            menu=menu, sopa=plato.objects.create(nombre_plato='Sopa', tipo='sopa'), cantidad=5)
+        jugo = apps.get_model('menu', 'MenuDiaJugo').objects.create(
+            menu=menu, jugo=plato.objects.create(nombre_plato='Jugo', tipo='jugo'))
+        extra = plato.objects.create(nombre_plato='Extra', tipo='extra', precio=Decimal('1.50'))
+        pedido = apps.get_model('pedidos', 'Pedido').objects.create(tipo='Llevar')
+        apps.get_model('pedidos', 'PedidoSopa').objects.create(
+            pedido=pedido, sopa=sopa, jugo=jugo, postre='Gelatina', cantidad=2,
+            precio_unitario=Decimal('1.50'), observacion='sin sal')
+        apps.get_model('pedidos', 'PedidoExtra').objects.create(
+            pedido=pedido, extra=extra, precio_unitario=Decimal('1.50'))
+
+        apps = self.migrar(self.despues)
+        items = apps.get_model('pedidos', 'PedidoItem').objects.order_by('id')
+        self.assertEqual(
+            [(i.tipo, i.sopa_id, i.jugo_id, i.extra_id, i.cantidad, i.postre, i.observacion) for i in items],
+            [('Sopa', sopa.id, jugo.id, None, 2, 'Gelatina', 'sin sal'),
+             ('Extra', None, None, extra.id, 1, '', None)],
+        )
+
+        apps = self.migrar(self.antes)
+        self.assertFalse(apps.get_model('pedidos', 'PedidoItem').objects.exists())
+        self.assertEqual(apps.get_model('pedidos', 'PedidoSopa').objects.get().postre, 'Gelatina')
+
+
+# Los eventos se leen de a uno: sin la ventana del publicador
+@override_settings(WS_VENTANA_AGRUPACION_MS=0)
+class ContadoresPendientesTests(MenuDelDiaMixin, TestCase):
+
+    def setUp(self):
+        # Los contadores viven en la caché, que no se revierte entre pruebas
+        cache.clear()
+
+    def guardar(self, tipo, **extra):
+        data = {'tipo_pedido': tipo, 'forma_pago': 'Efectivo', 'imprimir': 'false',
+                'productos_carrito': json.dumps(self.carrito(1))}
+        data.update(extra)
+        with self.captureOnCommitCallbacks(execute=True):
+            respuesta = self.client.post('/guardar-pedido/', data)
+        return Pedido.objects.get(id=respuesta.json()['pedido_id'])
+
+    def contadores(self):
+        return self.client.get('/obtener-contadores-tabs/').json()['contadores']
+
+    def test_se_ajustan_sin_contar_la_tabla(self):
+        self.assertEqual(self.contadores(), {'todos': 0, 'servirse': 0, 'llevar': 0, 'reservados': 0})
+        servirse = self.guardar('Servirse', mesa='3')
+        llevar = self.guardar('Llevar', cliente='Ana')
+        otro_llevar = self.guardar('Llevar', cliente='Luis')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.contadores(), {'todos': 3, 'servirse': 1, 'llevar': 2, 'reservados': 0})
+
+        # Cambiar de tipo, completar y eliminar
+        self.guardar('Reservado', cliente='Ana', subtipo_reservado='llevar', pedido_id=str(llevar.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/marcar-completado/', {'pedido_id': servirse.id})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/eliminar-pedido/', {'pedido_id': otro_llevar.id})
+
+        esperado = {'todos': 1, 'servirse': 0, 'llevar': 0, 'reservados': 1}
+        with self.assertNumQueries(0):
+            self.assertEqual(self.contadores(), esperado)
+        cache.clear()
+        self.assertEqual(self.contadores(), esperado)
+
+    def test_recuento_no_pisa_un_ajuste_concurrente(self):
+        from .contadores import _ajustar, _clave, recalcular_contadores
+
+        def completar_al_contar(pedido):
+            # Completa `pedido` (y ajusta) justo después de la consulta del recuento
+            def envoltura(execute, sql, params, many, context):
+                resultado = execute(sql, params, many, context)
+                if 'GROUP BY' in sql:
+                    Pedido.objects.filter(id=pedido.id).update(estado='completado')
+                    _ajustar({'Llevar': -1})
+                return resultado
+            return connection.execute_wrapper(envoltura)
+
+        self.contadores()
+        primero = self.guardar('Llevar', cliente='Ana')
+        segundo = self.guardar('Llevar', cliente='Luis')
+        self.assertEqual(self.contadores()['llevar'], 2)
+
+        # Falta otro contador: el de 'Llevar' ya ajustado no se pisa con lo contado antes
+        cache.delete(_clave('Servirse'))
+        with completar_al_contar(primero):
+            recalcular_contadores()
+        self.assertEqual(cache.get(_clave('Llevar')), 1)
+        self.assertEqual(self.contadores()['llevar'], 1)
+
+        # Faltan todos (el ajuste no encuentra el contador): el recuento no se guarda
+        cache.delete_many([_clave(tipo) for tipo in ('Servirse', 'Llevar', 'Reservado')])
+        with completar_al_contar(segundo):
+            recalcular_contadores()
+        self.assertIsNone(cache.get(_clave('Llevar')))
+        self.assertEqual(self.contadores()['llevar'], 0)
+
+    def test_eventos_websocket_llevan_contadores(self):
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+
+        capa = get_channel_layer()
+        canal = async_to_sync(capa.new_channel)()
+        async_to_sync(capa.group_add)('pedidos', canal)
+        self.guardar('Llevar', cliente='Ana')
+
+        mensaje = async_to_sync(capa.receive)(canal)
+        self.assertEqual(mensaje['type'], 'pedido_creado')
+        self.assertEqual(set(mensaje['contadores']), {'todos', 'servirse', 'llevar', 'reservados'})
+        async_to_sync(capa.group_discard)('pedidos', canal)
+
+
+# Los eventos se leen de a uno: sin la ventana del publicador
+@override_settings(WS_VENTANA_AGRUPACION_MS=0)
+class CambiosDesdeVersionTests(MenuDelDiaMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def crear(self, tipo='Servirse'):
+        pedido = Pedido.objects.create(tipo=tipo)
+        crear_lineas_pedido(pedido, self.carrito(1))
+        return pedido
+
+    def delta(self, version, tipo='todos'):
+        return self.client.get(f'/obtener-pedidos-por-tipo/?tipo={tipo}&since={version}').json()
+
+    def test_version_monotona_en_cada_cambio(self):
+        pedido = self.crear()
+        primera = pedido.version
+        pedido.save()
+        self.assertGreater(pedido.version, primera)
+        self.assertEqual(VersionCambios.actual(), pedido.version)
+
+    def test_version_al_final_de_la_transaccion(self):
+        from pedidos.cambios import transaccion_versionada
+
+        antes = VersionCambios.actual()
+        with transaccion_versionada():
+            pedido = self.crear()
+            otro = self.crear('Llevar')
+            # El contador no se toca (ni se bloquea) hasta el final del bloque
+            self.assertEqual(VersionCambios.actual(), antes)
+        self.assertEqual(VersionCambios.actual(), antes + 1)
+        self.assertEqual((pedido.version, otro.version), (antes + 1, antes + 1))
+        otro.refresh_from_db()
+        self.assertEqual(otro.version, antes + 1)
+
+    def test_solo_devuelve_lo_que_cambio(self):
+        viejo = self.crear()
+        completado = self.crear()
+        eliminado = self.crear('Llevar')
+        cambia_tipo = self.crear()
+        version = self.client.get('/obtener-pedidos-por-tipo/?tipo=servirse').json()['version']
+
+        nuevo = self.crear()
+        self.client.post('/marcar-completado/', {'pedido_id': completado.id})
+        self.client.post('/eliminar-pedido/', {'pedido_id': eliminado.id})
+        cambia_tipo.tipo = 'Llevar'
+        cambia_tipo.save()
+
+        datos = self.delta(version, 'servirse')
+        self.assertTrue(datos['delta'])
+        self.assertEqual([p['id'] for p in datos['pedidos']], [nuevo.id])
+        self.assertEqual(set(datos['eliminados']), {completado.id, eliminado.id, cambia_tipo.id})
+        self.assertNotIn(viejo.id, datos['eliminados'])
+        self.assertEqual(datos['version'], VersionCambios.actual())
+
+        # Sin cambios nuevos la respuesta queda vacía
+        sin_cambios = self.delta(datos['version'], 'servirse')
+        self.assertEqual((sin_cambios['pedidos'], sin_cambios['eliminados']), ([], []))
+
+    def test_bajas_purgadas_devuelven_lista_completa(self):
+        from datetime import timedelta
+        from pedidos.cambios import purgar_eliminados
+
+        pendiente = self.crear()
+        eliminado = self.crear()
+        self.client.post('/eliminar-pedido/', {'pedido_id': eliminado.id})
+        self.assertEqual(self.delta(0)['eliminados'], [eliminado.id])
+
+        self.assertEqual(purgar_eliminados(timezone.now() + timedelta(seconds=1)), 1)
+        datos = self.delta(0)
+        self.assertNotIn('delta', datos)
+        self.assertEqual([p['id'] for p in datos['pedidos']], [pendiente.id])
+        # Desde la versión actual sigue habiendo delta
+        self.assertTrue(self.delta(datos['version'])['delta'])
+
+    def test_since_invalido(self):
+        respuesta = self.client.get('/obtener-pedidos-por-tipo/?since=abc')
+        self.assertEqual(respuesta.status_code, 400)
+
+    def test_eventos_websocket_llevan_version(self):
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+
+        pedido = self.crear()
+        capa = get_channel_layer()
+        canal = async_to_sync(capa.new_channel)()
+        async_to_sync(capa.group_add)('pedidos', canal)
+        self.client.post('/marcar-completado/', {'pedido_id': pedido.id})
+
+        mensaje = async_to_sync(capa.receive)(canal)
+        async_to_sync(capa.group_discard)('pedidos', canal)
+        pedido.refresh_from_db()
+        self.assertEqual(mensaje['type'], 'pedido_actualizado')
+        self.assertEqual(mensaje['version'], VersionCambios.actual())
+        # Datos suficientes para que la tablet quite o reemplace la card en el lugar
+        self.assertEqual(mensaje['pedido']['version'], pedido.version)
+        self.assertEqual(mensaje['pedido']['estado'], 'completado')
+
+
+class GetCondicionalTests(MenuDelDiaMixin, TestCase):
+
+    def setUp(self):
+        # Las versiones de datos viven en la caché
+        cache.clear()
+
+    def get_condicional(self, url):
+        """Primer GET normal y segundo con If-None-Match; devuelve (etag, segunda respuesta)."""
+        primera = self.client.get(url)
+        self.assertEqual(primera.status_code, 200)
+        etag = primera['ETag']
+        return etag, self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_304_sin_consultas(self):
+        for url in ('/obtener-pedidos-por-tipo/?tipo=servirse', '/obtener-contadores-tabs/',
+                    '/obtener-cantidades-actualizadas/', '/obtener-cantidades-modal/'):
+            primera = self.client.get(url)
+            self.assertFalse(primera['ETag'].startswith('W/'))
+            with self.assertNumQueries(0):
+                respuesta = self.client.get(url, HTTP_IF_NONE_MATCH=primera['ETag'])
+            self.assertEqual(respuesta.status_code, 304, url)
+
+    def test_etag_cambia_con_pedidos(self):
+        url = '/obtener-pedidos-por-tipo/?tipo=servirse'
+        etag, _ = self.get_condicional(url)
+        pedido = Pedido.objects.create(tipo='Servirse')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # Completar usa update() (sin señales) y también debe invalidar
+        etag, _ = self.get_condicional(url)
+        self.client.post('/marcar-completado/', {'pedido_id': pedido.id})
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_cambia_con_stock(self):
+        from .views import actualizar_cantidades_menu
+
+        url = '/obtener-cantidades-actualizadas/'
+        etag, respuesta = self.get_condicional(url)
+        self.assertEqual(respuesta.status_code, 304)
+
+        actualizar_cantidades_menu(self.carrito(1), 'restar')
+        respuesta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.json()['sopas'][0]['cantidad_actual'], 47)
+
+
+class PlanesConsultaTests(MenuDelDiaMixin, TestCase):
+    """
+    EXPLAIN de las consultas frecuentes sobre una base con datos: ninguna debe
+    recorrer la tabla entera. En PostgreSQL se desactiva el seq scan para
+    comprobar que existe un índice utilizable (con pocas filas el planificador
+    lo preferiría aunque el índice exista); en SQLite se usa EXPLAIN QUERY PLAN.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        from caja.models import CajaDiaria
+
+        ahora = timezone.now()
+        pedidos = []
+        for i in range(600):
+            pedidos.append(Pedido(
+                tipo=('Servirse', 'Llevar', 'Reservado')[i % 3],
+                estado='pendiente' if i % 20 == 0 else 'completado',
+                fecha_creacion=ahora - timedelta(hours=i),
+            ))
+        Pedido.objects.bulk_create(pedidos)
+        CajaDiaria.objects.bulk_create([
+            CajaDiaria(fecha=date.today() - timedelta(days=i), estado='cerrada') for i in range(1, 200)
+        ])
+        # Menús de días anteriores con su stock
+        menus = MenuDia.objects.bulk_create([MenuDia(fecha=date.today() - timedelta(days=i)) for i in range(1, 200)])
+        MenuDiaSopa.objects.bulk_create([MenuDiaSopa(menu=m, sopa=s) for m in menus for s in cls.sopas])
+        MenuDiaSegundo.objects.bulk_create([MenuDiaSegundo(menu=m, segundo=s) for m in menus for s in cls.segundos])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def consultas_frecuentes(self):
+        from caja.models import CajaDiaria
+
+        hoy = timezone.localdate()
+        return {
+            'pendientes por tipo': (
+                Pedido.objects.filter(estado='pendiente', tipo='Llevar').order_by('-fecha_creacion'), 'pedidos_pedido'),
+            'pendientes (todos)': (
+                Pedido.objects.filter(estado='pendiente').order_by('-fecha_creacion'), 'pedidos_pedido'),
+            'completados del día': (
+                Pedido.objects.filter(fecha_creacion__date=hoy, estado='completado'), 'pedidos_pedido'),
+            'caja abierta': (CajaDiaria.objects.filter(estado='abierta')[:1], 'caja_cajadiaria'),
+            'stock de sopas': (
+                MenuDiaSopa.objects.filter(menu__fecha=hoy, sopa_id__in=[s.id for s in self.sopas]),
+                'menu_menudiasopa'),
+            'stock de segundos': (
+                MenuDiaSegundo.objects.filter(menu__fecha=hoy, segundo_id__in=[s.id for s in self.segundos]),
+                'menu_menudiasegundo'),
+        }
+
+    def tablas_recorridas(self, queryset):
+        """Tablas que el plan recorre completas (seq scan)."""
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SET enable_seqscan = off')
+                try:
+                    cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                    plan = cursor.fetchone()[0]
+                finally:
+                    cursor.execute('RESET enable_seqscan')
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                tablas = []
+                pendientes = [plan[0]['Plan']]
+                while pendientes:
+                    nodo = pendientes.pop()
+                    if nodo['Node Type'] == 'Seq Scan':
+                        tablas.append(nodo['Relation Name'])
+                    pendientes.extend(nodo.get('Plans', []))
+                return tablas
+
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            # "SCAN tabla" sin índice = recorrido completo ("SCAN tabla USING INDEX" no lo es)
+            return [
+                fila[-1].split()[1] for fila in cursor.fetchall()
+                if fila[-1].startswith('SCAN ') and ' USING ' not in fila[-1]
+            ]
+
+    def test_consultas_frecuentes_usan_indices(self):
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            self.skipTest('EXPLAIN solo se revisa en PostgreSQL y SQLite')
+        for nombre, (queryset, tabla) in self.consultas_frecuentes().items():
+            with self.subTest(nombre):
+                self.assertNotIn(tabla, self.tablas_recorridas(queryset))
+
+
+class FotoPendientesTests(MenuDelDiaMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def crear(self, tipo='Servirse'):
+        pedido = Pedido.objects.create(tipo=tipo)
+        crear_lineas_pedido(pedido, self.carrito(1))
+        return pedido
+
+    def test_una_foto_por_version(self):
+        from .foto import foto_pendientes
+
+        pedido = self.crear()
+        foto = json.loads(foto_pendientes())
+        self.assertEqual(foto['type'], 'pedidos_data')
+        self.assertEqual([p['id'] for p in foto['pedidos']], [pedido.id])
+        self.assertEqual(foto['version'], VersionCambios.actual())
+        # Los contadores no se guardan en la foto: el consumer los envía aparte
+        self.assertNotIn('contadores', foto)
+
+        # Otra tablet con los mismos datos: el mismo texto, sin consultas
+        with self.assertNumQueries(0):
+            self.assertEqual(json.loads(foto_pendientes()), foto)
+
+        otro = self.crear('Llevar')
+        self.assertIn(otro.id, [p['id'] for p in json.loads(foto_pendientes())['pedidos']])
+
+    def test_consumer_envia_la_foto_al_conectar(self):
+        from asgiref.sync import async_to_sync
+        from channels.testing import WebsocketCommunicator
+        from .consumers import PedidosConsumer
+
+        pedido = self.crear()
+
+        async def conectar():
+            comunicador = WebsocketCommunicator(PedidosConsumer.as_asgi(), '/ws/pedidos/')
+            conectado, _ = await comunicador.connect()
+            self.assertTrue(conectado)
+            bienvenida = await comunicador.receive_json_from()
+            foto = await comunicador.receive_json_from()
+            contadores = await comunicador.receive_json_from()
+            await comunicador.send_json_to({'type': 'get_pedidos'})
+            repetida = await comunicador.receive_json_from()
+            await comunicador.receive_json_from()  # contadores
+            await comunicador.disconnect()
+            return bienvenida, foto, contadores, repetida
+
+        bienvenida, foto, contadores, repetida = async_to_sync(conectar)()
+        self.assertEqual(bienvenida['type'], 'connection_established')
+        self.assertEqual([p['id'] for p in foto['pedidos']], [pedido.id])
+        self.assertEqual(contadores['type'], 'contadores_actualizados')
+        self.assertEqual(contadores['contadores']['servirse'], 1)
+        self.assertEqual(repetida, foto)
+
+
+# Los eventos se leen de a uno: sin la ventana del publicador
+@override_settings(WS_VENTANA_AGRUPACION_MS=0)
+class RegistroEventosTests(MenuDelDiaMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_eventos_desde_y_huecos(self):
+        from .eventos import TAMANO_BUFFER, eventos_desde, registrar_evento, secuencia_actual
+
+        inicio = secuencia_actual()
+        self.assertLess(inicio, 2 ** 53)  # Exacto en JavaScript
+        for i in range(3):
+            registrar_evento({'type': 'pedido_creado', 'pedido': {'id': i}})
+        eventos = eventos_desde(inicio + 1)
+        self.assertEqual([e['pedido']['id'] for e in eventos], [1, 2])
+        self.assertEqual([e['seq'] for e in eventos], [inicio + 2, inicio + 3])
+        self.assertEqual(eventos_desde(inicio + 3), [])
+
+        # Número futuro (caché vaciada) o hueco más viejo que el buffer: foto completa
+        self.assertIsNone(eventos_desde(inicio + 10))
+        for i in range(TAMANO_BUFFER):
+            registrar_evento({'type': 'pedido_creado', 'pedido': {'id': i}})
+        self.assertIsNone(eventos_desde(inicio))
+
+    def test_reconexion_recibe_solo_lo_perdido(self):
+        from asgiref.sync import async_to_sync
+        from channels.testing import WebsocketCommunicator
+        from .consumers import PedidosConsumer
+
+        async def conectar(ruta):
+            comunicador = WebsocketCommunicator(PedidosConsumer.as_asgi(), ruta)
+            await comunicador.connect()
+            await comunicador.receive_json_from()  # connection_established
+            return comunicador
+
+        async def primera_conexion():
+            comunicador = await conectar('/ws/pedidos/')
+            foto = await comunicador.receive_json_from()
+            await comunicador.disconnect()
+            return foto
+
+        foto = async_to_sync(primera_conexion)()
+        self.assertEqual(foto['type'], 'pedidos_data')
+
+        # Mientras la tablet estaba desconectada
+        pedido = Pedido.objects.create(tipo='Llevar')
+        crear_lineas_pedido(pedido, self.carrito(1))
+        self.client.post('/marcar-completado/', {'pedido_id': pedido.id})
+
+        async def reconexion():
+            comunicador = await conectar(f"/ws/pedidos/?ultimo_seq={foto['seq']}")
+            evento = await comunicador.receive_json_from()
+            nada_mas = await comunicador.receive_nothing()
+            await comunicador.disconnect()
+            return evento, nada_mas
+
+        evento, nada_mas = async_to_sync(reconexion)()
+        self.assertEqual(evento['type'], 'pedido_actualizado')
+        self.assertEqual(evento['seq'], foto['seq'] + 1)
+        self.assertTrue(evento['reenviado'])
+        self.assertEqual(evento['pedido']['id'], pedido.id)
+        self.assertTrue(nada_mas)
+
+
+@override_settings(WS_VENTANA_AGRUPACION_MS=20)
+class PublicadorPedidosTests(MenuDelDiaMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_una_rafaga_sale_en_un_solo_lote(self):
+        from asgiref.sync import async_to_sync
+        from channels.testing import WebsocketCommunicator
+        from .consumers import PedidosConsumer
+        from .publicador import publicador_pedidos
+
+        async def rafaga():
+            comunicador = WebsocketCommunicator(PedidosConsumer.as_asgi(), '/ws/pedidos/')
+            await comunicador.connect()
+            await comunicador.receive_json_from()  # connection_established
+            await comunicador.receive_json_from()  # foto
+            await comunicador.receive_json_from()  # contadores
+            publicador = publicador_pedidos()
+            await publicador.publicar({'type': 'stock_actualizado', 'stock': {'sopas': {1: 5}, 'segundos': {}}})
+            await publicador.publicar({'type': 'pedido_creado', 'pedido': {'id': 1, 'mesa': '1'}})
+            await publicador.publicar({'type': 'pedido_actualizado', 'pedido': {'id': 1, 'mesa': '5'}})
+            await publicador.publicar({'type': 'pedido_actualizado', 'pedido': {'id': 2, 'mesa': '2'}})
+            await publicador.publicar({'type': 'pedidos_marcados_completados', 'pedidos_ids': [3], 'cantidad': 1})
+            await publicador.publicar({'type': 'pedidos_marcados_completados', 'pedidos_ids': [2, 4], 'cantidad': 2})
+            await publicador.publicar({'type': 'stock_actualizado', 'stock': {'sopas': {1: 4, 2: 9}, 'segundos': {}}})
+            lote = await comunicador.receive_json_from(timeout=1)
+            nada_mas = await comunicador.receive_nothing(timeout=0.1)
+            # Pasada la ventana, un evento suelto va tal cual
+            await publicador.publicar({'type': 'pedido_eliminado', 'pedido': {'id': 5}})
+            suelto = await comunicador.receive_json_from(timeout=1)
+            await comunicador.disconnect()
+            return lote, nada_mas, suelto
+
+        lote, nada_mas, suelto = async_to_sync(rafaga)()
+        self.assertEqual(lote['type'], 'pedidos_batch')
+        self.assertTrue(nada_mas)
+        self.assertEqual(set(lote['contadores']), {'todos', 'servirse', 'llevar', 'reservados'})
+        # El creado queda como creado con los datos nuevos; la edición del 2 la pisa el completado
+        stock = lote['eventos'].pop()
+        self.assertEqual(lote['eventos'], [
+            {'type': 'pedido_creado', 'pedido': {'id': 1, 'mesa': '5'}},
+            {'type': 'pedidos_marcados_completados', 'pedidos_ids': [3, 2, 4], 'cantidad': 3},
+        ])
+        # Los avisos de stock quedan en uno, al final, con la versión del stock
+        self.assertEqual(stock['type'], 'stock_actualizado')
+        self.assertEqual((stock['stock']['sopas'], stock['stock']['segundos']), ({'1': 4, '2': 9}, {}))
+        self.assertIn('version', stock['stock'])
+        self.assertEqual(suelto['type'], 'pedido_eliminado')
+        self.assertEqual(suelto['seq'], lote['seq'] + 1)
+
+    def test_cancelar_la_ventana_envia_lo_pendiente(self):
+        from asgiref.sync import async_to_sync
+        from channels.testing import WebsocketCommunicator
+        from .consumers import PedidosConsumer
+        from .publicador import PublicadorPedidos
+
+        async def cancelar():
+            comunicador = WebsocketCommunicator(PedidosConsumer.as_asgi(), '/ws/pedidos/')
+            await comunicador.connect()
+            await comunicador.receive_json_from()  # connection_established
+            await comunicador.receive_json_from()  # foto
+            await comunicador.receive_json_from()  # contadores
+            publicador = PublicadorPedidos(ventana=10_000)
+            await publicador.publicar({'type': 'pedido_creado', 'pedido': {'id': 1, 'mesa': '1'}})
+            tarea = publicador._tarea
+            await asyncio.sleep(0)
+            tarea.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await tarea
+            mensaje = await comunicador.receive_json_from(timeout=1)
+            await comunicador.disconnect()
+            return publicador, mensaje
+
+        publicador, mensaje = async_to_sync(cancelar)()
+        self.assertEqual(mensaje['type'], 'pedido_creado')
+        self.assertIsNone(publicador._tarea)
+        self.assertEqual(publicador._pendientes, {})
+
+
+@override_settings(WS_VENTANA_AGRUPACION_MS=0)
+class TemasWebsocketTests(MenuDelDiaMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def guardar(self, tipo, **extra):
+        data = {'tipo_pedido': tipo, 'forma_pago': 'Efectivo', 'imprimir': 'false',
+                'cliente': 'Ana', 'productos_carrito': json.dumps(self.carrito(1))}
+        data.update(extra)
+        with self.captureOnCommitCallbacks(execute=True):
+            respuesta = self.client.post('/guardar-pedido/', data)
+        return respuesta.json()['pedido_id']
+
+    def test_cada_tema_recibe_solo_lo_suyo(self):
+        import asyncio
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+        from .temas import TEMAS
+
+        capa = get_channel_layer()
+        llevar = async_to_sync(capa.new_channel)()
+        contadores = async_to_sync(capa.new_channel)()
+        async_to_sync(capa.group_add)(TEMAS['llevar'], llevar)
+        async_to_sync(capa.group_add)(TEMAS['contadores'], contadores)
+
+        async def recibir(canal):
+            try:
+                return await asyncio.wait_for(capa.receive(canal), 0.1)
+            except asyncio.TimeoutError:
+                return None
+
+        self.guardar('Servirse', mesa='2')
+        self.assertIsNone(async_to_sync(recibir)(llevar))
+        self.assertEqual(async_to_sync(recibir)(contadores)['type'], 'contadores_actualizados')
+
+        pedido_id = self.guardar('Llevar')
+        creado = async_to_sync(recibir)(llevar)
+        self.assertEqual((creado['type'], creado['pedido']['id']), ('pedido_creado', pedido_id))
+        self.assertNotIn('seq', creado)
+        self.assertEqual(async_to_sync(recibir)(contadores)['type'], 'contadores_actualizados')
+
+        # Al pasar a Reservado, la pantalla de Llevar se entera para quitar la card
+        self.guardar('Reservado', subtipo_reservado='llevar', pedido_id=str(pedido_id))
+        cambio = async_to_sync(recibir)(llevar)
+        self.assertEqual(cambio['type'], 'pedido_actualizado')
+        self.assertEqual((cambio['pedido']['tipo'], cambio['tipo_anterior']), ('Reservado', 'Llevar'))
+        self.assertEqual(async_to_sync(recibir)(contadores)['type'], 'contadores_actualizados')
+
+        async_to_sync(capa.group_discard)(TEMAS['llevar'], llevar)
+        async_to_sync(capa.group_discard)(TEMAS['contadores'], contadores)
+
+    def test_suscribir_y_desuscribir(self):
+        from asgiref.sync import async_to_sync
+        from channels.db import database_sync_to_async
+        from channels.testing import WebsocketCommunicator
+        from caja.models import CajaDiaria, CajaEfectivo, CajaTransferencia
+        from .consumers import PedidosConsumer
+        from .temas import aenviar_caja
+
+        def abrir_caja():
+            caja = CajaDiaria.objects.create(fecha=date.today(), estado='abierta')
+            CajaEfectivo.objects.create(caja_diaria=caja, monto_inicial=0, total_ventas=Decimal('7.50'))
+            CajaTransferencia.objects.create(caja_diaria=caja, monto_inicial=0)
+
+        async def sesion():
+            comunicador = WebsocketCommunicator(PedidosConsumer.as_asgi(), '/ws/pedidos/?temas=caja')
+            await comunicador.connect()
+            recibidos = [await comunicador.receive_json_from()]  # connection_established
+            recibidos.append(await comunicador.receive_json_from())  # estado de la caja
+            await comunicador.send_json_to({'type': 'suscribir', 'temas': ['stock', 'otro']})
+            recibidos.append(await comunicador.receive_json_from())
+            await comunicador.send_json_to({'type': 'suscribir', 'temas': ['contadores']})
+            recibidos.append(await comunicador.receive_json_from())
+            recibidos.append(await comunicador.receive_json_from())
+            await database_sync_to_async(abrir_caja)()
+            await aenviar_caja()
+            recibidos.append(await comunicador.receive_json_from())
+            await comunicador.send_json_to({'type': 'desuscribir', 'temas': ['caja']})
+            recibidos.append(await comunicador.receive_json_from())
+            await aenviar_caja()
+            nada_mas = await comunicador.receive_nothing()
+            await comunicador.disconnect()
+            return recibidos, nada_mas
+
+        (bienvenida, caja, error, suscripciones, contadores, caja_abierta, sin_caja), nada_mas = (
+            async_to_sync(sesion)()
+        )
+        # Sin el tema 'pedidos' no llega la foto de pendientes
+        self.assertEqual(bienvenida['temas'], ['caja'])
+        self.assertEqual(caja, {'type': 'caja_actualizada', 'caja': {'abierta': False}})
+        self.assertEqual(error['type'], 'error')
+        self.assertEqual(suscripciones, {'type': 'suscripciones', 'temas': ['caja', 'contadores']})
+        self.assertEqual(contadores['type'], 'contadores_actualizados')
+        self.assertEqual(caja_abierta['caja']['total_ventas'], 7.5)
+        self.assertEqual(sin_caja['temas'], ['contadores'])
+        self.assertTrue(nada_mas)
+
+
+class FormatoWebsocketTests(MenuDelDiaMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_tabla_de_claves_sin_choques(self):
+        from .formato_ws import CLAVES, abreviar, codificar, decodificar
+
+        cortas = set(CLAVES.values())
+        self.assertEqual(len(cortas), len(CLAVES))
+        self.assertFalse(cortas & set(CLAVES))
+        mensaje = {'type': 'pedido_creado', 'pedido': {
+            'id': 1, 'numero_pedido_completo': 'S-001', 'observaciones_generales': '',
+            'productos': [{'tipo': 'Sopa', 'sopa_id': 2, 'componentes': ['a', 'b']}],
+        }, 'stock': {'sopas': {5: 10}}}
+        # decodificar expande lo que codificar abrevió
+        self.assertEqual(decodificar(codificar(mensaje, binario=True)), mensaje)
+        self.assertIn('n', abreviar(mensaje)['p'])
+
+    def test_consumer_negocia_msgpack(self):
+        import msgpack
+        from asgiref.sync import async_to_sync
+        from channels.testing import WebsocketCommunicator
+        from .consumers import PedidosConsumer
+        from .formato_ws import SUBPROTOCOLO_MSGPACK, decodificar
+
+        pedido = Pedido.objects.create(tipo='Llevar', observaciones_generales='sin cebolla')
+        crear_lineas_pedido(pedido, self.carrito(1))
+
+        async def sesion():
+            comunicador = WebsocketCommunicator(
+                PedidosConsumer.as_asgi(), '/ws/pedidos/', subprotocols=[SUBPROTOCOLO_MSGPACK]
+            )
+            _, subprotocolo = await comunicador.connect()
+            bienvenida = await comunicador.receive_from()
+            foto = await comunicador.receive_from()
+            await comunicador.receive_from()  # contadores
+            # El cliente también puede hablar en msgpack abreviado
+            await comunicador.send_to(bytes_data=msgpack.packb({'t': 'get_pedidos'}))
+            repetida = await comunicador.receive_from()
+            await comunicador.receive_from()  # contadores
+            await comunicador.disconnect()
+            return subprotocolo, bienvenida, foto, repetida
+
+        subprotocolo, bienvenida, foto, repetida = async_to_sync(sesion)()
+        self.assertEqual(subprotocolo, SUBPROTOCOLO_MSGPACK)
+        bienvenida = msgpack.unpackb(bienvenida)
+        self.assertEqual(bienvenida['type'], 'connection_established')
+        self.assertEqual(bienvenida['claves']['og'], 'observaciones_generales')
+
+        self.assertIsInstance(foto, bytes)
+        self.assertNotIn(b'observaciones_generales', foto)
+        datos = decodificar(foto)
+        self.assertEqual(datos['type'], 'pedidos_data')
+        self.assertEqual(datos['pedidos'][0]['observaciones_generales'], 'sin cebolla')
+        self.assertEqual(repetida, foto)
+
+
+@override_settings(WS_VENTANA_AGRUPACION_MS=0)
+# Los eventos se leen de a uno: sin la ventana del publicador
+@override_settings(WS_VENTANA_AGRUPACION_MS=0)
+class StockEnVivoTests(MenuDelDiaMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_vender_avisa_solo_las_filas_que_cambiaron(self):
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+        from menu.stock import version_stock
+        from .temas import TEMAS
+
+        capa = get_channel_layer()
+        canales = {tema: async_to_sync(capa.new_channel)() for tema in ('pedidos', 'stock')}
+        for tema, canal in canales.items():
+            async_to_sync(capa.group_add)(TEMAS[tema], canal)
+
+        data = {'tipo_pedido': 'Llevar', 'forma_pago': 'Efectivo', 'imprimir': 'false',
+                'cliente': 'Ana', 'productos_carrito': json.dumps(self.carrito(1))}
+        self.client.post('/guardar-pedido/', data)
+
+        sopa = MenuDiaSopa.objects.get(sopa=self.sopas[0])
+        segundo = MenuDiaSegundo.objects.get(segundo=self.segundos[0])
+        esperado = {'version': version_stock(), 'sopas': {sopa.id: 47}, 'segundos': {segundo.id: 48}}
+        mensaje = async_to_sync(capa.receive)(canales['stock'])
+        self.assertEqual((mensaje['type'], mensaje['stock']), ('stock_actualizado', esperado))
+        # Las tablets lo reciben después del evento del pedido (que ya no trae el stock)
+        creado = async_to_sync(capa.receive)(canales['pedidos'])
+        self.assertEqual(creado['type'], 'pedido_creado')
+        self.assertNotIn('stock', creado)
+        mensaje = async_to_sync(capa.receive)(canales['pedidos'])
+        self.assertEqual((mensaje['type'], mensaje['stock']), ('stock_actualizado', esperado))
+        # Con número de secuencia: se reenvía a quien se reconecte
+        self.assertEqual(mensaje['seq'], creado['seq'] + 1)
+        for tema, canal in canales.items():
+            async_to_sync(capa.group_discard)(TEMAS[tema], canal)
+
+        # La primera carga trae la misma versión para ordenar los avisos
+        self.assertEqual(self.client.get('/obtener-cantidades-modal/').json()['version'], version_stock())
@@ -0,0 +1,155 @@
+"""
+Tickets de cocina en segundo plano.
+
+guardar_pedido registra el ticket con transaction.on_commit; al confirmarse el
+pedido el trabajo entra a una cola y un hilo trabajador arma las líneas del
+ticket y lo envía al grupo 'impresion'. La respuesta HTTP no espera ni el
+formateo ni el envío.
+"""
+import logging
+import queue
+import threading
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+ANCHO_TICKET = 45
+
+
+def _linea_extremos(izquierda, derecha):
+    """Texto a la izquierda y a la derecha en una línea del ancho del ticket."""
+    espacios = ANCHO_TICKET - len(izquierda) - len(derecha)
+    return izquierda + " " * espacios + derecha
+
+
+def _linea_tipo(tipo, derecha):
+    """Primera línea del ticket (un carácter más corta que el ancho, como siempre se imprimió)."""
+    espacios = ANCHO_TICKET - len(f"{tipo}.") - len(derecha)
+    return tipo.upper() + " " * espacios + derecha
+
+
+def componer_ticket_cocina(pedido_data, productos, hora=None):
+    """
+    Arma las líneas del ticket de cocina.
+
+    Args:
+        pedido_data: Pedido serializado (serializar_pedido_para_websocket)
+        productos: Productos a imprimir, con 'componentes' ya resueltos
+        hora: Hora del ticket 'HH:MM' (por defecto la hora actual)
+
+    Returns:
+        list[str]: Líneas a imprimir
+    """
+    tipo = pedido_data['tipo']
+    contacto = pedido_data.get('contacto')
+
+    # Primera línea: tipo a la izquierda; mesa o cliente a la derecha
+    if tipo == 'Servirse' and pedido_data.get('mesa'):
+        linea_info = _linea_tipo(tipo, f"MESA: {pedido_data['mesa']}")
+    elif tipo == 'Llevar' and contacto:
+        linea_info = _linea_tipo(tipo, contacto.upper())
+    elif tipo == 'Reservado' and contacto:
+        subtipo_texto = f" ({pedido_data['subtipo']})" if pedido_data.get('subtipo') else ""
+        linea_info = _linea_tipo(tipo, f"{contacto}{subtipo_texto}".upper())
+    else:
+        linea_info = tipo.upper()
+
+    hora = hora or timezone.localtime().strftime('%H:%M')
+    lineas = [
+        linea_info,
+        _linea_extremos(f"Pedido #{pedido_data['numero_pedido_completo']}", f"Hora: {hora}"),
+    ]
+
+    if pedido_data.get('observaciones_generales'):
+        lineas.append(f"  {pedido_data['observaciones_generales']}")
+
+    lineas.append("-" * ANCHO_TICKET)
+
+    for producto in productos:
+        # Línea principal con cantidad y tipo, componentes uno debajo del otro
+        lineas.append(f"{producto['cantidad']}x {producto['tipo']}")
+        for componente in producto.get('componentes') or []:
+            lineas.append(f"  - {componente}")
+        if producto.get('observacion'):
+            lineas.append(f"  Obs: {producto['observacion']}")
+        lineas.append("")
+
+    return lineas
+
+
+class ColaTickets:
+    """Cola de tickets atendida por un hilo trabajador (se inicia al primer uso)."""
+
+    def __init__(self):
+        self._cola = queue.Queue()
+        self._hilo = None
+        self._lock = threading.Lock()
+        self._procesados = 0
+        self._errores = 0
+        self._latencia_total = 0.0
+        self._latencia_ultima = 0.0
+        self._latencia_max = 0.0
+
+    def encolar(self, pedido_data, productos, es_agregar_productos):
+        self._iniciar()
+        self._cola.put((time.monotonic(), pedido_data, productos, es_agregar_productos))
+
+    def esperar(self):
+        """Bloquea hasta que la cola quede vacía (útil en pruebas y al apagar)."""
+        self._cola.join()
+
+    def estadisticas(self):
+        """Profundidad de la cola y latencia (encolado -> enviado) en milisegundos."""
+        with self._lock:
+            procesados = self._procesados
+            return {
+                'pendientes': self._cola.qsize(),
+                'procesados': procesados,
+                'errores': self._errores,
+                'latencia_ultima_ms': round(self._latencia_ultima * 1000, 2),
+                'latencia_promedio_ms': round(self._latencia_total / procesados * 1000, 2) if procesados else 0.0,
+                'latencia_max_ms': round(self._latencia_max * 1000, 2),
+            }
+
+    def _iniciar(self):
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._trabajar, name='tickets-cocina', daemon=True)
+                self._hilo.start()
+
+    def _trabajar(self):
+        from .views import enviar_trabajo_impresion
+
+        while True:
+            encolado, pedido_data, productos, es_agregar_productos = self._cola.get()
+            try:
+                contenido = componer_ticket_cocina(pedido_data, productos)
+                enviar_trabajo_impresion(None, contenido, es_agregar_productos, pedido_data)
+                exito = True
+            except Exception:
+                logger.exception("Error al procesar ticket del pedido %s", pedido_data.get('id'))
+                exito = False
+            finally:
+                latencia = time.monotonic() - encolado
+                with self._lock:
+                    if exito:
+                        self._procesados += 1
+                        self._latencia_total += latencia
+                        self._latencia_ultima = latencia
+                        self._latencia_max = max(self._latencia_max, latencia)
+                    else:
+                        self._errores += 1
+                self._cola.task_done()
+
+
+cola_tickets = ColaTickets()
+
+
+def programar_ticket_cocina(pedido_data, productos, es_agregar_productos):
+    """Encola el ticket cuando la transacción actual se confirme."""
+    transaction.on_commit(
+        lambda: cola_tickets.encolar(pedido_data, productos, es_agregar_productos)
+    )
@@ -0,0 +1,51 @@
+"""
+Versiones de datos para GET condicionales (ETag / If-None-Match).
+
+La versión de pedidos es un contador en la caché, como la del catálogo, que se
+incrementa cuando se escribe un pedido (señales de Pedido y los UPDATE en lote
+de las vistas). La del stock es la de menu.stock. Las vistas de lectura arman
+su ETag solo con estas versiones, de modo que un If-None-Match vigente se
+contesta con 304 sin tocar la base de datos.
+"""
+from datetime import date
+
+from menu.catalogo import version_catalogo
+from menu.stock import version_configuracion, version_stock
+from poscresly.versiones import ContadorVersion
+
+CLAVE_PEDIDOS = 'datos:version:pedidos'
+
+
+def version_datos(clave):
+    return ContadorVersion(clave).actual()
+
+
+def marcar_cambio(clave):
+    """
+    Incrementa la versión de inmediato y otra vez al confirmar la transacción,
+    para que una respuesta armada antes del commit no quede con el ETag nuevo.
+    """
+    ContadorVersion(clave).invalidar()
+
+
+def marcar_cambio_pedidos(**kwargs):
+    """Receptor de señales de Pedido."""
+    marcar_cambio(CLAVE_PEDIDOS)
+
+
+def etag_pedidos(request, *args, **kwargs):
+    """ETag de las listas y contadores de pedidos (para @etag)."""
+    return f"pedidos-{version_datos(CLAVE_PEDIDOS)}"
+
+
+def version_menu():
+    """
+    Versión del menú de hoy sin las cantidades: configuración del menú,
+    catálogo (nombres y precios) y fecha. No cambia al vender.
+    """
+    return f"{version_configuracion()}-{version_catalogo()}-{date.today().isoformat()}"
+
+
+def etag_stock(request, *args, **kwargs):
+    """ETag de las cantidades del menú de hoy."""
+    return f"stock-{version_stock()}-{version_menu()}"
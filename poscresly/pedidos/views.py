@@ -1,15 +1,30 @@
 import logging
-from django.db import transaction
-from django.db.models import F, Value
+from asgiref.sync import sync_to_async
+from collections import defaultdict
+from django.db import connection
+from django.db.models import Case, F, Sum, Value, When
 from django.db.models.functions import Greatest
 from django.http import JsonResponse
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import etag, require_http_methods
 from datetime import date
 from decimal import Decimal
-from .models import Pedido, PedidoAlmuerzo, PedidoSopa, PedidoSegundo, PedidoExtra
+from .models import Pedido, VersionCambios
+from .lineas import calcular_diff_lineas, aplicar_diff_lineas, ids_extras
+from .esquema import ErrorJSON, decodificar_json, validar_pedido
+from .cambios import TIPOS_FILTRO, cambios_desde, diferir_version, transaccion_versionada
+from .contadores import ajustar_contadores, obtener_contadores
+from .idempotencia import idempotente
+from .publicador import publicador_pedidos
+from .serializadores import productos_de_pedido, serializar_pedidos
+from .temas import aenviar_caja, mensaje_stock
+from .tickets import cola_tickets, programar_ticket_cocina
+from .versiones import CLAVE_PEDIDOS, etag_pedidos, etag_stock, marcar_cambio
 from caja.models import CajaDiaria, CajaEfectivo, CajaTransferencia
-from menu.models import MenuDia, MenuDiaSopa, MenuDiaSegundo, MenuDiaJugo, Plato
+from menu.catalogo import obtener_catalogo
+from menu.stock import invalidar_stock, obtener_stock
+from menu.models import MenuDia, MenuDiaSopa, MenuDiaSegundo
 import json
 
 # Configurar logger
@@ -37,272 +52,132 @@ def _delta_cantidad(producto, operacion):
     return -q if operacion == "restar" else q
 
 
-def _aplicar_delta_sopa(menu, sopa_plato_id, delta, log):
-    """UPDATE atómico con F(); evita lost updates entre POST concurrentes."""
-    if sopa_plato_id is None or delta == 0:
-        return
-    n = MenuDiaSopa.objects.filter(menu=menu, sopa_id=sopa_plato_id).update(
-        cantidad_actual=Greatest(F("cantidad_actual") + Value(delta), Value(0))
-    )
-    if n:
-        obj = MenuDiaSopa.objects.filter(menu=menu, sopa_id=sopa_plato_id).first()
-        log.info(
-            "Sopa stock delta=%s aplicada: %s (cantidad_actual=%s)",
-            delta,
-            obj.sopa if obj else sopa_plato_id,
-            obj.cantidad_actual if obj else "?",
-        )
-    else:
-        log.warning("No se encontró sopa con Plato ID %s en el menú actual", sopa_plato_id)
-
-
-def _aplicar_delta_segundo(menu, segundo_plato_id, delta, log):
-    if segundo_plato_id is None or delta == 0:
-        return
-    n = MenuDiaSegundo.objects.filter(menu=menu, segundo_id=segundo_plato_id).update(
-        cantidad_actual=Greatest(F("cantidad_actual") + Value(delta), Value(0))
-    )
-    if n:
-        obj = MenuDiaSegundo.objects.filter(menu=menu, segundo_id=segundo_plato_id).first()
-        log.info(
-            "Segundo stock delta=%s aplicado: %s (cantidad_actual=%s)",
-            delta,
-            obj.segundo if obj else segundo_plato_id,
-            obj.cantidad_actual if obj else "?",
+def _aplicar_deltas_stock(modelo, campo, deltas, fecha):
+    """
+    Aplica todos los deltas de una tabla de stock (MenuDiaSopa o MenuDiaSegundo)
+    en un solo UPDATE ... CASE y retorna las filas nuevas con RETURNING.
+
+    Args:
+        modelo: MenuDiaSopa o MenuDiaSegundo
+        campo: 'sopa' o 'segundo' (FK a Plato)
+        deltas: {plato_id: unidades a sumar (negativo para restar)}
+        fecha: día del menú
+
+    Returns:
+        list[dict]: {'id', 'plato_id', 'cantidad_actual', 'cantidad'} por fila actualizada
+    """
+    if not deltas:
+        return []
+
+    columna_plato = modelo._meta.get_field(campo).column
+
+    if connection.vendor in ('postgresql', 'sqlite'):
+        qn = connection.ops.quote_name
+        tabla = qn(modelo._meta.db_table)
+        plato = qn(columna_plato)
+        casos = " ".join(["WHEN %s THEN %s"] * len(deltas))
+        marcadores = ", ".join(["%s"] * len(deltas))
+        mayor = 'GREATEST' if connection.vendor == 'postgresql' else 'MAX'
+        sql = (
+            f"UPDATE {tabla} "
+            f"SET cantidad_actual = {mayor}(cantidad_actual + CASE {plato} {casos} ELSE 0 END, 0) "
+            f"WHERE {plato} IN ({marcadores}) "
+            f"AND {qn(modelo._meta.get_field('menu').column)} IN "
+            f"(SELECT id FROM {qn(MenuDia._meta.db_table)} WHERE fecha = %s) "
+            f"RETURNING id, {plato}, cantidad_actual, cantidad"
         )
+        params = [v for par in deltas.items() for v in par] + list(deltas) + [fecha]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            filas = cursor.fetchall()
     else:
-        log.warning("No se encontró segundo con Plato ID %s en el menú actual", segundo_plato_id)
+        qs = modelo.objects.filter(menu__fecha=fecha, **{f'{campo}_id__in': list(deltas)})
+        qs.update(cantidad_actual=Greatest(
+            F('cantidad_actual') + Case(
+                *[When(**{f'{campo}_id': plato_id}, then=Value(delta)) for plato_id, delta in deltas.items()],
+                default=Value(0),
+            ),
+            Value(0),
+        ))
+        filas = qs.values_list('id', f'{campo}_id', 'cantidad_actual', 'cantidad')
+
+    return [
+        {'id': fila[0], 'plato_id': fila[1], 'cantidad_actual': fila[2], 'cantidad': fila[3]}
+        for fila in filas
+    ]
 
 
 def actualizar_cantidades_menu(productos_carrito, operacion="restar"):
     """
-    Actualiza cantidades del menú del día. Usa F() en SQL para stock concurrente.
+    Actualiza cantidades del menú del día.
+
+    Los deltas se agregan primero por plato y se aplican con un UPDATE por
+    tabla (sopas y segundos); así los bloqueos de stock duran lo mínimo y no
+    hace falta volver a leer las filas.
 
     Args:
         productos_carrito: Lista de productos del pedido
         operacion: 'restar' al vender, 'sumar' al anular / devolver stock
+
+    Returns:
+        dict: {'sopas': [...], 'segundos': [...]} con las filas actualizadas
+        ('id', 'plato_id', 'cantidad_actual', 'cantidad'); quien llama las
+        publica a las tablets con pedidos.temas.mensaje_stock
     """
     log = logging.getLogger(__name__)
     hoy = date.today()
     log.info("Actualizando cantidades para %s, operación: %s", hoy, operacion)
     log.info("Productos a procesar: %s", productos_carrito)
 
-    try:
-        menu = MenuDia.objects.get(fecha=hoy)
-        log.info("Menú encontrado: %s", menu)
-    except MenuDia.DoesNotExist:
-        log.warning("No hay menú configurado para hoy")
-        return
+    deltas_sopa = defaultdict(int)
+    deltas_segundo = defaultdict(int)
 
     for producto in productos_carrito:
         tipo = (producto.get("tipo") or "").lower()
         delta = _delta_cantidad(producto, operacion)
-        log.info("Procesando producto: tipo=%s, delta_stock=%s", tipo, delta)
 
-        if tipo == "almuerzo":
+        if tipo in ("almuerzo", "sopa"):
             sopa_id = _coerce_plato_id(producto.get("sopa_id"))
+            if sopa_id is not None:
+                deltas_sopa[sopa_id] += delta
+        if tipo in ("almuerzo", "segundo"):
             segundo_id = _coerce_plato_id(producto.get("segundo_id"))
-            log.info("Almuerzo - sopa_id: %s, segundo_id: %s", sopa_id, segundo_id)
-            _aplicar_delta_sopa(menu, sopa_id, delta, log)
-            _aplicar_delta_segundo(menu, segundo_id, delta, log)
-        elif tipo == "sopa":
-            sopa_id = _coerce_plato_id(producto.get("sopa_id"))
-            log.info("Sopa individual - sopa_id: %s", sopa_id)
-            _aplicar_delta_sopa(menu, sopa_id, delta, log)
-        elif tipo == "segundo":
-            segundo_id = _coerce_plato_id(producto.get("segundo_id"))
-            log.info("Segundo individual - segundo_id: %s", segundo_id)
-            _aplicar_delta_segundo(menu, segundo_id, delta, log)
-        elif tipo == "extra":
-            log.info("Extra procesado - no requiere actualización de cantidades")
+            if segundo_id is not None:
+                deltas_segundo[segundo_id] += delta
+
+    deltas_sopa = {k: v for k, v in deltas_sopa.items() if v}
+    deltas_segundo = {k: v for k, v in deltas_segundo.items() if v}
+    if deltas_sopa or deltas_segundo:
+        # UPDATE en lote (sin señales): se invalida la foto del stock y su ETag
+        invalidar_stock()
+
+    actualizadas = {
+        'sopas': _aplicar_deltas_stock(MenuDiaSopa, 'sopa', deltas_sopa, hoy),
+        'segundos': _aplicar_deltas_stock(MenuDiaSegundo, 'segundo', deltas_segundo, hoy),
+    }
+
+    for clave, deltas in (('sopas', deltas_sopa), ('segundos', deltas_segundo)):
+        encontrados = set()
+        for fila in actualizadas[clave]:
+            encontrados.add(fila['plato_id'])
+            log.info(
+                "Stock %s delta=%s aplicado: Plato ID %s (cantidad_actual=%s)",
+                clave, deltas[fila['plato_id']], fila['plato_id'], fila['cantidad_actual'],
+            )
+        for plato_id in set(deltas) - encontrados:
+            log.warning("No se encontró %s con Plato ID %s en el menú actual", clave, plato_id)
 
-        log.info("Producto procesado exitosamente: %s", tipo)
+    return actualizadas
 
 def calcular_precio_producto(tipo):
     """Calcula el precio unitario de un producto según su tipo"""
-    from menu.models import Producto
-    
-    producto = Producto.objects.get(nombre_producto__iexact=tipo)
+    producto = obtener_catalogo().producto(tipo)
     return Decimal(str(producto.precio_servirse))
 
-def convertir_producto_a_dict(producto_obj, tipo):
-    """Convierte un objeto de producto de BD a diccionario JSON"""
-    if tipo == 'Almuerzo':
-        return {
-            'tipo': 'Almuerzo',
-            'sopa_id': producto_obj.sopa.sopa.id,  # Plato ID
-            'segundo_id': producto_obj.segundo.segundo.id,  # Plato ID
-            'jugo_id': producto_obj.jugo.jugo.id,  # Plato ID
-            'cantidad': producto_obj.cantidad,
-            'precio_unitario': float(producto_obj.precio_unitario),
-            'observacion': producto_obj.observacion or '',
-            'componentes': [
-                producto_obj.sopa.sopa.nombre_plato,
-                producto_obj.segundo.segundo.nombre_plato,
-                producto_obj.jugo.jugo.nombre_plato
-            ]
-        }
-    elif tipo == 'Sopa':
-        return {
-            'tipo': 'Sopa',
-            'sopa_id': producto_obj.sopa.sopa.id,  # Plato ID
-            'jugo_id': producto_obj.jugo.jugo.id,  # Plato ID
-            'cantidad': producto_obj.cantidad,
-            'precio_unitario': float(producto_obj.precio_unitario),
-            'observacion': producto_obj.observacion or '',
-            'componentes': [
-                producto_obj.sopa.sopa.nombre_plato,
-                producto_obj.jugo.jugo.nombre_plato
-            ]
-        }
-    elif tipo == 'Segundo':
-        return {
-            'tipo': 'Segundo',
-            'segundo_id': producto_obj.segundo.segundo.id,  # Plato ID
-            'jugo_id': producto_obj.jugo.jugo.id,  # Plato ID
-            'cantidad': producto_obj.cantidad,
-            'precio_unitario': float(producto_obj.precio_unitario),
-            'observacion': producto_obj.observacion or '',
-            'componentes': [
-                producto_obj.segundo.segundo.nombre_plato,
-                producto_obj.jugo.jugo.nombre_plato
-            ]
-        }
-    elif tipo == 'Extra':
-        return {
-            'tipo': 'Extra',
-            'extra_id': producto_obj.extra.id,  # Plato ID
-            'cantidad': producto_obj.cantidad,
-            'precio_unitario': float(producto_obj.precio_unitario),
-            'observacion': producto_obj.observacion or '',
-            'componentes': [
-                producto_obj.extra.nombre_plato
-            ]
-        }
-    return None
-
-def obtener_productos_pedido(pedido):
-    """Obtiene todos los productos de un pedido en formato JSON"""
-    productos = []
-    
-    # Almuerzos
-    for almuerzo in pedido.almuerzos.all():
-        productos.append(convertir_producto_a_dict(almuerzo, 'Almuerzo'))
-    
-    # Sopas
-    for sopa in pedido.sopas.all():
-        productos.append(convertir_producto_a_dict(sopa, 'Sopa'))
-    
-    # Segundos
-    for segundo in pedido.segundos.all():
-        productos.append(convertir_producto_a_dict(segundo, 'Segundo'))
-    
-    # Extras
-    for extra in pedido.extras.all():
-        productos.append(convertir_producto_a_dict(extra, 'Extra'))
-    
-    return productos
-
-def crear_producto_pedido(pedido, producto_data):
-    """Crea un producto de pedido según su tipo"""
-    from menu.models import MenuDiaSopa, MenuDiaSegundo, MenuDiaJugo
-    
-    tipo = producto_data['tipo']
-    
-    if tipo == 'Almuerzo':
-        sopa_menu = MenuDiaSopa.objects.filter(sopa_id=producto_data['sopa_id']).first()
-        segundo_menu = MenuDiaSegundo.objects.filter(segundo_id=producto_data['segundo_id']).first()
-        jugo_menu = MenuDiaJugo.objects.filter(jugo_id=producto_data['jugo_id']).first()
-        
-        if sopa_menu and segundo_menu and jugo_menu:
-            return PedidoAlmuerzo.objects.create(
-                pedido=pedido,
-                sopa=sopa_menu,
-                segundo=segundo_menu,
-                jugo=jugo_menu,
-                cantidad=producto_data['cantidad'],
-                precio_unitario=producto_data['precio_unitario'],
-                observacion=producto_data.get('observacion', '')
-            )
-    
-    elif tipo == 'Sopa':
-        sopa_menu = MenuDiaSopa.objects.filter(sopa_id=producto_data['sopa_id']).first()
-        jugo_menu = MenuDiaJugo.objects.filter(jugo_id=producto_data['jugo_id']).first()
-        
-        if sopa_menu and jugo_menu:
-            return PedidoSopa.objects.create(
-                pedido=pedido,
-                sopa=sopa_menu,
-                jugo=jugo_menu,
-                cantidad=producto_data['cantidad'],
-                precio_unitario=producto_data['precio_unitario'],
-                observacion=producto_data.get('observacion', '')
-            )
-    
-    elif tipo == 'Segundo':
-        segundo_menu = MenuDiaSegundo.objects.filter(segundo_id=producto_data['segundo_id']).first()
-        jugo_menu = MenuDiaJugo.objects.filter(jugo_id=producto_data['jugo_id']).first()
-        
-        if segundo_menu and jugo_menu:
-            return PedidoSegundo.objects.create(
-                pedido=pedido,
-                segundo=segundo_menu,
-                jugo=jugo_menu,
-                cantidad=producto_data['cantidad'],
-                precio_unitario=producto_data['precio_unitario'],
-                observacion=producto_data.get('observacion', '')
-            )
-    
-    elif tipo == 'Extra':
-        # Para extras, crear múltiples registros si hay múltiples extras
-        extras_ids = producto_data.get('extras_ids', '').split(',')
-        extras_creados = []
-        
-        for extra_id in extras_ids:
-            if extra_id.strip():
-                try:
-                    extra_plato = Plato.objects.get(id=int(extra_id.strip()), tipo='extra')
-                    extra_creado = PedidoExtra.objects.create(
-                        pedido=pedido,
-                        extra=extra_plato,
-                        cantidad=producto_data['cantidad'],
-                        precio_unitario=extra_plato.precio,  # Usar precio del plato
-                        observacion=producto_data.get('observacion', '')
-                    )
-                    extras_creados.append(extra_creado)
-                except Plato.DoesNotExist:
-                    continue
-        
-        return extras_creados[0] if extras_creados else None
-    
-    return None
-
-def generar_clave_producto(producto):
-    """Genera una clave única para identificar un producto"""
-    if producto['tipo'] == 'Almuerzo':
-        return f"almuerzo_{producto['sopa_id']}_{producto['segundo_id']}_{producto['jugo_id']}"
-    elif producto['tipo'] == 'Sopa':
-        return f"sopa_{producto['sopa_id']}_{producto['jugo_id']}"
-    elif producto['tipo'] == 'Segundo':
-        return f"segundo_{producto['segundo_id']}_{producto['jugo_id']}"
-    elif producto['tipo'] == 'Extra':
-        return f"extra_{producto.get('extras_ids', '')}"
-    return None
-
 def calcular_total_pedido(pedido):
-    """Calcula el total de un pedido sumando todos sus productos"""
-    total = Decimal('0.00')
-    for almuerzo in pedido.almuerzos.all():
-        total += Decimal(str(almuerzo.precio_unitario)) * Decimal(str(almuerzo.cantidad))
-    for sopa in pedido.sopas.all():
-        total += Decimal(str(sopa.precio_unitario)) * Decimal(str(sopa.cantidad))
-    for segundo in pedido.segundos.all():
-        total += Decimal(str(segundo.precio_unitario)) * Decimal(str(segundo.cantidad))
-    
-    for extra in pedido.extras.all():
-        total += Decimal(str(extra.precio_unitario)) * Decimal(str(extra.cantidad))
-    
-    return total
+    """Calcula el total de un pedido sumando todos sus productos (una consulta)"""
+    total = pedido.items.aggregate(total=Sum(F('precio_unitario') * F('cantidad')))['total']
+    return total if total is not None else Decimal('0.00')
 
 # ===== VISTAS PRINCIPALES =====
 
@@ -332,8 +207,7 @@ def agregar_al_carrito(request):
         if tipo and tipo.lower() == 'extra':
             # Para extras: sumar precios de todos los extras seleccionados
             ids = [int(x) for x in extras_ids_raw.split(',') if x.strip().isdigit()]
-            from menu.models import Plato
-            precios = list(Plato.objects.filter(id__in=ids, tipo='extra').values_list('precio', flat=True))
+            precios = [plato.precio for plato in obtener_catalogo().platos(ids, tipo='extra').values()]
             precio_unitario = sum(Decimal(str(p)) for p in precios) if precios else Decimal('0.00')
         else:
             # Productos normales (almuerzo/sopa/segundo)
@@ -349,34 +223,33 @@ def agregar_al_carrito(request):
         return JsonResponse({'status': 'error', 'message': f'Error interno: {str(e)}'}, status=500)
 
 
+def productos_para_ticket(productos_carrito):
+    """
+    Productos agregados (carrito) listos para el ticket de cocina.
+
+    Si un producto no trae 'componentes' (p. ej. extras, que solo traen IDs, o
+    pedidos enviados por la API v2) los nombres se toman del catálogo.
+    """
+    catalogo = obtener_catalogo()
+    productos = []
+    for producto in productos_carrito:
+        producto = dict(producto)
+        if not producto.get('componentes'):
+            if producto.get('tipo') == 'Extra':
+                ids = ids_extras(producto)
+            else:
+                ids = [producto.get(campo) for campo in ('sopa_id', 'segundo_id', 'jugo_id')]
+            platos = [catalogo.plato(_coerce_plato_id(plato_id)) for plato_id in ids]
+            producto['componentes'] = [plato.nombre_plato for plato in platos if plato]
+        productos.append(producto)
+    return productos
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
-def guardar_pedido(request):
-    # Buscar caja abierta actual o crear una nueva para hoy
-    caja = CajaDiaria.objects.filter(estado='abierta').first()
-    
-    if not caja:
-        # No hay caja abierta, crear una nueva para hoy
-        caja = CajaDiaria.objects.create(
-            fecha=date.today(),
-            estado='abierta'
-        )
-        CajaEfectivo.objects.create(caja_diaria=caja, monto_inicial=0)
-        CajaTransferencia.objects.create(caja_diaria=caja, monto_inicial=0)
-
+@idempotente('guardar_pedido')
+async def guardar_pedido(request):
     try:
-        tipo_pedido = request.POST.get('tipo_pedido')
-        forma_pago = request.POST.get('forma_pago')
-        mesa = request.POST.get('mesa')
-        contacto = request.POST.get('cliente')  # Viene del frontend como 'cliente'
-        subtipo_reservado = request.POST.get('subtipo_reservado')  # Para pedidos reservados
-        print(f"[DEBUG] Subtipo recibido del frontend: {subtipo_reservado}")
-        observaciones_generales = request.POST.get('observaciones_generales')
-        pedido_id_editar = request.POST.get('pedido_id')
-        es_agregar_productos = request.POST.get('es_agregar_productos') == 'true'
-        imprimir_pedido = request.POST.get('imprimir', 'true') != 'false'
-
-        total_pedido = Decimal('0.00')
         productos_carrito = []
         
         # Intentar obtener productos del frontend primero
@@ -384,13 +257,12 @@ def guardar_pedido(request):
         
         if productos_frontend:
             try:
-                import json
                 productos_carrito = json.loads(productos_frontend)
                 
+                # Validar precio y cantidad de cada producto (el total se calcula en el diff)
                 for producto in productos_carrito:
-                    precio_unitario = Decimal(str(producto.get('precio_unitario', 0)))
-                    cantidad = int(producto.get('cantidad', 1))
-                    total_pedido += precio_unitario * Decimal(str(cantidad))
+                    Decimal(str(producto.get('precio_unitario', 0)))
+                    int(producto.get('cantidad', 1))
                     
             except Exception as e:
                 productos_carrito = []
@@ -399,458 +271,292 @@ def guardar_pedido(request):
         if not productos_carrito:
             return JsonResponse({'status': 'error', 'message': 'No se recibieron productos del pedido'}, status=400)
 
-        with transaction.atomic():
-            # Si viene un ID, actualizar el pedido existente; si no, crear uno nuevo
-            if pedido_id_editar:
-                pedido = Pedido.objects.get(id=pedido_id_editar, estado='pendiente')
-    
-                if es_agregar_productos:
-                    # Solo agregar productos, no modificar campos del pedido
-                    total_anterior = pedido.total
-                    pedido.total = total_anterior + total_pedido  # Sumar al total existente
-                    pedido.save()
-                else:
-                    # Edición normal - actualizar campos del pedido
-                    total_anterior = pedido.total
-                    pedido.tipo = tipo_pedido
-                    pedido.forma_pago = forma_pago
-                    pedido.numero_mesa = mesa if mesa else None
-                    pedido.contacto = contacto
-                    pedido.subtipo_reservado = (
-                        subtipo_reservado
-                        if (tipo_pedido or '').lower() == 'reservado'
-                        else None
-                    )
-                    pedido.observaciones_generales = observaciones_generales
-                    pedido.total = total_pedido
-                    pedido.save()
-            else:
-                # Crear el pedido principal
-                pedido = Pedido.objects.create(
-                    tipo=tipo_pedido,
-                    forma_pago=forma_pago,
-                    numero_mesa=mesa if mesa else None,
-                    contacto=contacto,
-                    subtipo_reservado=subtipo_reservado if tipo_pedido.lower() == 'reservado' else None,
-                    observaciones_generales=observaciones_generales,
-                    estado='pendiente',  # Guardar como pendiente
-                    total=total_pedido  # Guardar el total del pedido
+        datos = {
+            'tipo_pedido': request.POST.get('tipo_pedido'),
+            'forma_pago': request.POST.get('forma_pago'),
+            'mesa': request.POST.get('mesa'),
+            'cliente': request.POST.get('cliente'),
+            'subtipo_reservado': request.POST.get('subtipo_reservado'),  # Para pedidos reservados
+            'observaciones_generales': request.POST.get('observaciones_generales'),
+            'pedido_id': request.POST.get('pedido_id'),
+            'es_agregar_productos': request.POST.get('es_agregar_productos') == 'true',
+            'imprimir': request.POST.get('imprimir', 'true') != 'false',
+            'productos': productos_carrito,
+        }
+    except Exception as e:
+        logger.error(f"Error al leer pedido: {str(e)}", exc_info=True)
+        return JsonResponse({'status': 'error', 'message': f'Error interno: {str(e)}'}, status=500)
+
+    return await registrar_pedido(datos)
+
+
+def _guardar_pedido_en_bd(datos):
+    """
+    Parte transaccional de registrar_pedido (síncrona: se llama con sync_to_async).
+
+    Returns:
+        tuple: (pedido, productos_reconstruidos, total_real, pedido_data, tipo_anterior,
+                mensaje 'stock_actualizado' o None)
+    """
+    tipo_pedido = datos['tipo_pedido']
+    forma_pago = datos.get('forma_pago')
+    mesa = datos.get('mesa')
+    contacto = datos.get('cliente')  # Viene del frontend como 'cliente'
+    subtipo_reservado = datos.get('subtipo_reservado')
+    observaciones_generales = datos.get('observaciones_generales')
+    pedido_id_editar = datos.get('pedido_id')
+    es_agregar_productos = datos.get('es_agregar_productos', False)
+    imprimir_pedido = datos.get('imprimir', True)
+    productos_carrito = datos['productos']
+
+    # La versión de cambios se toma al final (solo bloquea el contador hasta el commit)
+    with transaccion_versionada():
+        # Si viene un ID, actualizar el pedido existente; si no, crear uno nuevo
+        if pedido_id_editar:
+            pedido = Pedido.objects.select_for_update().get(id=pedido_id_editar, estado='pendiente')
+            tipo_anterior = pedido.tipo
+
+            if not es_agregar_productos:
+                # Edición normal - actualizar campos del pedido
+                # (al agregar productos solo cambian las líneas y el total)
+                pedido.tipo = tipo_pedido
+                pedido.forma_pago = forma_pago
+                pedido.numero_mesa = mesa if mesa else None
+                pedido.contacto = contacto
+                pedido.subtipo_reservado = (
+                    subtipo_reservado
+                    if (tipo_pedido or '').lower() == 'reservado'
+                    else None
                 )
-                
-                # Debug: verificar que se guardó correctamente
-                print(f"[DEBUG] Pedido creado - ID: {pedido.id}, Subtipo guardado: {pedido.subtipo_reservado}")
-                print(f"[DEBUG] Tipo pedido: '{tipo_pedido}', Comparación: {tipo_pedido.lower() == 'reservado'}")
-    
-            # Guardar productos del carrito en BD
-            productos_guardados = []
-            
-            # Si es edición, manejar productos existentes y nuevos
-            productos_existentes = {}  # Cambiar a diccionario para mantener referencias
-            productos_procesados = set()  # Para rastrear qué productos se procesaron
-            productos_originales = []  # Para devolver cantidades originales
-            
-            if pedido_id_editar:
-                # Obtener productos existentes con sus referencias
-                for almuerzo in pedido.almuerzos.all():
-                    key = f"almuerzo_{almuerzo.sopa.id}_{almuerzo.segundo.id}_{almuerzo.jugo.id}"
-                    productos_existentes[key] = {'tipo': 'almuerzo', 'objeto': almuerzo}
-                    # Agregar a productos originales para devolver cantidades
-                    productos_originales.append({
-                        'tipo': 'almuerzo',
-                        'cantidad': almuerzo.cantidad,
-                        'sopa_id': almuerzo.sopa.sopa.id,  # Plato ID
-                        'segundo_id': almuerzo.segundo.segundo.id  # Plato ID
-                    })
-                for sopa in pedido.sopas.all():
-                    key = f"sopa_{sopa.sopa.id}_{sopa.jugo.id}"
-                    productos_existentes[key] = {'tipo': 'sopa', 'objeto': sopa}
-                    # Agregar a productos originales para devolver cantidades
-                    productos_originales.append({
-                        'tipo': 'sopa',
-                        'cantidad': sopa.cantidad,
-                        'sopa_id': sopa.sopa.sopa.id  # Plato ID
-                    })
-                for segundo in pedido.segundos.all():
-                    key = f"segundo_{segundo.segundo.id}_{segundo.jugo.id}"
-                    productos_existentes[key] = {'tipo': 'segundo', 'objeto': segundo}
-                    # Agregar a productos originales para devolver cantidades
-                    productos_originales.append({
-                        'tipo': 'segundo',
-                        'cantidad': segundo.cantidad,
-                        'segundo_id': segundo.segundo.segundo.id  # Plato ID
-                    })
-                # Agregar extras existentes
-                for extra in pedido.extras.all():
-                    key = f"extra_{extra.extra.id}"
-                    productos_existentes[key] = {'tipo': 'extra', 'objeto': extra}
-                    # Agregar a productos originales para devolver cantidades
-                    productos_originales.append({
-                        'tipo': 'extra',
-                        'cantidad': extra.cantidad,
-                        'extra_id': extra.extra.id  # Plato ID
-                    })
-            
-            for producto in productos_carrito:
-                # Para extras, procesar cada extra individualmente
-                if producto['tipo'] == 'Extra':
-                    # Los extras se procesan individualmente ya que cada uno es un registro separado
-                    extras_ids = producto.get('extras_ids', '').split(',')
-                    extras_a_crear = []  # Lista de IDs de extras que necesitan ser creados
-                    
-                    # Si es edición, verificar qué extras ya existen
-                    if pedido_id_editar:
-                        for extra_id in extras_ids:
-                            if extra_id.strip():
-                                extra_key = f"extra_{extra_id.strip()}"
-                                if extra_key in productos_existentes:
-                                    # El extra existe, actualizar cantidad
-                                    extra_existente = productos_existentes[extra_key]['objeto']
-                                    productos_procesados.add(extra_key)  # Marcar como procesado
-                                    
-                                    # Si la cantidad es 0, eliminar el extra
-                                    if producto['cantidad'] <= 0:
-                                        extra_existente.delete()
-                                    else:
-                                        extra_existente.cantidad = producto['cantidad']
-                                        extra_existente.observacion = producto.get('observacion', '')
-                                        extra_existente.save()
-                                else:
-                                    # El extra no existe, agregarlo a la lista para crearlo
-                                    extras_a_crear.append(extra_id.strip())
-                    else:
-                        # Pedido nuevo, todos los extras deben crearse
-                        extras_a_crear = [eid.strip() for eid in extras_ids if eid.strip()]
-                    
-                    # Si hay extras a crear, crear el producto (que creará todos los extras)
-                    if extras_a_crear:
-                        producto_creado = crear_producto_pedido(pedido, producto)
-                        if producto_creado:
-                            # Agregar todos los extras creados a productos_guardados
-                            for extra_id in extras_a_crear:
-                                if extra_id.strip():
-                                    try:
-                                        from menu.models import Plato
-                                        extra_plato = Plato.objects.get(id=int(extra_id.strip()), tipo='extra')
-                                        extra_obj = PedidoExtra.objects.filter(
-                                            pedido=pedido,
-                                            extra=extra_plato
-                                        ).order_by('-id').first()
-                                        if extra_obj:
-                                            producto_dict = convertir_producto_a_dict(extra_obj, 'Extra')
-                                            if producto_dict:
-                                                extra_id_existente = producto_dict.get('extra_id')
-                                                if not any(p.get('extra_id') == extra_id_existente and p.get('tipo') == 'Extra' 
-                                                           for p in productos_guardados):
-                                                    productos_guardados.append(producto_dict)
-                                    except (Plato.DoesNotExist, ValueError):
-                                        continue
-                    # Continuar al siguiente producto
-                    continue
-                
-                # Generar clave del producto usando función auxiliar (para productos normales)
-                producto_key = generar_clave_producto(producto)
-                
-                # Si es edición y el producto existe, actualizar cantidad
-                if pedido_id_editar and producto_key in productos_existentes:
-                    producto_existente = productos_existentes[producto_key]['objeto']
-                    productos_procesados.add(producto_key)  # Marcar como procesado
-                    
-                    # Si la cantidad es 0, eliminar el producto
-                    if producto['cantidad'] <= 0:
-                        producto_existente.delete()
-                    else:
-                        producto_existente.cantidad = producto['cantidad']
-                        producto_existente.observacion = producto.get('observacion', '')
-                        producto_existente.save()
-                    continue
-                
-                # Crear producto usando función auxiliar
-                producto_creado = crear_producto_pedido(pedido, producto)
-                if producto_creado:
-                    # Para extras, crear_producto_pedido puede crear múltiples registros
-                    # Necesitamos agregar todos los extras creados
-                    if producto['tipo'] == 'Extra':
-                        # Obtener todos los extras recién creados para este pedido
-                        # Usar el ID del pedido y los extras_ids para encontrar los extras creados
-                        extras_ids = producto.get('extras_ids', '').split(',')
-                        for extra_id in extras_ids:
-                            if extra_id.strip():
-                                try:
-                                    from menu.models import Plato
-                                    extra_plato = Plato.objects.get(id=int(extra_id.strip()), tipo='extra')
-                                    # Buscar el extra más reciente creado para este pedido y este plato
-                                    extra_obj = PedidoExtra.objects.filter(
-                                        pedido=pedido,
-                                        extra=extra_plato
-                                    ).order_by('-id').first()
-                                    if extra_obj:
-                                        producto_dict = convertir_producto_a_dict(extra_obj, 'Extra')
-                                        if producto_dict:
-                                            # Verificar que no esté ya en productos_guardados
-                                            extra_id_existente = producto_dict.get('extra_id')
-                                            if not any(p.get('extra_id') == extra_id_existente and p.get('tipo') == 'Extra' 
-                                                       for p in productos_guardados):
-                                                productos_guardados.append(producto_dict)
-                                except (Plato.DoesNotExist, ValueError):
-                                    continue
-                    else:
-                        # Para otros tipos de productos, usar el método normal
-                        producto_dict = convertir_producto_a_dict(producto_creado, producto['tipo'])
-                        if producto_dict:
-                            productos_guardados.append(producto_dict)
-    
-            # NOTA: No se actualiza caja automáticamente aquí
-            # Las ventas solo se suman cuando el pedido se marca como 'completado'
-    
-            # Si es edición, devolver cantidades originales antes de restar las nuevas
-            if pedido_id_editar and productos_originales:
-                print(f"=== EDITANDO PEDIDO {pedido_id_editar} ===")
-                print(f"Productos originales: {productos_originales}")
-                actualizar_cantidades_menu(productos_originales, 'sumar')
-                print("✅ Cantidades originales devueltas")
-            
-            # Actualizar cantidades del menú del día
-            print(f"Productos nuevos: {productos_carrito}")
-            actualizar_cantidades_menu(productos_carrito, 'restar')
-            print("✅ Cantidades nuevas restadas")
-    
-            # Si es edición, eliminar productos que ya no están en el carrito
-            if pedido_id_editar and not es_agregar_productos:
-                # Solo eliminar productos si NO estamos agregando productos
-                # Encontrar productos que no fueron procesados (eliminados del carrito)
-                productos_a_eliminar = set(productos_existentes.keys()) - productos_procesados
-                print(f"DEBUG: Productos a eliminar: {productos_a_eliminar}")
-                print(f"DEBUG: Productos existentes: {set(productos_existentes.keys())}")
-                print(f"DEBUG: Productos procesados: {productos_procesados}")
-                for producto_key in productos_a_eliminar:
-                    producto_existente = productos_existentes[producto_key]['objeto']
-                    producto_existente.delete()
-                    print(f"DEBUG: Producto eliminado: {producto_key}")
-            
-            # Reconstruir productos desde la BD usando función auxiliar (después de eliminar)
-            productos_reconstruidos = obtener_productos_pedido(pedido)
-            
-            # Recalcular el total real desde la BD
-            total_real = Decimal('0.00')
-            for producto in productos_reconstruidos:
-                total_real += Decimal(str(producto['precio_unitario'])) * Decimal(str(producto['cantidad']))
-            
-            # Actualizar el total del pedido si es diferente
-            if pedido.total != total_real:
-                pedido.total = total_real
-                pedido.save()
+                pedido.observaciones_generales = observaciones_generales
+        else:
+            # Crear el pedido principal (se guarda junto con su total más abajo)
+            pedido = Pedido(
+                tipo=tipo_pedido,
+                forma_pago=forma_pago,
+                numero_mesa=mesa if mesa else None,
+                contacto=contacto,
+                subtipo_reservado=subtipo_reservado if tipo_pedido.lower() == 'reservado' else None,
+                observaciones_generales=observaciones_generales,
+                estado='pendiente',  # Guardar como pendiente
+            )
+            tipo_anterior = None
 
-        # Enviar mensaje WebSocket
-        try:
-            pedido_data = serializar_pedido_para_websocket(pedido)
-            if pedido_data:
-                if pedido_id_editar:
-                    # Pedido actualizado
-                    enviar_mensaje_websocket('pedido_actualizado', pedido_data)
-                else:
-                    # Pedido creado
-                    enviar_mensaje_websocket('pedido_creado', pedido_data)
-        except Exception as e:
-            print(f"[WEBSOCKET] Error al enviar mensaje: {e}")
-
-        # Imprimir comando para cocina
-        try:
-            if not imprimir_pedido:
-                raise StopIteration
-            from impresion.impresora import ImpresoraTermica
-            from django.utils import timezone
-
-            # Crear comando para cocina
-            # Crear línea dinámica según el tipo de pedido
-            linea_info = f"{pedido.tipo.upper()}"
-            
-            if pedido.tipo == 'Servirse' and pedido.numero_mesa:
-                # Para servirse: mostrar mesa
-                espacios = 45 - len(f"{pedido.tipo.upper()}.") - len(f"MESA: {pedido.numero_mesa}")
-                linea_info += " " * espacios + f"MESA: {pedido.numero_mesa}"
-            elif pedido.tipo == 'Llevar' and pedido.contacto:
-                # Para llevar: mostrar cliente
-                espacios = 45 - len(f"{pedido.tipo.upper()}.") - len(f"{pedido.contacto}")
-                linea_info += " " * espacios + f"{pedido.contacto.upper()}"
-            elif pedido.tipo == 'Reservado' and pedido.contacto:
-                # Para reservado: mostrar cliente y subtipo
-                print(f"[DEBUG] Pedido Reservado - Contacto: {pedido.contacto}, Subtipo: {pedido.subtipo_reservado}")
-                print(f"[DEBUG] Tipo de pedido: {pedido.tipo}, Subtipo_reservado: {pedido.subtipo_reservado}")
-                subtipo_texto = f" ({pedido.subtipo_reservado})" if pedido.subtipo_reservado else ""
-                espacios = 45 - len(f"{pedido.tipo.upper()}.") - len(f"{pedido.contacto}{subtipo_texto}")
-                linea_info += " " * espacios + f"{pedido.contacto.upper()}{subtipo_texto.upper()}"
-            
-            # Calcular espacios para la segunda línea
-            hora_ticket = timezone.localtime().strftime('%H:%M')
-            espacios_segunda = 45 - len(f"Pedido #{pedido.numero_pedido_completo}") - len(f"Hora: {hora_ticket}")
-
-            comando_cocina = [
-                linea_info,
-                f"Pedido #{pedido.numero_pedido_completo}" + " " * espacios_segunda + f"Hora: {hora_ticket}"
-            ]
-            
-            # Agregar observaciones generales si existen
-            if pedido.observaciones_generales:
-                comando_cocina.append(f"  {pedido.observaciones_generales}")
+        # Comparar el carrito con las líneas guardadas: inserciones, cambios,
+        # eliminaciones, deltas de stock y total salen del mismo diff
+        diff = calcular_diff_lineas(pedido, productos_carrito, agregar=es_agregar_productos)
+        pedido.total = diff['total']
+        pedido.productos_snapshot = diff['productos']
+        pedido.save()
+        aplicar_diff_lineas(diff)
+
+        # Contadores de pendientes por tipo: +1 al crear; al editar, solo si cambió el tipo
+        if pedido.tipo != tipo_anterior:
+            deltas = {pedido.tipo: 1}
+            if tipo_anterior:
+                deltas[tipo_anterior] = -1
+            ajustar_contadores(deltas)
+
+        # NOTA: No se actualiza caja automáticamente aquí
+        # Las ventas solo se suman cuando el pedido se marca como 'completado'
+
+        # Stock: solo se aplica la diferencia respecto a lo que ya estaba guardado
+        stock = mensaje_stock(actualizar_cantidades_menu(diff['stock'], 'restar'))
+
+        productos_reconstruidos = diff['productos']
+        total_real = diff['total']
+        pedido_data = serializar_pedido_para_websocket(pedido, productos_reconstruidos)
+
+        # Ticket de cocina: se arma y envía en segundo plano una vez confirmado el pedido
+        if imprimir_pedido and pedido_data:
+            productos_ticket = (
+                productos_para_ticket(productos_carrito)
+                if es_agregar_productos else productos_reconstruidos
+            )
+            programar_ticket_cocina(pedido_data, productos_ticket, es_agregar_productos)
 
-            comando_cocina.append("-" * 45)
-                        
+    if pedido_data:
+        # Se serializó antes de que el pedido tomara su versión
+        pedido_data['version'] = pedido.version
+    return pedido, productos_reconstruidos, total_real, pedido_data, tipo_anterior, stock
 
-            
-            # Agregar productos con componentes verticales
-            productos_a_imprimir = productos_carrito if es_agregar_productos else productos_reconstruidos
-            
-            print(f"[DEBUG IMPRESIÓN] Productos a imprimir: {len(productos_a_imprimir)}")
-            print(f"[DEBUG IMPRESIÓN] Es agregar productos: {es_agregar_productos}")
-            
-            # Asegurar que todos los productos tengan componentes formateados
-            productos_formateados = []
-            for producto in productos_a_imprimir:
-                try:
-                    producto_formateado = producto.copy()
-                    
-                    # Si es un extra y no tiene componentes, formatearlo
-                    if producto.get('tipo') == 'Extra':
-                        # Si viene de productos_carrito, puede no tener componentes formateados
-                        if not producto.get('componentes') or len(producto.get('componentes', [])) == 0:
-                            # Intentar obtener el nombre del extra desde extras_ids
-                            extras_ids = producto.get('extras_ids', '')
-                            if extras_ids:
-                                try:
-                                    from menu.models import Plato
-                                    nombres_extras = []
-                                    for extra_id in extras_ids.split(','):
-                                        if extra_id.strip():
-                                            try:
-                                                extra_plato = Plato.objects.get(id=int(extra_id.strip()), tipo='extra')
-                                                nombres_extras.append(extra_plato.nombre_plato)
-                                            except Plato.DoesNotExist:
-                                                continue
-                                    if nombres_extras:
-                                        producto_formateado['componentes'] = nombres_extras
-                                except Exception as e:
-                                    print(f"[ERROR] Error al formatear extras para impresión: {e}")
-                    
-                    productos_formateados.append(producto_formateado)
-                except Exception as e:
-                    print(f"[ERROR] Error al formatear producto para impresión: {e}")
-                    print(f"[ERROR] Producto problemático: {producto}")
-                    continue
-            
-            print(f"[DEBUG IMPRESIÓN] Productos formateados: {len(productos_formateados)}")
-            
-            for producto in productos_formateados:
-                try:
-                    # Línea principal con cantidad y tipo
-                    comando_cocina.append(f"{producto['cantidad']}x {producto['tipo']}")
-                    
-                    # Componentes en forma vertical (uno debajo del otro)
-                    if producto.get('componentes'):
-                        for componente in producto['componentes']:
-                            comando_cocina.append(f"  - {componente}")
-                    
-                    # Observación en línea separada si existe
-                    if producto.get('observacion'):
-                        comando_cocina.append(f"  Obs: {producto['observacion']}")
-                    
-                    comando_cocina.append("")
-                except Exception as e:
-                    print(f"[ERROR] Error al agregar producto al comando: {e}")
-                    print(f"[ERROR] Producto: {producto}")
-                    continue
-            
-            print(f"[DEBUG IMPRESIÓN] Comando cocina generado: {len(comando_cocina)} líneas")
 
+async def asegurar_caja_abierta():
+    """Busca la caja abierta actual o crea una nueva para hoy."""
+    caja = await CajaDiaria.objects.filter(estado='abierta').afirst()
+    
+    if not caja:
+        # No hay caja abierta, crear una nueva para hoy
+        caja = await CajaDiaria.objects.acreate(
+            fecha=date.today(),
+            estado='abierta'
+        )
+        await CajaEfectivo.objects.acreate(caja_diaria=caja, monto_inicial=0)
+        await CajaTransferencia.objects.acreate(caja_diaria=caja, monto_inicial=0)
+        await aenviar_caja()
+    return caja
 
-            
-            # Imprimir vía WebSocket (tablet conectada a Railway)
-            try:
-                enviar_trabajo_impresion(pedido, comando_cocina, es_agregar_productos)
-            except Exception as e:
-                print(f"[WARNING] Error al enviar trabajo de impresión: {e}")
-                import traceback
-                traceback.print_exc()
-                
-        except StopIteration:
-            pass
-        except Exception as e:
-            print(f"[ERROR] Error general al imprimir: {e}")
-            import traceback
-            traceback.print_exc()
-
-        # Mensaje diferente según la acción
-        if es_agregar_productos:
-            mensaje = 'Productos agregados al pedido correctamente'
-        elif pedido_id_editar:
-            mensaje = 'Pedido actualizado correctamente'
-        else:
-            mensaje = 'Pedido creado correctamente'
-        
-        return JsonResponse({
-            'status': 'ok', 
-            'message': mensaje,
-            'pedido_id': pedido.id,
-            'pedido_data': {
-                'id': pedido.id,
-                'numero_dia': pedido.numero_dia,
-                'numero_pedido_completo': pedido.numero_pedido_completo,
-                'tipo': pedido.tipo,
-                'forma_pago': pedido.forma_pago,
-                'mesa': pedido.numero_mesa,
-                'contacto': pedido.contacto,
-                'subtipo_reservado': pedido.subtipo_reservado,
-                'fecha_creacion': pedido.fecha_creacion.isoformat(),
-                'estado': pedido.estado,
-                'productos': productos_reconstruidos,  # Usar productos reconstruidos
-                'total': float(total_real)  # Usar total real recalculado
-            }
-        })
 
+async def registrar_pedido(datos):
+    """
+    Crea o edita un pedido a partir de datos ya leídos y validados.
+
+    Usado por guardar_pedido (formulario) y guardar_pedido_v2 (JSON). `datos`
+    lleva las mismas claves que el formulario, con 'productos' como lista y
+    'es_agregar_productos'/'imprimir' como bool. La transacción corre en un
+    hilo con sync_to_async; el aviso por WebSocket se hace ya en el event loop.
+    """
+    pedido_id_editar = datos.get('pedido_id')
+    es_agregar_productos = datos.get('es_agregar_productos', False)
+
+    try:
+        await asegurar_caja_abierta()
+        pedido, productos_reconstruidos, total_real, pedido_data, tipo_anterior, stock = await sync_to_async(
+            _guardar_pedido_en_bd
+        )(datos)
     except Exception as e:
         logger.error(f"Error al guardar pedido: {str(e)}", exc_info=True)
         return JsonResponse({'status': 'error', 'message': f'Error interno: {str(e)}'}, status=500)
 
+    # Enviar mensaje WebSocket
+    if pedido_data:
+        if pedido_id_editar:
+            # Pedido actualizado (si cambió de tipo, también lo sabe el tema del tipo anterior)
+            datos_tipo = {'tipo_anterior': tipo_anterior} if tipo_anterior != pedido.tipo else {}
+            await aenviar_mensaje_websocket('pedido_actualizado', pedido_data, **datos_tipo)
+        else:
+            # Pedido creado
+            await aenviar_mensaje_websocket('pedido_creado', pedido_data)
+    if stock:
+        # Solo las filas que cambiaron (las tablets no vuelven a pedir las cantidades)
+        await publicador_pedidos().publicar(stock)
+
+    # Mensaje diferente según la acción
+    if es_agregar_productos:
+        mensaje = 'Productos agregados al pedido correctamente'
+    elif pedido_id_editar:
+        mensaje = 'Pedido actualizado correctamente'
+    else:
+        mensaje = 'Pedido creado correctamente'
+    
+    return JsonResponse({
+        'status': 'ok', 
+        'message': mensaje,
+        'pedido_id': pedido.id,
+        'pedido_data': {
+            'id': pedido.id,
+            'numero_dia': pedido.numero_dia,
+            'numero_pedido_completo': pedido.numero_pedido_completo,
+            'tipo': pedido.tipo,
+            'forma_pago': pedido.forma_pago,
+            'mesa': pedido.numero_mesa,
+            'contacto': pedido.contacto,
+            'subtipo_reservado': pedido.subtipo_reservado,
+            'fecha_creacion': pedido.fecha_creacion.isoformat(),
+            'estado': pedido.estado,
+            'productos': productos_reconstruidos,  # Usar productos reconstruidos
+            'total': float(total_real)  # Usar total real recalculado
+        }
+    })
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@idempotente('guardar_pedido_v2')
+async def guardar_pedido_v2(request):
+    """
+    Crea o edita un pedido desde un cuerpo application/json.
+
+    Mismos campos que guardar_pedido, con tipos nativos: 'productos' es una
+    lista, 'extras_ids' una lista de IDs y los indicadores son booleanos. Si hay
+    errores se devuelven todos juntos, cada uno con su campo y, para los
+    productos, el índice de la línea.
+    """
+    if request.content_type != 'application/json':
+        return JsonResponse({'status': 'error', 'message': 'Se esperaba application/json'}, status=415)
+
+    try:
+        data = decodificar_json(request.body)
+    except ErrorJSON as e:
+        return JsonResponse({'status': 'error', 'message': f'JSON inválido: {e}'}, status=400)
+
+    datos, errores = validar_pedido(data)
+    if errores:
+        return JsonResponse({'status': 'error', 'message': 'Pedido inválido', 'errores': errores}, status=400)
+
+    return await registrar_pedido(datos)
+
+
+def sumar_ventas_caja(totales):
+    """
+    Suma ventas a la caja abierta actual. `totales` es {forma_pago: Decimal}.
+
+    Se usa F() para que dos completados simultáneos no se pisen el total.
+    """
+    caja = CajaDiaria.objects.filter(estado='abierta').first()
+    if not caja:
+        return  # No hay caja abierta, no se suma
+    modelos = {'Efectivo': CajaEfectivo, 'Transferencia': CajaTransferencia}
+    for forma_pago, total in totales.items():
+        if forma_pago in modelos and total:
+            modelos[forma_pago].objects.filter(caja_diaria=caja).update(total_ventas=F('total_ventas') + total)
+
+
+def _completar_pedidos(pedido_ids):
+    """
+    Marca como completados los pedidos pendientes indicados y suma sus totales
+    a la caja, todo en una transacción (síncrona: se llama con sync_to_async).
+
+    Returns:
+        list: IDs de los pedidos que estaban pendientes y se completaron
+    """
+    with transaccion_versionada():
+        pendientes = list(
+            Pedido.objects.select_for_update()
+            .filter(id__in=pedido_ids, estado='pendiente')
+            .values_list('id', 'forma_pago', 'total', 'tipo')
+        )
+        if not pendientes:
+            return []
+
+        totales = defaultdict(Decimal)
+        completados_por_tipo = defaultdict(int)
+        for _, forma_pago, total, tipo in pendientes:
+            totales[forma_pago] += total
+            completados_por_tipo[tipo] -= 1
+
+        ids = [pedido_id for pedido_id, _, _, _ in pendientes]
+        Pedido.objects.filter(id__in=ids).update(estado='completado', updated_at=timezone.now())
+        diferir_version(ids=ids)
+        marcar_cambio(CLAVE_PEDIDOS)
+        sumar_ventas_caja(totales)
+        ajustar_contadores(completados_por_tipo)
+    return ids
+
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def marcar_pedido_completado(request):
+async def marcar_pedido_completado(request):
     try:
         pedido_id = request.POST.get('pedido_id')
         if not pedido_id:
             return JsonResponse({'status': 'error', 'message': 'ID de pedido requerido'}, status=400)
         
-        pedido = Pedido.objects.get(id=pedido_id)
-        pedido.estado = 'completado'
-        pedido.save()
+        # Sumar a caja cuando se marca como completado (solo si estaba pendiente,
+        # para no sumar dos veces el mismo pedido)
+        completados = await sync_to_async(_completar_pedidos)([pedido_id])
+        pedido = await Pedido.objects.aget(id=pedido_id)
         
         # Enviar mensaje WebSocket
-        try:
-            pedido_data = serializar_pedido_para_websocket(pedido)
-            if pedido_data:
-                enviar_mensaje_websocket('pedido_actualizado', pedido_data)
-        except Exception as e:
-            print(f"[WEBSOCKET] Error al enviar mensaje: {e}")
-        
-        # Sumar a caja cuando se marca como completado
-        from caja.models import CajaDiaria
-        from datetime import date
-        
-        try:
-            # Buscar caja abierta actual
-            caja = CajaDiaria.objects.filter(estado='abierta').first()
-            if caja:
-                if pedido.forma_pago == 'Efectivo':
-                    caja.caja_efectivo.total_ventas += pedido.total
-                    caja.caja_efectivo.save()
-                elif pedido.forma_pago == 'Transferencia':
-                    caja.caja_transferencia.total_ventas += pedido.total
-                    caja.caja_transferencia.save()
-        except Exception:
-            pass  # No hay caja abierta, no se suma
+        pedido_data = await sync_to_async(serializar_pedido_para_websocket)(pedido)
+        if pedido_data:
+            await aenviar_mensaje_websocket('pedido_actualizado', pedido_data)
+        if completados:
+            await aenviar_caja()
         
         return JsonResponse({'status': 'ok', 'message': 'Pedido marcado como completado'})
         
-    except Pedido.DoesNotExist:
+    except (Pedido.DoesNotExist, ValueError):
         return JsonResponse({'status': 'error', 'message': 'Pedido no encontrado'}, status=404)
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': f'Error interno: {str(e)}'}, status=500)
@@ -862,8 +568,8 @@ def obtener_pedido(request, pedido_id):
     try:
         pedido = Pedido.objects.get(id=pedido_id, estado='pendiente')
         
-        # Obtener productos del pedido usando función auxiliar 
-        productos = obtener_productos_pedido(pedido)
+        # Productos desde el snapshot del pedido (sin consultar las líneas)
+        productos = productos_de_pedido(pedido)
         
         return JsonResponse({
             'status': 'ok',
@@ -891,97 +597,79 @@ def obtener_pedido(request, pedido_id):
 @require_http_methods(["GET"])
 def obtener_pedidos_pendientes(request):
     try:
-        # Obtener todos los pedidos pendientes
+        # Obtener todos los pedidos pendientes con sus productos (desde el snapshot)
         pedidos = Pedido.objects.filter(estado='pendiente').order_by('-fecha_creacion')
         
-        pedidos_data = []
-        for pedido in pedidos:
-            # Obtener productos del pedido usando función auxiliar
-            productos = obtener_productos_pedido(pedido)
-            
-            pedidos_data.append({
-                'id': pedido.id,
-                'numero_dia': pedido.numero_dia,
-                'numero_pedido_completo': pedido.numero_pedido_completo,
-                'tipo': pedido.tipo,
-                'forma_pago': pedido.forma_pago,
-                'mesa': pedido.numero_mesa,
-                'contacto': pedido.contacto,
-                'subtipo_reservado': pedido.subtipo_reservado,
-                'observaciones_generales': pedido.observaciones_generales,
-                'fecha_creacion': pedido.fecha_creacion.isoformat(),
-                'estado': pedido.estado,
-                'productos': productos,
-                'total': float(pedido.total) if pedido.total else 0.0
-            })
-        
         return JsonResponse({
             'status': 'ok',
-            'pedidos': pedidos_data
+            'pedidos': serializar_pedidos(pedidos)
         })
         
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': f'Error interno: {str(e)}'}, status=500)
 
 
+def _eliminar_pedido_en_bd(pedido_id):
+    """
+    Devuelve el stock de los productos y elimina el pedido en una transacción.
+
+    El pedido se vuelve a leer bloqueado y solo si sigue pendiente: dos
+    eliminaciones del mismo pedido (reintentos) o una eliminación junto a
+    _completar_pedidos no devuelven el stock ni ajustan los contadores dos veces.
+
+    Returns:
+        tuple: (datos del pedido para el WebSocket, mensaje 'stock_actualizado' o None)
+
+    Raises:
+        Pedido.DoesNotExist: si el pedido no existe o ya no está pendiente
+    """
+    with transaccion_versionada():
+        pedido = Pedido.objects.select_for_update().filter(id=pedido_id, estado='pendiente').first()
+        if pedido is None:
+            raise Pedido.DoesNotExist(f"Pedido {pedido_id} no encontrado o no pendiente")
+
+        # Productos del pedido antes de eliminarlo: sirven para devolver el
+        # stock y para avisar por WebSocket
+        productos = productos_de_pedido(pedido)
+        pedido_data_ws = serializar_pedido_para_websocket(pedido, productos)
+
+        actualizadas = actualizar_cantidades_menu(
+            [
+                {
+                    'tipo': producto['tipo'].lower(),
+                    'cantidad': producto['cantidad'],
+                    'sopa_id': producto.get('sopa_id'),        # Plato.id
+                    'segundo_id': producto.get('segundo_id'),  # Plato.id
+                }
+                for producto in productos
+                if producto['tipo'] != 'Extra'
+            ],
+            'sumar',
+        )
+        pedido.delete()
+        ajustar_contadores({pedido.tipo: -1})
+    return pedido_data_ws, mensaje_stock(actualizadas)
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
-def eliminar_pedido(request):
+async def eliminar_pedido(request):
     """Elimina un pedido y actualiza las cantidades del menú"""
     try:
         pedido_id = request.POST.get('pedido_id')
         if not pedido_id:
             return JsonResponse({'status': 'error', 'message': 'ID de pedido requerido'}, status=400)
-        
-        pedido = Pedido.objects.get(id=pedido_id, estado='pendiente')
-        
-        # Obtener productos del pedido antes de eliminarlo
-        productos_pedido = []
-        
-        # Obtener almuerzos
-        for almuerzo in pedido.almuerzos.all():
-            productos_pedido.append({
-                'tipo': 'almuerzo',
-                'cantidad': almuerzo.cantidad,
-                'sopa_id': almuerzo.sopa.sopa.id,      # Plato.id
-                'segundo_id': almuerzo.segundo.segundo.id  # Plato.id
-            })
-        
-        # Obtener sopas individuales
-        for sopa in pedido.sopas.all():
-            productos_pedido.append({
-                'tipo': 'sopa',
-                'cantidad': sopa.cantidad,
-                'sopa_id': sopa.sopa.sopa.id           # Plato.id
-            })
-        
-        # Obtener segundos individuales
-        for segundo in pedido.segundos.all():
-            productos_pedido.append({
-                'tipo': 'segundo',
-                'cantidad': segundo.cantidad,
-                'segundo_id': segundo.segundo.segundo.id  # Plato.id
-            })
-        
-        pedido_data_ws = None
-        try:
-            pedido_data_ws = serializar_pedido_para_websocket(pedido)
-        except Exception as e:
-            print(f"[WEBSOCKET] Error al serializar pedido antes de eliminar: {e}")
 
-        with transaction.atomic():
-            actualizar_cantidades_menu(productos_pedido, 'sumar')
-            pedido.delete()
+        pedido_data_ws, stock = await sync_to_async(_eliminar_pedido_en_bd)(pedido_id)
 
-        try:
-            if pedido_data_ws:
-                enviar_mensaje_websocket('pedido_eliminado', pedido_data_ws)
-        except Exception as e:
-            print(f"[WEBSOCKET] Error al enviar mensaje: {e}")
+        if pedido_data_ws:
+            await aenviar_mensaje_websocket('pedido_eliminado', pedido_data_ws)
+        if stock:
+            await publicador_pedidos().publicar(stock)
 
         return JsonResponse({'status': 'ok', 'message': 'Pedido eliminado correctamente'})
         
-    except Pedido.DoesNotExist:
+    except (Pedido.DoesNotExist, ValueError):
         return JsonResponse({'status': 'error', 'message': 'Pedido no encontrado'}, status=404)
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': f'Error interno: {str(e)}'}, status=500)
@@ -989,49 +677,17 @@ def eliminar_pedido(request):
 
 @csrf_exempt
 @require_http_methods(["GET"])
+@etag(etag_stock)
 def obtener_cantidades_actualizadas(request):
-    """Obtiene las cantidades actualizadas del menú del día"""
+    """Obtiene las cantidades actualizadas del menú del día (desde la foto del stock)"""
     try:
-        from datetime import date
-        from menu.models import MenuDia, MenuDiaSopa, MenuDiaSegundo
-        
-        hoy = date.today()
-        
-        try:
-            menu = MenuDia.objects.get(fecha=hoy)
-        except MenuDia.DoesNotExist:
-            return JsonResponse({
-                'status': 'ok',
-                'sopas': [],
-                'segundos': []
-            })
-        
-        # Obtener sopas con cantidades actuales
-        sopas_data = []
-        for sopa in MenuDiaSopa.objects.filter(menu=menu):
-            sopas_data.append({
-                'id': sopa.id,
-                'nombre': str(sopa.sopa),
-                'cantidad_configurada': sopa.cantidad,
-                'cantidad_actual': sopa.cantidad_actual,
-                'cantidad_vendida': sopa.cantidad - sopa.cantidad_actual
-            })
-        
-        # Obtener segundos con cantidades actuales
-        segundos_data = []
-        for segundo in MenuDiaSegundo.objects.filter(menu=menu):
-            segundos_data.append({
-                'id': segundo.id,
-                'nombre': str(segundo.segundo),
-                'cantidad_configurada': segundo.cantidad,
-                'cantidad_actual': segundo.cantidad_actual,
-                'cantidad_vendida': segundo.cantidad - segundo.cantidad_actual
-            })
-        
+        stock = obtener_stock()
+        campos = ('id', 'nombre', 'cantidad_configurada', 'cantidad_actual', 'cantidad_vendida')
         return JsonResponse({
             'status': 'ok',
-            'sopas': sopas_data,
-            'segundos': segundos_data
+            'version': stock['version'],
+            'sopas': [{campo: fila[campo] for campo in campos} for fila in stock['sopas']],
+            'segundos': [{campo: fila[campo] for campo in campos} for fila in stock['segundos']],
         })
         
     except Exception as e:
@@ -1040,7 +696,7 @@ def obtener_cantidades_actualizadas(request):
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def marcar_pedidos_completados(request):
+async def marcar_pedidos_completados(request):
     """Marcar múltiples pedidos como completados"""
     try:
         data = json.loads(request.body)
@@ -1049,58 +705,18 @@ def marcar_pedidos_completados(request):
         if not pedido_ids:
             return JsonResponse({'status': 'error', 'message': 'No se proporcionaron IDs de pedidos'})
         
-        # Actualizar pedidos
-        pedidos_actualizados = Pedido.objects.filter(id__in=pedido_ids, estado='pendiente')
-        cantidad_actualizada = pedidos_actualizados.update(estado='completado')
-        
-        # Sumar a caja los pedidos que se marcaron como completados
-        from caja.models import CajaDiaria
-        from datetime import date
-        
-        try:
-            # Buscar caja abierta actual
-            caja = CajaDiaria.objects.filter(estado='abierta').first()
-            if caja:
-                total_efectivo = 0
-                total_transferencia = 0
-                
-                for pedido in pedidos_actualizados:
-                    if pedido.forma_pago == 'Efectivo':
-                        total_efectivo += pedido.total
-                    elif pedido.forma_pago == 'Transferencia':
-                        total_transferencia += pedido.total
-                
-                # Actualizar totales en caja
-                if total_efectivo > 0:
-                    caja.caja_efectivo.total_ventas += total_efectivo
-                    caja.caja_efectivo.save()
-                if total_transferencia > 0:
-                    caja.caja_transferencia.total_ventas += total_transferencia
-                    caja.caja_transferencia.save()
-                
-        except Exception:
-            pass  # No hay caja abierta, no se suma
+        # Actualizar pedidos y sumar a caja los que se marcaron como completados
+        completados = await sync_to_async(_completar_pedidos)(pedido_ids)
+        cantidad_actualizada = len(completados)
         
         # Enviar mensaje WebSocket para notificar a otros dispositivos
-        try:
-            from channels.layers import get_channel_layer
-            from asgiref.sync import async_to_sync
-            
-            channel_layer = get_channel_layer()
-            if channel_layer:
-                async_to_sync(channel_layer.group_send)(
-                    "pedidos",
-                    {
-                        "type": "pedidos_marcados_completados",
-                        "pedidos_ids": pedido_ids,
-                        "cantidad": cantidad_actualizada
-                    }
-                )
-                print(f"[WEBSOCKET] Notificación enviada: {cantidad_actualizada} pedidos marcados como completados")
-            else:
-                print("[WEBSOCKET] No hay channel layer configurado")
-        except Exception as e:
-            print(f"[WEBSOCKET] Error al enviar notificación: {e}")
+        await aenviar_mensaje_websocket(
+            'pedidos_marcados_completados',
+            pedidos_ids=pedido_ids,
+            cantidad=cantidad_actualizada,
+        )
+        if completados:
+            await aenviar_caja()
         
         return JsonResponse({
             'status': 'ok',
@@ -1114,115 +730,51 @@ def marcar_pedidos_completados(request):
 
 
 @require_http_methods(["GET"])
+@etag(etag_pedidos)
 def obtener_pedidos_por_tipo(request):
-    """Obtener pedidos filtrados por tipo"""
+    """
+    Obtener pedidos filtrados por tipo.
+
+    Con ?since=<versión> solo devuelve lo que cambió después de esa versión:
+    los pedidos nuevos o modificados y los ids a quitar ('eliminados'). Si la
+    versión es anterior a las bajas ya purgadas se devuelve la lista completa.
+    La respuesta siempre incluye la 'version' actual para la siguiente consulta.
+    """
     try:
         tipo = request.GET.get('tipo', 'todos')
+        since = request.GET.get('since')
+
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                return JsonResponse({'status': 'error', 'message': 'since debe ser un número'}, status=400)
+
+            cambios = cambios_desde(since, tipo)
+            if cambios is not None:
+                contadores = obtener_contadores()
+                return JsonResponse({
+                    'status': 'ok',
+                    'delta': True,
+                    'version': cambios['version'],
+                    'pedidos': serializar_pedidos(cambios['pedidos']),
+                    'eliminados': cambios['eliminados'],
+                    'cantidad': contadores.get(tipo, contadores['todos']),
+                })
+
+        # La versión se lee antes que la lista (ver pedidos.cambios.cambios_desde)
+        version = VersionCambios.actual()
+        pedidos = Pedido.objects.filter(estado='pendiente').order_by('-fecha_creacion')
         
-        pedidos = Pedido.objects.filter(estado='pendiente').prefetch_related(
-            'almuerzos__sopa', 'almuerzos__segundo', 'almuerzos__jugo',
-            'sopas__sopa', 'sopas__jugo',
-            'segundos__segundo', 'segundos__jugo',
-            'extras__extra'  # Incluir extras
-        ).order_by('-fecha_creacion')
+        if tipo in TIPOS_FILTRO:
+            pedidos = pedidos.filter(tipo=TIPOS_FILTRO[tipo])
         
-        if tipo == 'servirse':
-            pedidos = pedidos.filter(tipo='Servirse')
-        elif tipo == 'llevar':
-            pedidos = pedidos.filter(tipo='Llevar')
-        elif tipo == 'reservados':
-            pedidos = pedidos.filter(tipo='Reservado')
-        
-        # Calcular totales para cada pedido
-        for pedido in pedidos:
-            total_calculado = Decimal('0.00')
-            
-            for almuerzo in pedido.almuerzos.all():
-                total_calculado += almuerzo.precio_unitario * Decimal(str(almuerzo.cantidad))
-            
-            for sopa in pedido.sopas.all():
-                total_calculado += sopa.precio_unitario * Decimal(str(sopa.cantidad))
-            
-            for segundo in pedido.segundos.all():
-                total_calculado += segundo.precio_unitario * Decimal(str(segundo.cantidad))
-            
-            # Agregar extras al total
-            for extra in pedido.extras.all():
-                total_calculado += extra.precio_unitario * Decimal(str(extra.cantidad))
-            
-            pedido.total_calculado = total_calculado
-        
-        # Serializar pedidos
-        pedidos_data = []
-        for pedido in pedidos:
-            productos = []
-            
-            for almuerzo in pedido.almuerzos.all():
-                productos.append({
-                    'tipo': 'Almuerzo',
-                    'componentes': [
-                        almuerzo.sopa.sopa.nombre_plato,
-                        almuerzo.segundo.segundo.nombre_plato,
-                        almuerzo.jugo.jugo.nombre_plato
-                    ],
-                    'cantidad': almuerzo.cantidad,
-                    'precio_unitario': float(almuerzo.precio_unitario),
-                    'observacion': almuerzo.observacion or ''
-                })
-            
-            for sopa in pedido.sopas.all():
-                productos.append({
-                    'tipo': 'Sopa',
-                    'componentes': [
-                        sopa.sopa.sopa.nombre_plato,
-                        sopa.jugo.jugo.nombre_plato
-                    ],
-                    'cantidad': sopa.cantidad,
-                    'precio_unitario': float(sopa.precio_unitario),
-                    'observacion': sopa.observacion or ''
-                })
-            
-            for segundo in pedido.segundos.all():
-                productos.append({
-                    'tipo': 'Segundo',
-                    'componentes': [
-                        segundo.segundo.segundo.nombre_plato,
-                        segundo.jugo.jugo.nombre_plato
-                    ],
-                    'cantidad': segundo.cantidad,
-                    'precio_unitario': float(segundo.precio_unitario),
-                    'observacion': segundo.observacion or ''
-                })
-            
-            # Agregar extras
-            for extra in pedido.extras.all():
-                productos.append({
-                    'tipo': 'Extra',
-                    'componentes': [
-                        extra.extra.nombre_plato
-                    ],
-                    'cantidad': extra.cantidad,
-                    'precio_unitario': float(extra.precio_unitario),
-                    'observacion': extra.observacion or ''
-                })
-            
-            pedidos_data.append({
-                'id': pedido.id,
-                'numero_dia': pedido.numero_dia,
-                'numero_pedido_completo': pedido.numero_pedido_completo,
-                'tipo': pedido.tipo,
-                'forma_pago': pedido.forma_pago,
-                'fecha_creacion': pedido.fecha_creacion.isoformat(),
-                'mesa': pedido.numero_mesa,
-                'contacto': pedido.contacto,
-                'subtipo_reservado': pedido.subtipo_reservado,
-                'observaciones_generales': pedido.observaciones_generales,
-                'total': float(pedido.total_calculado),  # Usar total calculado que incluye extras
-                'productos': productos
-            })
+        # Serializar pedidos (productos y total desde el snapshot de cada pedido)
+        pedidos_data = serializar_pedidos(pedidos)
         
         return JsonResponse({
             'status': 'ok',
+            'version': version,
             'pedidos': pedidos_data,
             'cantidad': len(pedidos_data)
         })
@@ -1232,23 +784,14 @@ def obtener_pedidos_por_tipo(request):
 
 
 @require_http_methods(["GET"])
+@etag(etag_pedidos)
 def obtener_contadores_tabs(request):
     """Obtener contadores de pedidos para cada tab"""
     try:
-        # Obtener pedidos pendientes
-        pedidos = Pedido.objects.filter(estado='pendiente')
-        
-        # Contar por tipo
-        contadores = {
-            'todos': pedidos.count(),
-            'servirse': pedidos.filter(tipo='Servirse').count(),
-            'llevar': pedidos.filter(tipo='Llevar').count(),
-            'reservados': pedidos.filter(tipo='Reservado').count()
-        }
-        
+        # Contadores mantenidos en caché (ver pedidos.contadores): sin COUNT(*) por tab
         return JsonResponse({
             'status': 'ok',
-            'contadores': contadores
+            'contadores': obtener_contadores()
         })
         
     except Exception as e:
@@ -1256,75 +799,69 @@ def obtener_contadores_tabs(request):
 
 
 @require_http_methods(["GET"])
+@etag(etag_stock)
 def obtener_cantidades_modal(request):
-    """Obtener cantidades actualizadas para el modal de agregar productos"""
+    """Obtener cantidades actualizadas para el modal de agregar productos (desde la foto del stock)"""
     try:
-        hoy = date.today()
-        menu = MenuDia.objects.get(fecha=hoy)
-        
-        # Obtener sopas con cantidades
-        sopas = []
-        for sopa_dia in MenuDiaSopa.objects.filter(menu=menu):
-            sopas.append({
-                'id': sopa_dia.id,
-                'sopa_id': sopa_dia.sopa.id,
-                'nombre': sopa_dia.sopa.nombre_plato,
-                'cantidad_actual': sopa_dia.cantidad_actual,
-                'cantidad_configurada': sopa_dia.cantidad
-            })
+        stock = obtener_stock()
         
-        # Obtener segundos con cantidades
-        segundos = []
-        for segundo_dia in MenuDiaSegundo.objects.filter(menu=menu):
-            segundos.append({
-                'id': segundo_dia.id,
-                'segundo_id': segundo_dia.segundo.id,
-                'nombre': segundo_dia.segundo.nombre_plato,
-                'cantidad_actual': segundo_dia.cantidad_actual,
-                'cantidad_configurada': segundo_dia.cantidad
-            })
+        def filas_modal(filas, clave_plato):
+            return [{
+                'id': fila['id'],
+                clave_plato: fila['plato_id'],
+                'nombre': fila['nombre'],
+                'cantidad_actual': fila['cantidad_actual'],
+                'cantidad_configurada': fila['cantidad_configurada'],
+            } for fila in filas]
         
         return JsonResponse({
             'status': 'ok',
-            'sopas': sopas,
-            'segundos': segundos
+            'version': stock['version'],  # Para ordenar con los avisos 'stock_actualizado'
+            'sopas': filas_modal(stock['sopas'], 'sopa_id'),
+            'segundos': filas_modal(stock['segundos'], 'segundo_id')
         })
         
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)})
 
 
+@require_http_methods(["GET"])
+def estado_cola_impresion(request):
+    """
+    Estado de la cola de tickets de cocina: pendientes y latencia de envío.
+    """
+    return JsonResponse({'status': 'ok', 'cola': cola_tickets.estadisticas()})
+
+
 # ===== FUNCIONES WEBSOCKET =====
 
-def enviar_mensaje_websocket(tipo_mensaje, pedido_data):
+async def aenviar_mensaje_websocket(tipo_mensaje, pedido_data=None, **datos):
     """
-    Envía un mensaje WebSocket al grupo 'pedidos' para notificar cambios
-    
+    Envía un evento al grupo 'pedidos' (y a sus temas) para notificar cambios.
+
+    Pasa por el publicador (ver pedidos.publicador), que junta los de una
+    ventana corta en un solo 'pedidos_batch' y espera el group_send directo,
+    sin pasar por async_to_sync. Es el único camino para los eventos de pedidos.
+
     Args:
-        tipo_mensaje: 'pedido_creado' o 'pedido_actualizado'
-        pedido_data: Datos del pedido en formato JSON
+        tipo_mensaje: Tipo del evento (handler del consumer)
+        pedido_data: Datos del pedido en formato JSON (opcional)
+        **datos: Campos adicionales del mensaje (p. ej. pedidos_ids, o
+            tipo_anterior si el pedido cambió de tipo: ver pedidos.temas)
+
+    Cada envío lleva la versión de cambios actual y los contadores de
+    pendientes por tipo, para que las tablets actualicen las cards y las tabs
+    en el lugar, sin volver a consultarlas (el stock llega aparte, en
+    'stock_actualizado': ver pedidos.temas.mensaje_stock). Además recibe un
+    número de secuencia y queda en el registro de eventos (ver pedidos.eventos).
     """
-    from channels.layers import get_channel_layer
-    from asgiref.sync import async_to_sync
-    
-    try:
-        channel_layer = get_channel_layer()
-        if channel_layer:
-            async_to_sync(channel_layer.group_send)(
-                "pedidos",
-                {
-                    "type": tipo_mensaje,
-                    "pedido": pedido_data
-                }
-            )
-            print(f"[WEBSOCKET] Mensaje enviado: {tipo_mensaje}")
-        else:
-            print("[WEBSOCKET] No hay channel layer configurado")
-    except Exception as e:
-        print(f"[WEBSOCKET] Error al enviar mensaje: {e}")
+    mensaje = {"type": tipo_mensaje, **datos}
+    if pedido_data is not None:
+        mensaje["pedido"] = pedido_data
+    await publicador_pedidos().publicar(mensaje)
 
 
-def enviar_trabajo_impresion(pedido, contenido, es_agregar_productos):
+def enviar_trabajo_impresion(pedido, contenido, es_agregar_productos, pedido_data=None):
     """
     Envía un trabajo de impresión al grupo 'impresion' para la tablet
     
@@ -1332,6 +869,7 @@ def enviar_trabajo_impresion(pedido, contenido, es_agregar_productos):
         pedido: Instancia del modelo Pedido
         contenido: Lista de líneas para imprimir
         es_agregar_productos: bool indicando si son productos adicionales
+        pedido_data: Pedido ya serializado (opcional, evita volver a consultarlo)
     """
     from channels.layers import get_channel_layer
     from asgiref.sync import async_to_sync
@@ -1340,7 +878,7 @@ def enviar_trabajo_impresion(pedido, contenido, es_agregar_productos):
     try:
         payload = {
             "type": "print_job",
-            "pedido": serializar_pedido_para_websocket(pedido),
+            "pedido": pedido_data or serializar_pedido_para_websocket(pedido),
             "contenido": contenido,
             "es_agregar_productos": es_agregar_productos,
         }
@@ -1365,19 +903,21 @@ def enviar_trabajo_impresion(pedido, contenido, es_agregar_productos):
         print(f"[WEBSOCKET] Error al enviar trabajo de impresión: {e}")
 
 
-def serializar_pedido_para_websocket(pedido):
+def serializar_pedido_para_websocket(pedido, productos=None):
     """
     Serializa un pedido para enviarlo por WebSocket
     
     Args:
         pedido: Instancia del modelo Pedido
+        productos: Productos ya serializados (opcional, evita volver a consultarlos)
         
     Returns:
         dict: Datos del pedido en formato JSON
     """
     try:
         # Obtener productos del pedido
-        productos = obtener_productos_pedido(pedido)
+        if productos is None:
+            productos = productos_de_pedido(pedido)
         
         return {
             'id': pedido.id,
@@ -1385,14 +925,17 @@ def serializar_pedido_para_websocket(pedido):
             'numero_pedido_completo': pedido.numero_pedido_completo,
             'tipo': pedido.tipo,
             'subtipo': pedido.subtipo_reservado,
+            'subtipo_reservado': pedido.subtipo_reservado,
             'forma_pago': pedido.forma_pago,
             'total': float(pedido.total),
             'estado_pedido': pedido.estado,
+            'estado': pedido.estado,
             'fecha_creacion': pedido.fecha_creacion.isoformat(),
             'contacto': pedido.contacto,
             'observaciones_generales': pedido.observaciones_generales,
             'mesa': pedido.numero_mesa,
-            'productos': productos
+            'productos': productos,
+            'version': pedido.version,  # Para que la tablet descarte eventos viejos
         }
     except Exception as e:
         print(f"[WEBSOCKET] Error al serializar pedido: {e}")
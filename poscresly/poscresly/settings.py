@@ -194,4 +194,23 @@ else:
         }
     }
 
+# Ventana (ms) en la que se juntan los eventos de pedidos en un solo mensaje
+# 'pedidos_batch' del WebSocket (ver pedidos.publicador). 0 = enviar cada uno
+WS_VENTANA_AGRUPACION_MS = int(os.getenv('WS_VENTANA_AGRUPACION_MS', '75'))
+
+# Caché (respuestas idempotentes de pedidos y otros datos de corta vida)
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
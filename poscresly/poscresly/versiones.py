@@ -0,0 +1,51 @@
+"""
+Contadores de versión en la caché, compartidos por los procesos.
+
+Los usan el catálogo y el stock del menú, las versiones de datos de los ETag y
+la secuencia de eventos del WebSocket: una clave con un entero que se
+incrementa con cada cambio y que los lectores comparan con lo que tienen.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def _valor_inicial():
+    # Si la caché se vació se parte de un valor nuevo, para que ninguna copia,
+    # ETag o número anterior coincida por casualidad. En milisegundos porque
+    # algunos viajan a las tablets y JavaScript solo representa enteros
+    # exactos hasta 2**53
+    return time.time_ns() // 1_000_000
+
+
+class ContadorVersion:
+    """Contador de versión guardado en la caché bajo `clave`."""
+
+    def __init__(self, clave):
+        self.clave = clave
+
+    def actual(self):
+        version = cache.get(self.clave)
+        if version is None:
+            cache.add(self.clave, _valor_inicial(), None)
+            version = cache.get(self.clave)
+        return version
+
+    def incrementar(self):
+        """Incrementa el contador y retorna el valor nuevo."""
+        try:
+            return cache.incr(self.clave)
+        except ValueError:
+            version = _valor_inicial()
+            cache.set(self.clave, version, None)
+            return version
+
+    def invalidar(self, **kwargs):
+        """
+        Incrementa de inmediato y otra vez al confirmar la transacción, para
+        que lo armado antes del commit (sin el cambio) no quede como vigente.
+        Sirve como receptor de señales.
+        """
+        self.incrementar()
+        transaction.on_commit(self.incrementar)
@@ -101,6 +101,8 @@ class WebSocketManager {
     this.maxReconnectAttempts = 5;
     this.reconnectDelay = 1000; // 1 segundo
     this.isConnected = false;
+    this.ultimoSeq = null; // Número del último evento recibido (para reanudar al reconectar)
+    this.claves = null; // Tabla de claves abreviadas (solo con msgpack)
   }
 
   connect() {
@@ -108,11 +110,19 @@ class WebSocketManager {
       // Construir URL del WebSocket
       const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
       const host = window.location.host;
-      const wsUrl = `${protocol}//${host}/ws/pedidos/`;
+      // Al reconectar se informa el último evento visto: el servidor reenvía
+      // solo los perdidos (o la foto completa si ya no los tiene)
+      const reanudar = this.ultimoSeq !== null ? `?ultimo_seq=${this.ultimoSeq}` : '';
+      const wsUrl = `${protocol}//${host}/ws/pedidos/${reanudar}`;
       
       console.log('[WEBSOCKET] Conectando a:', wsUrl);
       
-      this.socket = new WebSocket(wsUrl);
+      // Con la librería msgpack cargada se ofrece el formato binario compacto;
+      // si el servidor no lo acepta, los mensajes siguen llegando en JSON
+      const subprotocolos = window.MessagePack ? ['cresly.msgpack.v1'] : [];
+      this.claves = null;
+      this.socket = new WebSocket(wsUrl, subprotocolos);
+      this.socket.binaryType = 'arraybuffer';
       
       // Eventos del WebSocket
       this.socket.onopen = (event) => {
@@ -120,6 +130,10 @@ class WebSocketManager {
         this.isConnected = true;
         this.reconnectAttempts = 0;
         this.showConnectionStatus('Conectado', 'success');
+        // Cantidades del menú: se cargan una vez por conexión y después llegan por eventos
+        if (typeof cargarStockInicial === 'function') {
+          cargarStockInicial();
+        }
       };
       
       this.socket.onmessage = (event) => {
@@ -144,11 +158,57 @@ class WebSocketManager {
     }
   }
 
+  decodificarMensaje(contenido) {
+    if (typeof contenido === 'string') {
+      return JSON.parse(contenido);
+    }
+    const data = window.MessagePack.decode(new Uint8Array(contenido));
+    if (this.claves === null) {
+      // El primer mensaje (connection_established) va sin abreviar y trae la tabla
+      this.claves = data.claves || {};
+      return data;
+    }
+    return this.expandirClaves(data);
+  }
+
+  expandirClaves(valor) {
+    if (Array.isArray(valor)) {
+      return valor.map(item => this.expandirClaves(item));
+    }
+    if (valor && typeof valor === 'object') {
+      const expandido = {};
+      Object.entries(valor).forEach(([clave, item]) => {
+        expandido[this.claves[clave] || clave] = this.expandirClaves(item);
+      });
+      return expandido;
+    }
+    return valor;
+  }
+
   handleMessage(event) {
     try {
-      const data = JSON.parse(event.data);
+      const data = this.decodificarMensaje(event.data);
       console.log('[WEBSOCKET] Mensaje recibido:', data);
       
+      if (typeof data.seq === 'number') {
+        this.ultimoSeq = this.ultimoSeq === null ? data.seq : Math.max(this.ultimoSeq, data.seq);
+      }
+      this.reenviado = !!data.reenviado;
+      
+      // Los eventos de pedidos traen los contadores de las tabs ya calculados
+      if (data.contadores) {
+        this.ultimosContadores = data.contadores;
+        if (typeof aplicarContadoresTabs === 'function') {
+          aplicarContadoresTabs(data.contadores);
+        }
+      }
+      
+      // Cantidades del menú: 'stock_actualizado' trae solo las filas que
+      // cambiaron (dentro de un lote se aplica en handlePedidosBatch)
+      if (data.stock && typeof aplicarStock === 'function') {
+        aplicarStock(data.stock);
+      }
+      
       switch (data.type) {
         case 'connection_established':
           console.log('[WEBSOCKET] Conexión establecida:', data.message);
@@ -170,10 +230,22 @@ class WebSocketManager {
           this.handlePedidosMarcadosCompletados(data);
           break;
           
-        case 'pedidos_data':
-          this.handlePedidosData(data.pedidos);
+        case 'stock_actualizado':
+          // Ya aplicado arriba
           break;
           
+        case 'pedidos_batch':
+          this.handlePedidosBatch(data.eventos || []);
+          break;
+          
+        case 'pedidos_data':
+          this.handlePedidosData(data);
+          break;
+
+        case 'contadores_actualizados':
+          // Llegan después de la foto; ya se aplicaron arriba
+          break;
+
         case 'error':
           console.error('[WEBSOCKET] Error del servidor:', data.message);
           break;
@@ -192,8 +264,8 @@ class WebSocketManager {
     // Mostrar notificación
     this.showNotification('Nuevo pedido creado', `Pedido #${pedido.numero_pedido_completo}`, 'success');
     
-    // Recargar la lista de pedidos
-    this.reloadPedidos();
+    // Insertar la card en la lista (o recargar fuera de la página de inicio)
+    this.aplicarPedido(pedido);
   }
 
   handlePedidoActualizado(pedido) {
@@ -202,8 +274,8 @@ class WebSocketManager {
     // Mostrar notificación
     this.showNotification('Pedido actualizado', `Pedido #${pedido.numero_pedido_completo}`, 'info');
     
-    // Recargar la lista de pedidos
-    this.reloadPedidos();
+    // Reemplazar la card (o quitarla si se completó o cambió de tipo)
+    this.aplicarPedido(pedido);
   }
 
   handlePedidoEliminado(pedido) {
@@ -212,8 +284,8 @@ class WebSocketManager {
     // Mostrar notificación
     this.showNotification('Pedido eliminado', `Pedido #${pedido.numero_pedido_completo}`, 'warning');
     
-    // Recargar la lista de pedidos
-    this.reloadPedidos();
+    // Quitar la card de la lista
+    this.quitarPedidos([pedido.id]);
   }
 
   handlePedidosMarcadosCompletados(data) {
@@ -226,13 +298,145 @@ class WebSocketManager {
       'success'
     );
     
-    // Recargar la lista de pedidos
-    this.reloadPedidos();
+    // Quitar las cards de los pedidos completados
+    this.quitarPedidos(data.pedidos_ids || []);
   }
 
-  handlePedidosData(pedidos) {
-    console.log('[WEBSOCKET] Datos de pedidos recibidos:', pedidos);
-    // Aquí podrías actualizar la interfaz directamente sin recargar
+  handlePedidosBatch(eventos) {
+    // Eventos juntados por el servidor en una ventana corta: los contadores
+    // ya vienen una sola vez en el mensaje, cada evento se aplica en orden
+    console.log('[WEBSOCKET] Lote de eventos:', eventos.length);
+    eventos.forEach(evento => {
+      switch (evento.type) {
+        case 'pedido_creado':
+          this.handlePedidoCreado(evento.pedido);
+          break;
+        case 'pedido_actualizado':
+          this.handlePedidoActualizado(evento.pedido);
+          break;
+        case 'pedido_eliminado':
+          this.handlePedidoEliminado(evento.pedido);
+          break;
+        case 'pedidos_marcados_completados':
+          this.handlePedidosMarcadosCompletados(evento);
+          break;
+        case 'stock_actualizado':
+          if (typeof aplicarStock === 'function') {
+            aplicarStock(evento.stock);
+          }
+          break;
+        default:
+          console.log('[WEBSOCKET] Tipo de evento desconocido en el lote:', evento.type);
+      }
+    });
+  }
+
+  handlePedidosData(data) {
+    console.log('[WEBSOCKET] Foto de pedidos recibida:', data.pedidos, 'versión:', data.version);
+    // La foto queda como lista base de cada tab: al cambiar de tab solo se
+    // piden los cambios desde esta versión (?since=)
+    if (typeof combinarPedidosPorTipo !== 'function') {
+      return;
+    }
+    const habiaListas = window.pedidosPorTipo && Object.keys(window.pedidosPorTipo).length > 0;
+    const tipos = { todos: null, servirse: 'Servirse', llevar: 'Llevar', reservados: 'Reservado' };
+    Object.entries(tipos).forEach(([tab, tipo]) => {
+      const pedidos = tipo ? data.pedidos.filter(pedido => pedido.tipo === tipo) : data.pedidos;
+      combinarPedidosPorTipo(tab, { version: data.version, pedidos });
+    });
+
+    // Reconexión sin los eventos perdidos: se vuelve a dibujar la tab actual desde la foto
+    if (habiaListas && typeof cargarPedidosPorTipo === 'function') {
+      cargarPedidosPorTipo(window.tipoActual || 'todos');
+    }
+  }
+
+  puedeParchear() {
+    // Solo en la página de inicio (lista de cards y funciones de inicio.html)
+    return !!document.getElementById('contenedor-cards-pedidos') &&
+      typeof crearCardPedidoDesdeBD === 'function' &&
+      typeof agregarEventosCardPedido === 'function';
+  }
+
+  perteneceATab(pedido, tab) {
+    const tipos = { servirse: 'Servirse', llevar: 'Llevar', reservados: 'Reservado' };
+    const estado = pedido.estado || pedido.estado_pedido;
+    return estado === 'pendiente' && (tab === 'todos' || tipos[tab] === pedido.tipo);
+  }
+
+  aplicarPedido(pedido) {
+    if (!this.puedeParchear()) {
+      this.reloadPedidos();
+      return;
+    }
+
+    // Listas guardadas por tab (ver combinarPedidosPorTipo): se descarta el
+    // evento si ya tenemos una versión igual o más nueva del pedido
+    const listas = window.pedidosPorTipo || {};
+    const guardado = listas.todos && listas.todos.pedidos.get(pedido.id);
+    if (guardado && guardado.version && pedido.version && guardado.version >= pedido.version) {
+      console.log('[WEBSOCKET] Evento viejo descartado para el pedido', pedido.id);
+      return;
+    }
+    Object.entries(listas).forEach(([tab, lista]) => {
+      if (this.perteneceATab(pedido, tab)) {
+        lista.pedidos.set(pedido.id, pedido);
+      } else {
+        lista.pedidos.delete(pedido.id);
+      }
+    });
+
+    const contenedor = document.getElementById('contenedor-cards-pedidos');
+    const card = contenedor.querySelector(`.pedido-card[data-pedido-id="${pedido.id}"]`);
+    const columna = card ? card.parentElement : null;
+
+    if (!this.perteneceATab(pedido, window.tipoActual || 'todos')) {
+      if (columna) {
+        columna.remove();
+      }
+      return;
+    }
+
+    const plantilla = document.createElement('template');
+    plantilla.innerHTML = crearCardPedidoDesdeBD(pedido).trim();
+    const nuevaColumna = plantilla.content.firstElementChild;
+
+    if (columna) {
+      // Misma posición: solo cambia el contenido de la card
+      columna.replaceWith(nuevaColumna);
+    } else {
+      // Pedido nuevo en esta tab: los más recientes van primero
+      const fecha = new Date(pedido.fecha_creacion);
+      const siguiente = Array.from(contenedor.querySelectorAll('.pedido-card')).find(otra => {
+        const otroPedido = listas.todos && listas.todos.pedidos.get(Number(otra.dataset.pedidoId));
+        return otroPedido && new Date(otroPedido.fecha_creacion) < fecha;
+      });
+      if (siguiente) {
+        contenedor.insertBefore(nuevaColumna, siguiente.parentElement);
+      } else if (listas.todos) {
+        contenedor.appendChild(nuevaColumna);
+      } else {
+        contenedor.prepend(nuevaColumna);
+      }
+    }
+    agregarEventosCardPedido(nuevaColumna);
+  }
+
+  quitarPedidos(ids) {
+    if (!this.puedeParchear()) {
+      this.reloadPedidos();
+      return;
+    }
+
+    const listas = window.pedidosPorTipo || {};
+    const contenedor = document.getElementById('contenedor-cards-pedidos');
+    ids.map(Number).forEach(id => {
+      Object.values(listas).forEach(lista => lista.pedidos.delete(id));
+      const card = contenedor.querySelector(`.pedido-card[data-pedido-id="${id}"]`);
+      if (card && card.parentElement) {
+        card.parentElement.remove();
+      }
+    });
   }
 
   reloadPedidos() {
@@ -268,13 +472,19 @@ class WebSocketManager {
     // Actualizar solo los contadores de tabs sin recargar la página
     console.log('[WEBSOCKET] Actualizando contadores...');
     
-    // Llamar a la función existente para actualizar contadores
-    if (typeof actualizarContadoresTabs === 'function') {
+    // Si el evento ya trajo los contadores no hace falta consultarlos
+    if (this.ultimosContadores && typeof aplicarContadoresTabs === 'function') {
+      aplicarContadoresTabs(this.ultimosContadores);
+    } else if (typeof actualizarContadoresTabs === 'function') {
       actualizarContadoresTabs();
     }
   }
 
   showNotification(title, message, type = 'info') {
+    // Los eventos reenviados al reconectar no vuelven a avisar
+    if (this.reenviado) {
+      return;
+    }
     // Crear notificación visual
     const notification = document.createElement('div');
     notification.className = `alert alert-${type} alert-dismissible fade show position-fixed`;
@@ -0,0 +1,101 @@
+/*
+ * Decodificador msgpack para el WebSocket de pedidos (window.MessagePack.decode).
+ *
+ * Se sirve desde static para que las tablets no dependan de un CDN. Cubre lo
+ * que envía el servidor (msgpack de Python: nil, booleanos, enteros, floats,
+ * textos, binarios, arrays y mapas); las extensiones no se usan.
+ */
+(function (global) {
+  'use strict';
+
+  const textDecoder = new TextDecoder('utf-8');
+
+  function decode(bytes) {
+    const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+    let pos = 0;
+
+    function texto(longitud) {
+      const valor = textDecoder.decode(bytes.subarray(pos, pos + longitud));
+      pos += longitud;
+      return valor;
+    }
+
+    function binario(longitud) {
+      const valor = bytes.slice(pos, pos + longitud);
+      pos += longitud;
+      return valor;
+    }
+
+    function array(longitud) {
+      const valor = new Array(longitud);
+      for (let i = 0; i < longitud; i++) {
+        valor[i] = leer();
+      }
+      return valor;
+    }
+
+    function mapa(longitud) {
+      const valor = {};
+      for (let i = 0; i < longitud; i++) {
+        const clave = leer();
+        valor[clave] = leer();
+      }
+      return valor;
+    }
+
+    function entero64(conSigno) {
+      // Los números de secuencia y versiones entran en 2**53 (exactos en JavaScript)
+      const alto = conSigno ? view.getInt32(pos) : view.getUint32(pos);
+      const bajo = view.getUint32(pos + 4);
+      pos += 8;
+      return alto * 4294967296 + bajo;
+    }
+
+    function leer() {
+      const tipo = view.getUint8(pos++);
+      let valor;
+
+      if (tipo <= 0x7f) return tipo;
+      if (tipo <= 0x8f) return mapa(tipo & 0x0f);
+      if (tipo <= 0x9f) return array(tipo & 0x0f);
+      if (tipo <= 0xbf) return texto(tipo & 0x1f);
+      if (tipo >= 0xe0) return tipo - 0x100;
+
+      switch (tipo) {
+        case 0xc0: return null;
+        case 0xc2: return false;
+        case 0xc3: return true;
+        case 0xc4: valor = view.getUint8(pos); pos += 1; return binario(valor);
+        case 0xc5: valor = view.getUint16(pos); pos += 2; return binario(valor);
+        case 0xc6: valor = view.getUint32(pos); pos += 4; return binario(valor);
+        case 0xca: valor = view.getFloat32(pos); pos += 4; return valor;
+        case 0xcb: valor = view.getFloat64(pos); pos += 8; return valor;
+        case 0xcc: valor = view.getUint8(pos); pos += 1; return valor;
+        case 0xcd: valor = view.getUint16(pos); pos += 2; return valor;
+        case 0xce: valor = view.getUint32(pos); pos += 4; return valor;
+        case 0xcf: return entero64(false);
+        case 0xd0: valor = view.getInt8(pos); pos += 1; return valor;
+        case 0xd1: valor = view.getInt16(pos); pos += 2; return valor;
+        case 0xd2: valor = view.getInt32(pos); pos += 4; return valor;
+        case 0xd3: return entero64(true);
+        case 0xd9: valor = view.getUint8(pos); pos += 1; return texto(valor);
+        case 0xda: valor = view.getUint16(pos); pos += 2; return texto(valor);
+        case 0xdb: valor = view.getUint32(pos); pos += 4; return texto(valor);
+        case 0xdc: valor = view.getUint16(pos); pos += 2; return array(valor);
+        case 0xdd: valor = view.getUint32(pos); pos += 4; return array(valor);
+        case 0xde: valor = view.getUint16(pos); pos += 2; return mapa(valor);
+        case 0xdf: valor = view.getUint32(pos); pos += 4; return mapa(valor);
+        default:
+          throw new Error('msgpack: tipo no soportado 0x' + tipo.toString(16));
+      }
+    }
+
+    const resultado = leer();
+    if (pos !== bytes.byteLength) {
+      throw new Error('msgpack: sobran bytes al final del mensaje');
+    }
+    return resultado;
+  }
+
+  global.MessagePack = { decode: decode };
+})(typeof window !== 'undefined' ? window : globalThis);